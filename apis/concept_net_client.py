@@ -17,10 +17,24 @@ This wrapper has been portet to ConceptNet5 by Tim Daubenschuetz
 """
 import sys
 import os.path
+import random
+import time
 
 import urllib, urllib2
+from threading import Lock
+from concurrent.futures import as_completed
+from requests.exceptions import ConnectionError
+from requests.exceptions import HTTPError
+from requests.exceptions import Timeout
 from requests_futures.sessions import FuturesSession
 from ..utils.utils import get_config
+from ..utils.utils import extr_from_concept_net_edge
+from ..utils.metrics import get_metrics
+from ..utils.single_flight import SingleFlight
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.circuit_breaker import CircuitOpenError
+from .edge_cache import get_edge_cache
+from .graph_store import GraphStore
 
 try:
     import json
@@ -35,6 +49,28 @@ API_URL = get_config('conceptnet5_parameters', 'API_URL')
 CONCEPT_NET_VERSION = get_config('conceptnet5_parameters', 'VERSION')
 REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT')
 
+# Connection pool and timeout (in seconds) used by ConceptNetClient
+POOL_SIZE = get_config('conceptnet5_parameters', 'POOL_SIZE', 'getint', 10)
+TIMEOUT = get_config('conceptnet5_parameters', 'TIMEOUT', 'getfloat', 10.0)
+# Number of times a request that failed transiently is repeated
+RETRIES = get_config('conceptnet5_parameters', 'RETRIES', 'getint', 2)
+# Seconds before the first retry, doubled for every further one
+RETRY_BACKOFF = get_config('conceptnet5_parameters', 'RETRY_BACKOFF', 'getfloat', 0.2)
+# Number of consecutive failures after which requests fail right away, 0 never gives up
+BREAKER_THRESHOLD = get_config('conceptnet5_parameters', 'BREAKER_THRESHOLD', 'getint', 5)
+# Seconds after which a request is tried again once the breaker opened
+BREAKER_RESET = get_config('conceptnet5_parameters', 'BREAKER_RESET', 'getfloat', 30.0)
+
+# Lookups are either sent to ConceptNet's web-API ('http') or answered by a GraphStore ('offline')
+BACKEND = get_config('conceptnet5_parameters', 'BACKEND', 'get', 'http')
+GRAPH_STORE = get_config('conceptnet5_parameters', 'GRAPH_STORE', 'get', './conceptnet.graph')
+
+# Concurrent lookups of the same concept by the same client are only sent once
+_lookup_flights = SingleFlight('lookup')
+
+_lookup_failures = 0
+_lookup_failures_lock = Lock()
+
 TYPES = {
     'assertion': 'a',
     'concept': 'c',
@@ -47,7 +83,198 @@ TYPES = {
     'or': 'or'
 }
 
-def lookup(type, language, key):
+class ConceptNetClient(object):
+    """
+    A client that keeps a pool of persistent (keep-alive) connections to ConceptNet's web-API.
+
+    Opening a new connection for every lookup makes TCP setup the most expensive
+    part of a graph search. A ConceptNetClient reuses its connections and is able to
+    run up to pool_size requests at the same time.
+
+    Requests that fail transiently (connection errors, timeouts, 429 and 5xx responses)
+    are retried with exponential backoff. If they keep failing, a circuit breaker makes
+    further requests fail right away, instead of every search waiting for its timeouts.
+    """
+
+    # results of a remote backend are worth caching
+    remote = True
+
+    def __init__(self, api_url=None, version=None, req_limit=None, pool_size=POOL_SIZE, timeout=TIMEOUT,
+            retries=RETRIES, backoff=RETRY_BACKOFF, breaker=None):
+        self.api_url = api_url or API_URL
+        self.version = version or CONCEPT_NET_VERSION
+        self.req_limit = req_limit or REQ_LIMIT
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+        # FuturesSession mounts an adapter whose pool holds as many connections as it has workers
+        self.session = FuturesSession(max_workers=pool_size)
+
+    def build_url(self, *url_parts):
+        return self.api_url + '/' + self.version + '/' + '/'.join(urllib2.quote(p.encode('utf-8')) for p in url_parts) + '?limit=' + str(self.req_limit)
+
+    def get_url(self, url, timeout=None):
+        """
+        Requests an url using one of the pooled connections and returns its body.
+        Transient failures are retried, see retry.
+        """
+        return self.retry(lambda: self.get_url_async(url, timeout).result().content)
+
+    def retry(self, request, attempts=0):
+        """
+        Returns request() and repeats it while it fails transiently, until retries
+        attempts have failed in addition to the first one. attempts counts the ones
+        that already failed before. The breaker is asked before every attempt and
+        told about its outcome.
+        """
+        while True:
+            if attempts:
+                # jitter keeps the workers of a burst from retrying all at the same time
+                time.sleep(self.backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.5))
+            self.breaker.check()
+            try:
+                content = request()
+            except Exception as e:
+                if not is_transient(e):
+                    # ConceptNet answered (e.g. 404), which ends a trial of a half-open breaker as well
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                attempts += 1
+                if attempts > self.retries:
+                    raise
+            else:
+                self.breaker.success()
+                return content
+
+    def get_url_async(self, url, timeout=None):
+        """
+        Requests an url in the background and returns a future of its response.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.get(url, timeout=timeout, hooks={'response': _raise_for_status})
+
+    def get_json(self, *url_parts, **kwargs):
+        return json.loads(self.get_url(self.build_url(*url_parts), kwargs.get('timeout')))
+
+    def lookup(self, type, language, key, timeout=None):
+        """
+        Same as the module's lookup function, but using this client's connections.
+        """
+        url = self.build_url(_to_type(type), language, key.lower())
+        metrics = get_metrics()
+        if not metrics.enabled:
+            return json.loads(self.get_url(url, timeout))
+        started = time.time()
+        content = self.get_url(url, timeout)
+        received = time.time()
+        res = json.loads(content)
+        metrics.increment('conceptnet_requests_total')
+        metrics.observe('conceptnet_request_seconds', received - started)
+        metrics.observe('conceptnet_decode_seconds', time.time() - received)
+        return res
+
+    def lookup_many(self, type, language, keys, timeout=None):
+        """
+        Looks up a list of keys of the same type and language concurrently.
+
+        This is a generator that yields (key, result, error) tuples in the order the
+        lookups complete. If a lookup failed, result is None and error holds the exception.
+        """
+        type = _to_type(type)
+        urls = dict((self.build_url(type, language, k.lower()), k) for k in keys)
+        futures = {}
+        rejected = []
+        for url, key in urls.items():
+            # The breaker is asked for every request, so a half-open one lets a single trial through
+            try:
+                self.breaker.check()
+            except CircuitOpenError as e:
+                rejected.append((key, e))
+                continue
+            futures[self.get_url_async(url, timeout)] = url
+        for key, e in rejected:
+            yield key, None, e
+        metrics = get_metrics()
+        for future in as_completed(futures):
+            url = futures[future]
+            key = urls[url]
+            try:
+                try:
+                    content = future.result().content
+                except Exception as e:
+                    if not is_transient(e):
+                        # ConceptNet answered (e.g. 404), which ends a trial of a half-open breaker as well
+                        self.breaker.success()
+                        raise
+                    self.breaker.failure()
+                    if not self.retries:
+                        raise
+                    # the failed request is repeated on its own
+                    content = self.retry(lambda: self.get_url_async(url, timeout).result().content, 1)
+                else:
+                    self.breaker.success()
+                if metrics.enabled:
+                    # the requests overlap, hence only their decoding is timed
+                    started = time.time()
+                    res = json.loads(content)
+                    metrics.increment('conceptnet_requests_total')
+                    metrics.observe('conceptnet_decode_seconds', time.time() - started)
+                else:
+                    res = json.loads(content)
+                yield key, res, None
+            except Exception as e:
+                yield key, None, e
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+_default_client = None
+_default_client_lock = Lock()
+_web_client = None
+
+def get_client():
+    """
+    Returns the client that is shared by all module-level lookups.
+    Depending on BACKEND, this is either a ConceptNetClient or a GraphStore.
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                if BACKEND == 'offline':
+                    _default_client = GraphStore(GRAPH_STORE)
+                else:
+                    _default_client = ConceptNetClient()
+    return _default_client
+
+def get_web_client():
+    """
+    Returns a client of ConceptNet's web-API for the helpers below that request other
+    resources than concepts. The shared client is used, unless it is not able to request
+    urls, e.g. a GraphStore, which only answers concept lookups. In that case, a
+    ConceptNetClient is created on first use.
+    """
+    global _web_client
+    client = get_client()
+    if hasattr(client, 'get_url'):
+        return client
+    if _web_client is None:
+        with _default_client_lock:
+            if _web_client is None:
+                _web_client = ConceptNetClient()
+    return _web_client
+
+def set_client(client):
+    """
+    Replaces the shared client, e.g. by one pointing to a local stub server or a GraphStore.
+    """
+    global _default_client
+    _default_client = client
+
+def lookup(type, language, key, client=None):
     """
     Get an object of a certain *type*, specified by the code for what
     *language* it is in and its *key*. The types currently supported are:
@@ -73,12 +300,66 @@ def lookup(type, language, key):
     
     The object will be returned as a dictionary, or in the case of features,
     a list.
+
+    If no client is given, the shared ConceptNetClient is used.
+
+    Concepts are answered from the edge cache, if they have been looked up before
+    by a client with the same limit of edges.
+    If a remote client is already looking up the same key, its result is shared instead
+    of sending the same request again.
+    """
+    type = _to_type(type)
+    key = key.lower()
+    client = client or get_client()
+    edge_cache = get_edge_cache() if type == 'c' and client.remote else None
+    # the cache only holds lookups of its own limit, results of other limits have other lengths
+    if edge_cache is not None and int(client.req_limit) != edge_cache.req_limit:
+        edge_cache = None
+    if edge_cache is not None:
+        res = edge_cache.get(type, language, key)
+        metrics = get_metrics()
+        if metrics.enabled:
+            metrics.increment('edge_cache_hits_total' if res is not None else 'edge_cache_misses_total')
+        if res is not None:
+            return res
+    if not client.remote:
+        return client.lookup(type, language, key)
+    return _lookup_flights.do((id(client), type, language, key), _lookup_and_cache, client, edge_cache, type, language, key)
+
+def _lookup_and_cache(client, edge_cache, type, language, key):
+    global _lookup_failures
+    try:
+        res = client.lookup(type, language, key)
+    except Exception:
+        with _lookup_failures_lock:
+            _lookup_failures += 1
+        raise
+    if edge_cache is not None:
+        edge_cache.put(type, language, key, res)
+    return res
+
+def lookup_failures():
+    """
+    Returns the number of lookups of remote clients that have failed so far,
+    including the ones a circuit breaker did not let through.
+    """
+    return _lookup_failures
+
+def is_transient(e):
+    """
+    Returns whether a request that failed with an exception is worth repeating.
     """
+    if isinstance(e, HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status == 429 or (status is not None and status >= 500)
+    return isinstance(e, (ConnectionError, Timeout))
+
+def _to_type(type):
     if type == None: 
         raise Exception('Type must be specified to request the web api.')
     if len(type) > 1: 
         type = from_name_to_type(type)
-    return _get_json(type, language, key.lower())
+    return type
 
 def from_name_to_type(type='concept'):
     try:
@@ -159,6 +440,29 @@ def surface_forms_for_concept(concept, limit=20):
     """
     return _refine_json(concept, 'surfaceforms', 'limit:%d' % limit)
 
+def neighbours_for_concept(language, concept_name, min_weight=None):
+    """
+    Given a concept's name, look up the concepts it is connected to in the same language.
+
+    Returns a list of (name, rel, weight) tuples in the order ConceptNet returned the edges.
+    If min_weight is given, only edges heavier than it are returned.
+    """
+    res = lookup('concept', language, concept_name)
+    neighbours = []
+    if res is None or res.get('numFound', 0) == 0:
+        return neighbours
+    for e in res['edges']:
+        start = extr_from_concept_net_edge(e['start'])
+        end = extr_from_concept_net_edge(e['end'])
+        # edges are undirected, the neighbour is whichever side is not the concept itself
+        other = end if end['name'] != concept_name else start
+        if other['lang_code'] != language or other['name'] == concept_name:
+            continue
+        if min_weight is not None and not e['weight'] > min_weight:
+            continue
+        neighbours.append((other['name'], e['rel'], e['weight']))
+    return neighbours
+
 def votes_for(obj):
     """
     Given a dictionary representing any object that can be voted on -- such as
@@ -233,19 +537,19 @@ def _get_json(*url_parts):
     """
     This method has been updated and now uses ConceptNet5 syntax to access the web-API
     """
-    session = FuturesSession()
-    url = API_URL + '/' + CONCEPT_NET_VERSION + '/' + '/'.join(urllib2.quote(p.encode('utf-8')) for p in url_parts) + '?limit=' + REQ_LIMIT
     # print 'Looking up: ' + url
-    #return session.get(url)
-    return json.loads(_get_url(url))
+    return get_web_client().get_json(*url_parts)
 
 def _extend_url(old_url, *url_parts):
     url = old_url + '/'.join(urllib2.quote(str(p)) for p in url_parts) + '/'
     return json.loads(_get_url(url))
 
 def _get_url(url):
-    conn = urllib2.urlopen(url)
-    return conn.read()
+    return get_web_client().get_url(url)
+
+def _raise_for_status(response, *args, **kwargs):
+    # urllib2 used to raise on error codes, so the pooled client does as well
+    response.raise_for_status()
 
 def _refine_json(old_obj, *parts):
     return _extend_url(SERVER_URL + old_obj['resource_uri'], *parts)
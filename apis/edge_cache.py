@@ -0,0 +1,191 @@
+"""
+Caches the raw edges of ConceptNet concepts.
+
+CacheController only saves the final emotion-vector of a word. However,
+graph searches of different words share most of their intermediate concepts
+(e.g. 'c/en/person'). Therefore, the parsed edges of every concept that has been
+looked up are saved as well, so that the network is only asked for concepts that
+have never been expanded before.
+
+The cache consists of two levels:
+    * a bounded in-memory LRU cache; and
+    * a durable shelve on the hard drive.
+
+Concepts without any edges (typos, names, slang) are cached as well, so they fail fast
+instead of being looked up on every message. As ConceptNet may learn them later on,
+they expire after NEGATIVE_TTL seconds, independent of TTL.
+"""
+import atexit
+import shelve
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+from ..utils.utils import get_config
+
+EDGE_CACHE_ENABLED = get_config('edge_cache', 'ENABLED', 'getboolean', True)
+# Number of concepts held in memory
+EDGE_CACHE_SIZE = get_config('edge_cache', 'MAX_ENTRIES', 'getint', 10000)
+# Seconds after which a cached concept is looked up again, 0 keeps it forever
+EDGE_CACHE_TTL = get_config('edge_cache', 'TTL', 'getint', 0)
+# Seconds after which a concept without edges is looked up again, 0 keeps it forever
+EDGE_CACHE_NEGATIVE_TTL = get_config('edge_cache', 'NEGATIVE_TTL', 'getint', 86400)
+REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+
+class LRUCache(object):
+    """
+    A thread-safe dictionary that holds at most max_entries keys.
+    If it is full, the least recently used key is dropped.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return None
+            # re-inserting moves the key to the end, which is the most recently used position
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+class EdgeCache(object):
+    """
+    Saves ConceptNet lookup results by (type, lang_code, concept) in memory and on the hard drive.
+    """
+    def __init__(self, path=None, max_entries=EDGE_CACHE_SIZE, ttl=EDGE_CACHE_TTL, req_limit=REQ_LIMIT, persistent=True,
+            negative_ttl=EDGE_CACHE_NEGATIVE_TTL):
+        # lookups only return req_limit edges, hence every limit gets its own file,
+        # just like CacheController's word caches
+        self.path = path or './edge_cache_%d' % req_limit
+        self.req_limit = req_limit
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(max_entries)
+        # a shelve must not be written by several processes, those use the in-memory level only
+        self.store = shelve.open(self.path, protocol=2) if persistent else None
+        # shelve does not allow concurrent access
+        self.store_lock = Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, type, lang_code, name):
+        """
+        Returns the cached lookup result of a concept or None, if it is unknown or expired.
+        """
+        key = _cache_key(type, lang_code, name)
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory_hits += 1
+        elif self.store is not None:
+            with self.store_lock:
+                entry = self.store.get(key)
+            if entry is not None:
+                self.memory.put(key, entry)
+        if entry is None or self._expired(entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if _is_empty(entry[1]):
+            self.negative_hits += 1
+        return entry[1]
+
+    def put(self, type, lang_code, name, result):
+        """
+        Saves the result of a lookup.
+
+        Only the fields of the edges that are needed for a graph search are kept.
+        """
+        key = _cache_key(type, lang_code, name)
+        entry = (time.time(), strip_lookup_result(result))
+        self.memory.put(key, entry)
+        if self.store is not None:
+            with self.store_lock:
+                self.store[key] = entry
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'memory_entries': len(self.memory)
+        }
+
+    def close(self):
+        with self.store_lock:
+            if self.store is not None:
+                self.store.close()
+
+    def _expired(self, entry):
+        ttl = self.negative_ttl if _is_empty(entry[1]) else self.ttl
+        return ttl > 0 and time.time() - entry[0] > ttl
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def strip_lookup_result(result):
+    """
+    Reduces a concept's lookup result to the edges' start, end, rel and weight.
+    """
+    if result is None or 'edges' not in result:
+        return result
+    return {
+        'numFound': result['numFound'],
+        'edges': [{
+            'start': e['start'],
+            'end': e['end'],
+            'rel': e['rel'],
+            'weight': e['weight']
+        } for e in result['edges']]
+    }
+
+_edge_cache = None
+_edge_cache_lock = Lock()
+
+def get_edge_cache():
+    """
+    Returns the EdgeCache used by concept_net_client.lookup, or None if it is disabled.
+    """
+    global _edge_cache
+    if _edge_cache is None and EDGE_CACHE_ENABLED:
+        with _edge_cache_lock:
+            if _edge_cache is None:
+                _edge_cache = EdgeCache()
+                atexit.register(_edge_cache.close)
+    return _edge_cache
+
+def set_edge_cache(edge_cache):
+    """
+    Replaces the shared EdgeCache. Passing None disables caching of edges.
+    """
+    global _edge_cache, EDGE_CACHE_ENABLED
+    _edge_cache = edge_cache
+    EDGE_CACHE_ENABLED = edge_cache is not None
+
+def _is_empty(result):
+    return result is None or not result.get('edges')
+
+def _cache_key(type, lang_code, name):
+    # shelve only allows byte strings as keys
+    return ('%s/%s/%s' % (type, lang_code, name)).encode('utf8')
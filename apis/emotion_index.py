@@ -0,0 +1,162 @@
+"""
+A precomputed index of emotion-vectors for every concept close to an emotion.
+
+build_graph searches outwards from every token, hoping to find one of the EMOTIONS.
+Since there are only a few emotions, it is a lot cheaper to search the other way round:
+A breadth-first search starting at every emotion finds concepts that are able to reach it
+within MAX_DEPTH, and scores the path it took.
+
+The result is an approximation of build_graph: A concept only follows its own first REQ_LIMIT edges,
+so the search backwards may miss concepts that lead to an emotion. And of several paths, build_graph
+takes the one it comes across first when searching outwards from the token, which depends on the token.
+The index may thus lack emotions build_graph finds, or score them differently.
+
+The index is built once per parameter set:
+
+    python -m emotext.apis.emotion_index --language en
+
+Afterwards, the 'index' search strategy (SEARCH_MODE = index) looks up tokens in the index and
+only falls back to a breadth-first search for tokens that are missing. Its results are cached
+separately from the ones of the breadth-first search.
+"""
+import argparse
+import shelve
+import whichdb
+
+from threading import Lock
+
+from ..utils.utils import get_config
+from .concept_net_client import neighbours_for_concept
+from .text import EMOTIONS
+from .text import calc_path_weight
+from .text import calc_percentages
+
+MAX_DEPTH = get_config('graph_search', 'MAX_DEPTH', 'getint')
+MIN_WEIGHT = get_config('graph_search', 'MIN_WEIGHT', 'getint')
+REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+
+EMOTION_INDEX_ENABLED = get_config('emotion_index', 'ENABLED', 'getboolean', True)
+
+class EmotionIndex(object):
+    """
+    Read access to an index written by build_emotion_index.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = shelve.open(path, flag='r')
+        # shelve does not allow concurrent access
+        self.lock = Lock()
+
+    def fetch_word(self, word):
+        """
+        Returns the emotion-vector of a word or None, if the word is not part of the index.
+        """
+        with self.lock:
+            emotions = self.index.get(word.encode('utf8'))
+        if emotions is None:
+            return None
+        return {
+            'name': word,
+            'emotions': emotions
+        }
+
+    def __contains__(self, word):
+        with self.lock:
+            return word.encode('utf8') in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.index.close()
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def index_path(max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, req_limit=REQ_LIMIT, lang_code='en'):
+    # just like the word caches, every parameter set gets its own file
+    return './emotion_index_%s_%d_%d_%d' % (lang_code, max_depth, min_weight, req_limit)
+
+def build_emotion_index(lang_code='en', max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, req_limit=REQ_LIMIT, path=None):
+    """
+    Searches breadth-first from every emotion and writes the emotion-vector
+    of every concept that has been reached to an index.
+
+    Returns the number of indexed concepts.
+    """
+    # build_graph finds an emotion that is n edges away from a token on level n and then
+    # keeps scoring it on every following level, hence a path of length n is counted (max_depth - n) times.
+    # Emotions that are max_depth edges away are never scored.
+    vectors = {}
+    for emotion in sorted(EMOTIONS):
+        for name, weights in reverse_search(emotion, lang_code, max_depth - 1, min_weight):
+            emotions = vectors.setdefault(name, {})
+            emotions[emotion] = emotions.get(emotion, 0) + (max_depth - len(weights)) * calc_path_weight(weights)
+
+    index = shelve.open(path or index_path(max_depth, min_weight, req_limit, lang_code), flag='n', protocol=2)
+    for name, emotions in vectors.iteritems():
+        index[name.encode('utf8')] = calc_percentages(emotions)
+    index.close()
+    return len(vectors)
+
+def reverse_search(emotion, lang_code, max_hops, min_weight):
+    """
+    Searches breadth-first from an emotion and yields a (name, weights) tuple for every
+    concept within max_hops edges. weights are ordered from the emotion to the concept.
+
+    An edge is only followed if the concept it leads to returns it among its own edges, too,
+    as build_graph only searches the edges a lookup of a concept returns.
+    """
+    # build_graph never expands emotions, so paths cannot lead through other emotions
+    used_names = set([emotion])
+    frontier = [(emotion, ())]
+    # the weight of the first edge of every looked up concept to each of its neighbours
+    forward_edges = {}
+    for hop in range(max_hops):
+        next_frontier = []
+        # sorting makes the chosen path reproducible, if there are several of equal length
+        for name, weights in sorted(frontier):
+            for neighbour, rel, weight in neighbours_for_concept(lang_code, name, min_weight):
+                if neighbour in used_names or neighbour in EMOTIONS:
+                    continue
+                if neighbour not in forward_edges:
+                    forward_edges[neighbour] = _first_edges(lang_code, neighbour, min_weight)
+                # the neighbour's own lookup may not return the edge, if it has more than REQ_LIMIT edges
+                if name not in forward_edges[neighbour]:
+                    continue
+                used_names.add(neighbour)
+                path = weights + (forward_edges[neighbour][name],)
+                next_frontier.append((neighbour, path))
+                yield neighbour, path
+        frontier = next_frontier
+
+def _first_edges(lang_code, name, min_weight):
+    # just like build_graph, only the first edge to a neighbour counts
+    edges = {}
+    for neighbour, rel, weight in neighbours_for_concept(lang_code, name, min_weight):
+        edges.setdefault(neighbour, weight)
+    return edges
+
+_emotion_indexes = {}
+_emotion_indexes_lock = Lock()
+
+def get_emotion_index(lang_code='en', max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, req_limit=REQ_LIMIT):
+    """
+    Returns the shared index for a parameter set, or None if it has not been built or is disabled.
+    """
+    if not EMOTION_INDEX_ENABLED:
+        return None
+    path = index_path(max_depth, min_weight, req_limit, lang_code)
+    with _emotion_indexes_lock:
+        if path not in _emotion_indexes:
+            # whichdb returns None if no database exists at the given path
+            _emotion_indexes[path] = EmotionIndex(path) if whichdb.whichdb(path) else None
+        return _emotion_indexes[path]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the emotion index for the parameters in config.cfg.')
+    parser.add_argument('--language', default='en', help='language code of the indexed concepts')
+    parser.add_argument('--out', default=None, help='path of the index to write')
+    args = parser.parse_args()
+    count = build_emotion_index(args.language, path=args.out)
+    print 'Indexed %d concepts' % count
@@ -0,0 +1,309 @@
+"""
+Alternative strategies of searching ConceptNet's graph for emotions.
+
+build_graph searches forwards from a token only. Its frontier grows exponentially
+with every level, which makes deep searches very expensive.
+
+Every strategy is a subclass of SearchStrategy and can be selected by its name
+using SEARCH_MODE in config.cfg.
+"""
+from math import ceil
+
+from ..utils.utils import get_config
+from .concept_net_client import neighbours_for_concept
+from .emotion_index import reverse_search
+from .text import EMOTIONS
+from .text import CONCURRENCY
+from .text import DEBUG
+from .text import calc_path_weight
+from .text import calc_percentages
+from .text import _frontier_executor
+
+MAX_DEPTH = get_config('graph_search', 'MAX_DEPTH', 'getint')
+MIN_WEIGHT = get_config('graph_search', 'MIN_WEIGHT', 'getint')
+REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+SEARCH_MODE = get_config('graph_search', 'SEARCH_MODE', 'get', 'bfs')
+
+# Limits of the beam search, 0 disables a limit
+BEAM_WIDTH = get_config('graph_search', 'BEAM_WIDTH', 'getint', 0)
+MAX_LOOKUPS = get_config('graph_search', 'MAX_LOOKUPS', 'getint', 0)
+EARLY_STOP = get_config('graph_search', 'EARLY_STOP', 'getboolean', False)
+
+# maps the name of every strategy to its class
+STRATEGIES = {}
+
+# The backward searches do not depend on the token, hence they are shared by all searches
+_backward_frontiers = {}
+
+class SearchStrategy(object):
+    """
+    A way of searching the emotions of a single word.
+
+    Subclasses set name, implement search and list every parameter
+    that alters their results in params.
+    """
+    name = None
+
+    def __init__(self, max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, concurrency=CONCURRENCY):
+        self.max_depth = max_depth
+        self.min_weight = min_weight
+        self.concurrency = concurrency
+
+    def params(self):
+        return {}
+
+    def cache_key(self):
+        """
+        Identifies the strategy and its parameters in the name of a word cache.
+        The default breadth-first search returns an empty key, so existing caches are still found.
+        """
+        params = ['%s%s' % (k, v) for k, v in sorted(self.params().items())]
+        if self.name == 'bfs' and not params:
+            return ''
+        return '_'.join([self.name] + params)
+
+    def search(self, word, lang_code='en'):
+        """
+        Returns the emotions-vector of a word.
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class BidirectionalSearch(SearchStrategy):
+    """
+    Searches forwards from the word and backwards from every emotion, see bidirectional_search.
+    """
+    name = 'bidirectional'
+
+    def search(self, word, lang_code='en'):
+        return bidirectional_search(word, lang_code, self.max_depth, self.min_weight, self.concurrency)
+
+class BeamSearch(SearchStrategy):
+    """
+    A breadth-first search with a bounded cost per word, see beam_search.
+    """
+    name = 'beam'
+
+    def __init__(self, beam_width=BEAM_WIDTH, max_lookups=MAX_LOOKUPS, early_stop=EARLY_STOP, **kwargs):
+        SearchStrategy.__init__(self, **kwargs)
+        self.beam_width = beam_width
+        self.max_lookups = max_lookups
+        self.early_stop = early_stop
+
+    def params(self):
+        return {
+            'k': self.beam_width,
+            'l': self.max_lookups,
+            'e': int(bool(self.early_stop))
+        }
+
+    def search(self, word, lang_code='en'):
+        return beam_search(word, lang_code, self.max_depth, self.min_weight,
+            self.beam_width, self.max_lookups, self.early_stop, self.concurrency)
+
+def register_strategy(strategy_class):
+    """
+    Makes a SearchStrategy selectable by its name.
+    """
+    STRATEGIES[strategy_class.name] = strategy_class
+    return strategy_class
+
+def get_strategy(name=SEARCH_MODE, **kwargs):
+    """
+    Instantiates a registered SearchStrategy by its name.
+    """
+    try:
+        return STRATEGIES[name](**kwargs)
+    except KeyError:
+        raise Exception('Unknown search strategy: %s' % name)
+
+register_strategy(BidirectionalSearch)
+register_strategy(BeamSearch)
+
+def bidirectional_search(name, lang_code='en', max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, concurrency=CONCURRENCY):
+    """
+    Searches for the emotions of a token by growing a frontier forwards from the token
+    and backwards from every emotion, until they meet.
+
+    Returns an emotion-vector of the same form and with the same weighting as build_graph.
+    Every emotion it finds is found by build_graph as well, but not vice versa: the backward
+    searches miss concepts that only lead to an emotion through an edge beyond the first
+    REQ_LIMIT edges of the emotion's side. Of several paths, the shortest one meeting at the
+    lowest name is scored, which need not be the one build_graph takes.
+    """
+
+    # Overview:
+    #
+    # build_graph scores an emotion that is n edges away from the token (max_depth - n) times,
+    # paths of max_depth or more edges are never scored.
+    # Every path of at most max_depth - 1 edges can be split into a forward part of at most
+    # forward_hops edges and a backward part of at most backward_hops edges.
+    # Hence, each side only has to search about half as deep as build_graph does.
+    max_hops = max_depth - 1
+    forward_hops = int(ceil(max_hops / 2.0))
+    backward_hops = max_hops - forward_hops
+
+    emo_vector = {
+        'name': name,
+        'emotions': {}
+    }
+    if name in EMOTIONS or max_hops < 1:
+        return emo_vector
+
+    # reverse_search only follows edges the forward side's lookup of a concept returns as well,
+    # hence every path through a meeting concept could be taken by build_graph
+    backward = dict((e, backward_frontier(e, lang_code, backward_hops, min_weight)) for e in EMOTIONS)
+
+    # forward maps every concept reached from the token to the weights of its path,
+    # ordered from the token to the concept
+    forward = {name: ()}
+    frontier = [name]
+    # for every emotion, the best (length, meeting name, weights) found so far
+    meetings = {}
+    for hop in range(1, forward_hops + 1):
+        next_frontier = []
+        # sorting makes the chosen path reproducible, if there are several of equal length
+        for concept, neighbours in _expand(sorted(frontier), lang_code, min_weight, concurrency):
+            for neighbour, rel, weight in neighbours:
+                if neighbour in forward:
+                    continue
+                forward[neighbour] = forward[concept] + (weight,)
+                # emotions are not expanded, just like in build_graph
+                if neighbour not in EMOTIONS:
+                    next_frontier.append(neighbour)
+                _join(neighbour, forward[neighbour], backward, meetings, max_hops)
+        frontier = next_frontier
+
+        # Paths found later are at least hop + 1 edges long. If every emotion has already
+        # been met by a path that is not longer, searching further cannot improve anything.
+        if len(meetings) == len(EMOTIONS) and all(m[0] <= hop + 1 for m in meetings.values()):
+            break
+        if not frontier:
+            break
+
+    for emotion, (length, meeting, weights) in meetings.items():
+        emo_vector['emotions'][emotion] = (max_depth - length) * calc_path_weight(weights)
+    emo_vector['emotions'] = calc_percentages(emo_vector['emotions'])
+    return emo_vector
+
+def beam_search(name, lang_code='en', max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, beam_width=0, max_lookups=0, early_stop=False, concurrency=CONCURRENCY):
+    """
+    Searches forwards from a token just like build_graph does, but with a bounded cost:
+        * beam_width: only the heaviest beam_width concepts of every level are expanded;
+        * max_lookups: at most max_lookups concepts are looked up for the token; and
+        * early_stop: the search stops once every emotion has been found, or once the
+          remaining frontier is unlikely to change the ranking of the emotions found so far.
+          The latter is estimated by _upper_bound, which is no real bound, so an early stop
+          may drop emotions that build_graph finds. It is off by default.
+
+    Concepts are ranked by the sum of the weights of their path.
+    Without any limits, the results are identical to build_graph's.
+    """
+    emo_vector = {
+        'name': name,
+        'emotions': {}
+    }
+    if name in EMOTIONS:
+        return emo_vector
+
+    # frontier holds (concept, weights) tuples, weights are ordered from the token to the concept
+    frontier = [(name, ())]
+    used_names = set([name])
+    lookups = 0
+    max_weight = 0
+    for hop in range(1, max_depth):
+        if beam_width or max_lookups:
+            # the heaviest concepts are expanded first, so they are not cut off by max_lookups
+            frontier.sort(key=lambda c: (-sum(c[1]), c[0]))
+        else:
+            # the order of build_graph
+            frontier.sort()
+        if max_lookups:
+            frontier = frontier[:max(max_lookups - lookups, 0)]
+        lookups += len(frontier)
+
+        next_frontier = []
+        for (concept, weights), (_, neighbours) in zip(frontier, _expand([c for c, w in frontier], lang_code, min_weight, concurrency)):
+            for neighbour, rel, weight in neighbours:
+                max_weight = max(max_weight, weight)
+                if neighbour in used_names:
+                    continue
+                used_names.add(neighbour)
+                path = weights + (weight,)
+                if neighbour in EMOTIONS:
+                    # build_graph scores an emotion on every remaining level
+                    emo_vector['emotions'][neighbour] = (max_depth - hop) * calc_path_weight(tuple(reversed(path)))
+                else:
+                    next_frontier.append((neighbour, path))
+
+        if beam_width:
+            next_frontier.sort(key=lambda c: (-sum(c[1]), c[0]))
+            next_frontier = next_frontier[:beam_width]
+        frontier = next_frontier
+
+        if not frontier or (max_lookups and lookups >= max_lookups):
+            break
+        if early_stop:
+            if len(emo_vector['emotions']) == len(EMOTIONS):
+                break
+            found = emo_vector['emotions'].values()
+            # every emotion found later would probably be ranked below the ones found so far
+            if found and _upper_bound(frontier, hop, max_depth, max_weight) < min(found):
+                break
+    emo_vector['emotions'] = calc_percentages(emo_vector['emotions'])
+    return emo_vector
+
+def _upper_bound(frontier, hop, max_depth, max_weight):
+    # Estimates the highest score an emotion could still get through the frontier.
+    # Edges that have not been looked up yet are assumed to be as heavy as the heaviest edge seen so far.
+    # This is a heuristic, not a bound: edges looked up later may be heavier than all edges seen so far.
+    bound = 0
+    for concept, weights in frontier:
+        reverse_weights = tuple(reversed(weights))
+        for length in range(hop + 1, max_depth):
+            unknown = (max_weight,) * (length - hop)
+            bound = max(bound, (max_depth - length) * calc_path_weight(unknown + reverse_weights))
+    return bound
+
+def backward_frontier(emotion, lang_code, max_hops, min_weight):
+    """
+    Returns a dictionary mapping every concept within max_hops edges of an emotion
+    to the weights of its path, ordered from the emotion to the concept.
+    """
+    key = (emotion, lang_code, max_hops, min_weight, REQ_LIMIT)
+    try:
+        return _backward_frontiers[key]
+    except KeyError:
+        frontier = {emotion: ()}
+        frontier.update(reverse_search(emotion, lang_code, max_hops, min_weight))
+        return _backward_frontiers.setdefault(key, frontier)
+
+def _join(concept, forward_weights, backward, meetings, max_hops):
+    for emotion, frontier in backward.items():
+        if concept not in frontier:
+            continue
+        # calc_path_weight expects weights from the emotion back to the token
+        weights = frontier[concept] + tuple(reversed(forward_weights))
+        length = len(weights)
+        if length > max_hops:
+            continue
+        if emotion not in meetings or (length, concept) < meetings[emotion][:2]:
+            meetings[emotion] = (length, concept, weights)
+
+def _expand(concepts, lang_code, min_weight, concurrency):
+    # yields (concept, neighbours) tuples in the order of concepts
+    if concurrency > 1:
+        results = _frontier_executor(concurrency).map(lambda c: _neighbours(c, lang_code, min_weight), concepts)
+    else:
+        results = (_neighbours(c, lang_code, min_weight) for c in concepts)
+    return zip(concepts, results)
+
+def _neighbours(concept, lang_code, min_weight):
+    try:
+        return neighbours_for_concept(lang_code, concept, min_weight)
+    except Exception as e:
+        if DEBUG:
+            print e
+        return []
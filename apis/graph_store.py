@@ -0,0 +1,285 @@
+"""
+An offline store of ConceptNet's graph.
+
+Running a local ConceptNet instance only to look up the edges of concepts is
+expensive. Instead, a dump of ConceptNet's assertions can be imported once into a compact
+file that is then opened using mmap:
+
+    python -m emotext.apis.graph_store assertions.csv conceptnet.graph --languages en,de
+
+The file holds the graph as an adjacency structure in compressed sparse row (CSR) format:
+    * a sorted table of interned concept names (their position is their id);
+    * a table of relation names;
+    * for every concept, the offset of its first neighbour; and
+    * packed neighbour ids, relation ids and weights, sorted by weight per concept.
+
+A GraphStore answers lookups with the same edges ConceptNet's web-API would,
+and can therefore be used as a drop-in replacement for a ConceptNetClient.
+To do so, set BACKEND to 'offline' and GRAPH_STORE to the file's path in config.cfg.
+"""
+import argparse
+import json
+import mmap
+import struct
+
+from array import array
+
+from ..utils.utils import get_config
+
+REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+
+MAGIC = 'EMOGRAPH'
+FORMAT_VERSION = 1
+
+# magic, version, number of concepts, number of (directed) edges, number of relations
+HEADER = struct.Struct('<8sIIII')
+# offsets of the sections: name offsets, names, relation offsets, relations,
+# csr offsets, neighbours, relation ids and weights
+SECTIONS = struct.Struct('<8Q')
+
+# The highest bit of a stored relation id marks edges whose 'end' is the concept itself.
+# This allows to reproduce the original direction of an edge.
+REVERSED = 0x8000
+
+class GraphStore(object):
+    """
+    Opens a file written by import_dump and answers edge lookups from it.
+    """
+
+    # Looking up a concept only takes a couple of microseconds,
+    # hence caching its results is not necessary
+    remote = False
+
+    def __init__(self, path, req_limit=REQ_LIMIT):
+        self.path = path
+        self.req_limit = req_limit
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_concepts, self.n_edges, self.n_rels = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise Exception('%s is not a graph store of version %d.' % (path, FORMAT_VERSION))
+        (self.name_offsets, self.names, self.rel_offsets, self.rel_names,
+            self.csr_offsets, self.neighbours, self.rels, self.weights) = SECTIONS.unpack_from(self.mm, HEADER.size)
+        # there are only a few relations, hence they are held in memory
+        self.relations = [self._string(self.rel_offsets, self.rel_names, i) for i in xrange(self.n_rels)]
+
+    def concept_id(self, lang_code, name):
+        """
+        Returns the id of a concept using binary search on the sorted names, or None.
+        """
+        key = ('%s/%s' % (lang_code, name)).encode('utf8')
+        lo, hi = 0, self.n_concepts
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = self._string(self.name_offsets, self.names, mid, decode=False)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def concept_name(self, concept_id):
+        return self._string(self.name_offsets, self.names, concept_id)
+
+    def neighbours_of(self, concept_id, limit=None):
+        """
+        Returns a list of (neighbour id, relation, weight, reversed) tuples
+        of a concept, ordered by descending weight.
+        """
+        start, end = struct.unpack_from('<II', self.mm, self.csr_offsets + 4 * concept_id)
+        if limit is not None:
+            end = min(end, start + limit)
+        count = end - start
+        if count <= 0:
+            return []
+        neighbours = struct.unpack_from('<%dI' % count, self.mm, self.neighbours + 4 * start)
+        rels = struct.unpack_from('<%dH' % count, self.mm, self.rels + 2 * start)
+        weights = struct.unpack_from('<%df' % count, self.mm, self.weights + 4 * start)
+        return [(n, self.relations[r & ~REVERSED], w, bool(r & REVERSED)) \
+            for n, r, w in zip(neighbours, rels, weights)]
+
+    def lookup(self, type, language, key, timeout=None):
+        """
+        Returns a concept's edges in the form of ConceptNet's web-API.
+        """
+        if type not in ('c', 'concept'):
+            raise Exception('A graph store can only look up concepts.')
+        concept_id = self.concept_id(language, key.lower())
+        if concept_id is None:
+            return {'numFound': 0, 'edges': []}
+        uri = '/c/%s/%s' % (language, key.lower())
+        edges = []
+        for n, rel, weight, rev in self.neighbours_of(concept_id, self.req_limit):
+            other = '/c/' + self.concept_name(n)
+            edges.append({
+                'start': other if rev else uri,
+                'end': uri if rev else other,
+                'rel': rel,
+                'weight': weight
+            })
+        return {'numFound': len(edges), 'edges': edges}
+
+    def lookup_many(self, type, language, keys, timeout=None):
+        """
+        Same as ConceptNetClient.lookup_many, but answered from the store.
+        """
+        for k in keys:
+            try:
+                yield k, self.lookup(type, language, k), None
+            except Exception as e:
+                yield k, None, e
+
+    def close(self):
+        self.mm.close()
+
+    def _string(self, offsets, blob, i, decode=True):
+        start, end = struct.unpack_from('<II', self.mm, offsets + 4 * i)
+        s = self.mm[blob + start:blob + end]
+        return s.decode('utf8') if decode else s
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def import_dump(dump_path, out_path, languages=('en',)):
+    """
+    Reads a dump of ConceptNet's assertions and writes a graph store to out_path.
+
+    Both ConceptNet's CSV dumps (tab separated) and JSON dumps (one edge per line) are
+    supported. Only edges between concepts of the given languages are imported.
+    """
+    names = {}
+    relations = {}
+    starts, ends, rels, weights = array('I'), array('I'), array('H'), array('f')
+
+    def intern_id(table, name):
+        try:
+            return table[name]
+        except KeyError:
+            table[name] = len(table)
+            return table[name]
+
+    with open(dump_path, 'rb') as dump:
+        for line in dump:
+            edge = parse_dump_line(line)
+            if edge is None:
+                continue
+            start, end, rel, weight = edge
+            if start[0] not in languages or end[0] not in languages or start == end:
+                continue
+            starts.append(intern_id(names, '%s/%s' % start))
+            ends.append(intern_id(names, '%s/%s' % end))
+            rels.append(intern_id(relations, rel))
+            weights.append(weight)
+
+    # Concepts are renumbered, so that their ids equal their position in the sorted name table
+    sorted_names = sorted(names.keys(), key=lambda n: n.encode('utf8'))
+    new_ids = array('I', [0] * len(sorted_names))
+    for i, n in enumerate(sorted_names):
+        new_ids[names[n]] = i
+    rel_names = sorted(relations.keys(), key=lambda r: relations[r])
+
+    # Every edge is stored twice, once for each of its concepts (counting sort by concept)
+    counts = array('I', [0] * (len(sorted_names) + 1))
+    for s, e in zip(starts, ends):
+        counts[new_ids[s] + 1] += 1
+        counts[new_ids[e] + 1] += 1
+    for i in xrange(1, len(counts)):
+        counts[i] += counts[i-1]
+    csr_offsets = array('I', counts)
+    n_edges = csr_offsets[-1]
+    neighbours, edge_rels, edge_weights = array('I', [0] * n_edges), array('H', [0] * n_edges), array('f', [0] * n_edges)
+    fill = array('I', csr_offsets)
+    for s, e, r, w in zip(starts, ends, rels, weights):
+        s, e = new_ids[s], new_ids[e]
+        for concept, other, rel in ((s, e, r), (e, s, r | REVERSED)):
+            pos = fill[concept]
+            neighbours[pos], edge_rels[pos], edge_weights[pos] = other, rel, w
+            fill[concept] += 1
+
+    # ConceptNet returns the strongest edges first, so do we
+    for concept in xrange(len(sorted_names)):
+        start, end = csr_offsets[concept], csr_offsets[concept+1]
+        if end - start < 2:
+            continue
+        order = sorted(xrange(start, end), key=lambda i: -edge_weights[i])
+        neighbours[start:end] = array('I', [neighbours[i] for i in order])
+        edge_rels[start:end] = array('H', [edge_rels[i] for i in order])
+        edge_weights[start:end] = array('f', [edge_weights[i] for i in order])
+
+    name_offsets, name_blob = _string_table(sorted_names)
+    rel_offsets, rel_blob = _string_table(rel_names)
+    sections = [name_offsets.tostring(), name_blob, rel_offsets.tostring(), rel_blob,
+        csr_offsets.tostring(), neighbours.tostring(), edge_rels.tostring(), edge_weights.tostring()]
+
+    with open(out_path, 'wb') as out:
+        offset = HEADER.size + SECTIONS.size
+        section_offsets = []
+        for section in sections:
+            section_offsets.append(offset)
+            # sections are aligned to 4 bytes
+            offset += len(section) + _padding(len(section))
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sorted_names), n_edges, len(rel_names)))
+        out.write(SECTIONS.pack(*section_offsets))
+        for section in sections:
+            out.write(section)
+            out.write('\0' * _padding(len(section)))
+    return len(sorted_names), n_edges
+
+def parse_dump_line(line):
+    """
+    Parses a line of a ConceptNet dump and returns a
+    ((lang_code, name), (lang_code, name), rel, weight) tuple or None.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line.startswith('{'):
+            # JSON dumps contain one edge dictionary per line
+            e = json.loads(line)
+            start, end, rel, weight = e['start'], e['end'], e['rel'], float(e['weight'])
+        else:
+            cols = line.decode('utf8').split('\t')
+            start, end, rel = cols[2], cols[3], cols[1]
+            # ConceptNet >= 5.5 saves an edge's information as a JSON dictionary in the fifth column,
+            # older versions save the weight as the sixth column
+            if cols[4].startswith('{'):
+                weight = float(json.loads(cols[4])['weight'])
+            else:
+                weight = float(cols[5])
+    except (ValueError, KeyError, IndexError):
+        return None
+    start, end = _concept(start), _concept(end)
+    if start is None or end is None:
+        return None
+    return start, end, rel, weight
+
+def _concept(uri):
+    # '/c/en/person/n/...' => ('en', 'person')
+    parts = uri.split('/')
+    if len(parts) < 4 or parts[1] != 'c':
+        return None
+    return parts[2], parts[3]
+
+def _string_table(strings):
+    offsets = array('I', [0])
+    blob = []
+    for s in strings:
+        encoded = s.encode('utf8')
+        blob.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+    return offsets, ''.join(blob)
+
+def _padding(length):
+    return (4 - length % 4) % 4
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imports a ConceptNet dump into a graph store.')
+    parser.add_argument('dump', help='ConceptNet assertions as CSV or JSON')
+    parser.add_argument('out', help='path of the graph store to write')
+    parser.add_argument('--languages', default='en', help='comma separated language codes to import')
+    args = parser.parse_args()
+    n_concepts, n_edges = import_dump(args.dump, args.out, tuple(args.languages.split(',')))
+    print 'Imported %d concepts and %d edges into %s' % (n_concepts, n_edges / 2, args.out)
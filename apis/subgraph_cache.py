@@ -0,0 +1,276 @@
+"""
+Caches the subgraph a search explored for a word, independent of the search's parameters.
+
+Every set of MAX_DEPTH, MIN_WEIGHT and REQ_LIMIT has its own word cache, hence changing one
+of them used to mean searching the whole vocabulary over the network again. Instead,
+the subgraph of a word is recorded once at permissive parameters: every concept the search
+looked up, with its edges, their weights and the depth it was first reached at.
+
+A breadth-first search with stricter parameters (a lower max_depth, a higher min_weight or
+a lower req_limit) only ever looks up concepts the permissive one looked up as well, and only
+sees the first req_limit edges of each of them. Hence, build_graph can be run again on the
+recorded subgraph (see SubgraphClient), which yields the very same results without a single lookup.
+This relies on ConceptNet returning the edges of a concept in the same order for every limit.
+
+Subgraphs are saved in a SQLite database. If ENABLED is set in config.cfg, the breadth-first
+search records the subgraph of every word it does not have one of, and replays it afterwards.
+Grids of parameters can be evaluated offline using emotext.models.sweep.
+"""
+import json
+import sqlite3
+import zlib
+
+from threading import Lock
+from threading import local
+
+from ..utils.utils import extr_from_concept_net_edge
+from ..utils.utils import get_config
+from .concept_net_client import ConceptNetClient
+from .concept_net_client import lookup
+from .edge_cache import strip_lookup_result
+from .graph_store import GraphStore
+
+REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+
+SUBGRAPH_CACHE_ENABLED = get_config('subgraph_cache', 'ENABLED', 'getboolean', False)
+SUBGRAPH_CACHE_PATH = get_config('subgraph_cache', 'PATH', 'get', './subgraph_cache.sqlite')
+# The permissive parameters subgraphs are recorded at. A search's own parameters are used
+# wherever they are even more permissive.
+RECORD_MAX_DEPTH = get_config('subgraph_cache', 'MAX_DEPTH', 'getint',
+    get_config('graph_search', 'MAX_DEPTH', 'getint'))
+RECORD_MIN_WEIGHT = get_config('subgraph_cache', 'MIN_WEIGHT', 'getint',
+    get_config('graph_search', 'MIN_WEIGHT', 'getint'))
+RECORD_REQ_LIMIT = get_config('subgraph_cache', 'REQ_LIMIT', 'getint', REQ_LIMIT)
+# Seconds a process waits for another one to finish writing
+SUBGRAPH_CACHE_TIMEOUT = get_config('cache', 'TIMEOUT', 'getfloat', 30.0)
+
+EMPTY_RESULT = {'numFound': 0, 'edges': []}
+
+class Subgraph(object):
+    """
+    The concepts a search for a word looked up, and the parameters it was recorded at.
+
+    concepts maps every concept's name to its depth and its lookup result:
+    {'name': {'depth': 1, 'numFound': 2, 'edges': [...]}}
+    """
+    def __init__(self, word, lang_code, max_depth, min_weight, req_limit, concepts):
+        self.word = word
+        self.lang_code = lang_code
+        self.max_depth = max_depth
+        self.min_weight = min_weight
+        self.req_limit = req_limit
+        self.concepts = concepts
+
+    def covers(self, max_depth, min_weight, req_limit):
+        """
+        Returns whether a search with the given parameters can be replayed on this subgraph.
+        """
+        return max_depth <= self.max_depth and min_weight >= self.min_weight and req_limit <= self.req_limit
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class SubgraphClient(object):
+    """
+    Answers lookups from a Subgraph, just like a ConceptNetClient with the given req_limit would.
+    Concepts that are not part of the subgraph have no edges.
+    """
+    # results must not end up in the edge cache
+    remote = False
+
+    def __init__(self, subgraph, req_limit=None):
+        self.subgraph = subgraph
+        self.req_limit = req_limit or subgraph.req_limit
+        if self.req_limit > subgraph.req_limit:
+            raise Exception('A subgraph recorded with a limit of %d edges cannot answer lookups of %d edges.' \
+                % (subgraph.req_limit, self.req_limit))
+
+    def lookup(self, type, language, key, timeout=None):
+        concept = self.subgraph.concepts.get(key.lower()) if language == self.subgraph.lang_code else None
+        if concept is None:
+            return EMPTY_RESULT
+        edges = concept['edges'][:self.req_limit]
+        return {'numFound': min(concept['numFound'], len(edges)), 'edges': edges}
+
+    def lookup_many(self, type, language, keys, timeout=None):
+        for k in keys:
+            yield k, self.lookup(type, language, k), None
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class RecordingClient(object):
+    """
+    Passes lookups on to another client and records their results.
+    """
+    # the edge cache is asked by lookup itself, so that cached results are recorded as well
+    remote = False
+
+    def __init__(self, client):
+        self.client = client
+        self.req_limit = int(client.req_limit)
+        self.results = {}
+        self.failures = 0
+        self.lock = Lock()
+
+    def lookup(self, type, language, key, timeout=None):
+        # lookup also counts failed lookups and bypasses the edge cache for other limits
+        try:
+            res = lookup(type, language, key, self.client)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        with self.lock:
+            self.results[key.lower()] = strip_lookup_result(res) or EMPTY_RESULT
+        return res
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class SubgraphStore(object):
+    """
+    Saves subgraphs in a SQLite database, several per word if they were recorded at different parameters.
+    """
+    def __init__(self, path=SUBGRAPH_CACHE_PATH, timeout=SUBGRAPH_CACHE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        # sqlite3 connections must not be shared by threads
+        self.local = local()
+        conn = self.connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS subgraphs (
+                    word TEXT NOT NULL,
+                    lang_code TEXT NOT NULL,
+                    max_depth INTEGER NOT NULL,
+                    min_weight INTEGER NOT NULL,
+                    req_limit INTEGER NOT NULL,
+                    concepts INTEGER NOT NULL,
+                    graph BLOB NOT NULL,
+                    PRIMARY KEY (word, lang_code, max_depth, min_weight, req_limit)
+                )''')
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def fetch(self, word, lang_code, max_depth, min_weight, req_limit):
+        """
+        Returns the smallest subgraph of a word that covers the given parameters, or None.
+        """
+        row = self.connection().execute('SELECT max_depth, min_weight, req_limit, graph FROM subgraphs ' \
+            'WHERE word = ? AND lang_code = ? AND max_depth >= ? AND min_weight <= ? AND req_limit >= ? ' \
+            'ORDER BY concepts LIMIT 1', (word, lang_code, max_depth, min_weight, req_limit)).fetchone()
+        if row is None:
+            return None
+        return Subgraph(word, lang_code, row[0], row[1], row[2], json.loads(zlib.decompress(row[3])))
+
+    def add(self, subgraph):
+        graph = sqlite3.Binary(zlib.compress(json.dumps(subgraph.concepts)))
+        conn = self.connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO subgraphs ' \
+                '(word, lang_code, max_depth, min_weight, req_limit, concepts, graph) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (subgraph.word, subgraph.lang_code, subgraph.max_depth, subgraph.min_weight, subgraph.req_limit,
+                len(subgraph.concepts), graph))
+
+    def record(self, word, lang_code, max_depth, min_weight, req_limit, search, client):
+        """
+        Records the subgraph of a word by searching it with the given parameters through client.
+        search is called as search(word, lang_code, client, max_depth, min_weight).
+
+        The subgraph is only saved if every lookup succeeded. Either way, it is returned.
+        """
+        recorder = RecordingClient(client_with_limit(client, req_limit))
+        search(word, lang_code, recorder, max_depth, min_weight)
+        concepts = recorder.results
+        depths = concept_depths(word, lang_code, concepts, min_weight)
+        for name, concept in concepts.items():
+            concept['depth'] = depths.get(name)
+        subgraph = Subgraph(word, lang_code, max_depth, min_weight, recorder.req_limit, concepts)
+        if recorder.failures == 0:
+            self.add(subgraph)
+        return subgraph
+
+    def search(self, word, lang_code, max_depth, min_weight, req_limit, search, client):
+        """
+        Searches a word on its recorded subgraph, recording it first if necessary.
+        """
+        subgraph = self.fetch(word, lang_code, max_depth, min_weight, req_limit)
+        if subgraph is None:
+            subgraph = self.record(word, lang_code, max(RECORD_MAX_DEPTH, max_depth), min(RECORD_MIN_WEIGHT, min_weight),
+                max(RECORD_REQ_LIMIT, req_limit), search, client)
+        return search(word, lang_code, SubgraphClient(subgraph, req_limit), max_depth, min_weight)
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def client_with_limit(client, req_limit):
+    """
+    Returns a client like the given one, which looks up req_limit edges per concept.
+    """
+    if int(client.req_limit) == req_limit:
+        return client
+    if isinstance(client, GraphStore):
+        return GraphStore(client.path, req_limit)
+    if isinstance(client, ConceptNetClient):
+        return ConceptNetClient(client.api_url, client.version, req_limit)
+    raise Exception('Cannot change the limit of edges of %s' % client)
+
+def concept_depths(word, lang_code, concepts, min_weight):
+    """
+    Returns the number of edges between the word and every concept of a subgraph,
+    following edges heavier than min_weight just like build_graph does.
+    """
+    depths = {word: 0}
+    frontier = [word]
+    depth = 0
+    while frontier:
+        depth += 1
+        next_frontier = []
+        for name in frontier:
+            for e in concepts.get(name, EMPTY_RESULT)['edges']:
+                if not e['weight'] > min_weight:
+                    continue
+                start = extr_from_concept_net_edge(e['start'])
+                end = extr_from_concept_net_edge(e['end'])
+                other = end if end['name'] != name else start
+                if other['lang_code'] == lang_code and other['name'] not in depths:
+                    depths[other['name']] = depth
+                    next_frontier.append(other['name'])
+        frontier = next_frontier
+    return depths
+
+_subgraph_store = None
+_subgraph_store_lock = Lock()
+
+def get_subgraph_store():
+    """
+    Returns the SubgraphStore used by the breadth-first search, or None if it is disabled.
+    """
+    global _subgraph_store
+    if _subgraph_store is None and SUBGRAPH_CACHE_ENABLED:
+        with _subgraph_store_lock:
+            if _subgraph_store is None:
+                _subgraph_store = SubgraphStore()
+    return _subgraph_store
+
+def set_subgraph_store(store):
+    """
+    Replaces the shared SubgraphStore. Passing None disables it.
+    """
+    global _subgraph_store, SUBGRAPH_CACHE_ENABLED
+    _subgraph_store = store
+    SUBGRAPH_CACHE_ENABLED = store is not None
@@ -11,11 +11,16 @@ connections between a specific token and the entity 'Emotion'.
 import sys
 import os.path
 import re
+import time
 
 from sets import Set
 from math import pow
 
 from ..utils.utils import get_config
+from ..utils.metrics import Stopwatch
+from ..utils.metrics import get_metrics
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters
 from nltk.tokenize import RegexpTokenizer
@@ -33,6 +38,28 @@ MIN_WEIGHT = get_config('graph_search', 'MIN_WEIGHT', 'getint')
 
 EMOTIONS = set(get_config('graph_search', 'EMOTIONS', 'getlist'))
 
+# Number of lookups that are run simultaneously per level of the graph search.
+# A value of 1 keeps the original, strictly serial behaviour.
+CONCURRENCY = get_config('graph_search', 'CONCURRENCY', 'getint', 1)
+
+# How paths are scored, see score_node
+SCORING = get_config('graph_search', 'SCORING', 'get', 'exact')
+# Factor by which the weight of a path is reduced on every further edge, if SCORING is 'incremental'
+PATH_DECAY = get_config('graph_search', 'PATH_DECAY', 'getfloat', 0.9)
+# Prints every scored path and failed lookup
+DEBUG = get_config('graph_search', 'DEBUG', 'getboolean', False)
+
+# Worker pools are kept alive between searches, one per concurrency limit
+_frontier_executors = {}
+
+# Number of words whose stemmed or lower case form every TextProcessor remembers
+MEMO_SIZE = get_config('text_processing', 'MEMO_SIZE', 'getint', 100000)
+# isn't = is not
+NEGATION_PATTERN = re.compile(r"(n't)")
+
+# TextProcessors are shared by all calls with the same language and options
+_text_processors = {}
+
 def lang_name_to_code(lang_name='english'):
     """
     ConceptNet uses language codes to query words.
@@ -61,79 +88,158 @@ def text_processing(text, remove_punctuation=True, stemming=True, remove_stopwor
         * Stemming (and stopword removal)
         * Conversion to lower case
     The language parameter is only required, if stemming and removal of stopwords are desired.
+
+    The work is done by a TextProcessor that is shared by all calls with the same options.
     """
+    return get_text_processor(remove_punctuation, stemming, remove_stopwords, language).process(text)
 
-    # Texts often contain punctuation characters.
-    # While we'd like to remove them from our data set, their information shouldn't be lost, as
-    # it would enable us to handle negation in text later on.
-    # 
-    # An example:
-    # Given the sentence: 'The movie was not bad.', we could convert all
-    # adjectives in the sentence to antonyms and remove all negations.
-    # Afterwards, the sentence would read 'The movie was good', where 'good'
-    # is the antonym of 'bad'.
-    # 
-    # Therefore, punctuation information should not be lost throughout the process of
-    # processing the text with NLP.
-    sentence_tokenizer = PunktSentenceTokenizer(PunktParameters())
-    # tokenize always returns a list of strings divided by punctuation characters
-    # 
-    # 'hello' => [u'hello']
-    # 'Hello this is doge. world.' => [u'Hello this is doge.', u'world.']
-    # 
-    # Therefore, we need to continue handling a list, namely the sentences variable
-    sentences = sentence_tokenizer.tokenize(text)
+def get_text_processor(remove_punctuation=True, stemming=True, remove_stopwords=True, language='english'):
+    """
+    Returns the TextProcessor of a language and set of options.
+    It is only created once, so its tokenizers, stopwords and memo are reused by every call.
+    """
+    key = (remove_punctuation, stemming, remove_stopwords, language)
+    try:
+        return _text_processors[key]
+    except KeyError:
+        return _text_processors.setdefault(key, TextProcessor(*key))
 
-    # In the English language at least, 
-    # there are certain stop words, that introduce low-level negation
-    # on a sentence bases.
-    # However, these stop words are often melted with their previous verb
-    # 
-    # isn't = is not
-    # wouldn't = would not
-    # 
-    # This must resolved, as it would not be possible for further functionality of this function to continue
-    # extracting information.
-    # Especially the 'anonymity' functionality wouldn't work without this
-    if language == 'english':
-        sw_pattern = r"(n't)"
-        sentences = [re.sub(sw_pattern, ' not', s) for s in sentences]
-    
-    # If desired, the user can no go ahead and remove punctuation from all sentences
-    if remove_punctuation:
-        # This tokenizer simply removes every character or word which
-        # length is < 2 and is not a alphabetic one
-        punct_rm_tokenizer = RegexpTokenizer(r'\w{2,}')
-        # In this case, tokenize will return a list of every word in the sentence
+class TextProcessor(object):
+    """
+    Processes texts of one language with one set of options, see text_processing.
+
+    Everything that does not depend on the text is prepared once:
+        * the sentence and punctuation tokenizers;
+        * the stopwords as a frozenset; and
+        * the stemmer, whose results are memoized per word, as chats repeat the same words
+          over and over again.
+    """
+    def __init__(self, remove_punctuation=True, stemming=True, remove_stopwords=True, language='english', memo_size=MEMO_SIZE):
+        self.remove_punctuation = remove_punctuation
+        self.stemming = stemming
+        self.remove_stopwords = remove_stopwords
+        self.language = language
+        self.memo_size = memo_size
+        # maps every word seen so far to its stemmed or lower case form
+        self.memo = {}
+
+        # Texts often contain punctuation characters.
+        # While we'd like to remove them from our data set, their information shouldn't be lost, as
+        # it would enable us to handle negation in text later on.
         # 
-        # [u'hello'] => [[u'hello']]
-        # [u'hello', u'this is another sentence'] => [[u'hello'], [u'this', u'is', u'another', u'sentence']]
+        # An example:
+        # Given the sentence: 'The movie was not bad.', we could convert all
+        # adjectives in the sentence to antonyms and remove all negations.
+        # Afterwards, the sentence would read 'The movie was good', where 'good'
+        # is the antonym of 'bad'.
         # 
-        # Therefore, in the next step we need to handle a list of lists
-        sentences = [punct_rm_tokenizer.tokenize(s) for s in sentences]
+        # Therefore, punctuation information should not be lost throughout the process of
+        # processing the text with NLP.
+        self.sentence_tokenizer = PunktSentenceTokenizer(PunktParameters())
+
+        # This tokenizer simply removes every character or word which
+        # length is < 2 and is not a alphabetic one
+        self.punct_rm_tokenizer = RegexpTokenizer(r'\w{2,}') if remove_punctuation else None
+
+        self.stopwords = None
+        if remove_stopwords:
+            try:
+                self.stopwords = frozenset(stopwords.words(language))
+            except:
+                print 'There are no stopwords available in this language = ' + language
 
-    if remove_stopwords:
-        try:
-            sentences = [[w for w in sentence if not w in stopwords.words(language)] \
-                                for sentence in sentences]
-        except:
-            print 'There are no stopwords available in this language = ' + language
-
-    # Next, we want to stem on a words basis
-    # What this does for example is convert every word into lowercase, remove morphological
-    # meanings, and so on.
-    if stemming:
         # If desired, stopwords such as 'i', 'me', 'my', 'myself', 'we' can be removed
         # from the text.
-        stemmer = SnowballStemmer(language)
-        sentences = [[stemmer.stem(w) for w in sentence] for sentence in sentences]
-    else:
+        self.stemmer = SnowballStemmer(language) if stemming else None
+
+    def process(self, text):
+        """
+        Returns the processed sentences of a text, just like text_processing.
+        """
+        # tokenize always returns a list of strings divided by punctuation characters
+        # 
+        # 'hello' => [u'hello']
+        # 'Hello this is doge. world.' => [u'Hello this is doge.', u'world.']
+        # 
+        # Therefore, we need to continue handling a list, namely the sentences variable
+        metrics = get_metrics()
+        stopwatch = Stopwatch(metrics, 'text_processing_seconds') if metrics.enabled else None
+        sentences = self.sentence_tokenizer.tokenize(text)
+        if stopwatch is not None:
+            stopwatch.lap('sentences')
+
+        # In the English language at least, 
+        # there are certain stop words, that introduce low-level negation
+        # on a sentence bases.
+        # However, these stop words are often melted with their previous verb
+        # 
+        # isn't = is not
+        # wouldn't = would not
+        # 
+        # This must resolved, as it would not be possible for further functionality of this function to continue
+        # extracting information.
+        # Especially the 'anonymity' functionality wouldn't work without this
+        if self.language == 'english':
+            sentences = [NEGATION_PATTERN.sub(' not', s) for s in sentences]
+            if stopwatch is not None:
+                stopwatch.lap('negation')
+
+        # If desired, the user can no go ahead and remove punctuation from all sentences
+        if self.punct_rm_tokenizer is not None:
+            # In this case, tokenize will return a list of every word in the sentence
+            # 
+            # [u'hello'] => [[u'hello']]
+            # [u'hello', u'this is another sentence'] => [[u'hello'], [u'this', u'is', u'another', u'sentence']]
+            # 
+            # Therefore, in the next step we need to handle a list of lists
+            sentences = [self.punct_rm_tokenizer.tokenize(s) for s in sentences]
+            if stopwatch is not None:
+                stopwatch.lap('punctuation')
+
+        if self.stopwords is not None:
+            sentences = [[w for w in sentence if not w in self.stopwords] for sentence in sentences]
+            if stopwatch is not None:
+                stopwatch.lap('stopwords')
+
+        # Next, we want to stem on a words basis
+        # What this does for example is convert every word into lowercase, remove morphological
+        # meanings, and so on.
         # If stemming is not desired, all words are at least converted into lower case
-        sentences = [[w.lower() for w in sentence] for sentence in sentences]
+        sentences = [[self.normalize(w) for w in sentence] for sentence in sentences]
+        if stopwatch is not None:
+            stopwatch.lap('normalization')
+        return sentences
+
+    def process_many(self, texts):
+        """
+        Processes every text of an iterable, yielding their sentences one text at a time.
+        """
+        for text in texts:
+            yield self.process(text)
+
+    def normalize(self, word):
+        """
+        Returns the stemmed or lower case form of a single word.
+        """
+        try:
+            return self.memo[word]
+        except KeyError:
+            pass
+        if self.stemmer is not None:
+            normalized = self.stemmer.stem(word)
+        else:
+            normalized = word.lower()
+        # The memo is bounded by starting over once it is full.
+        # Frequent words are memoized again right away.
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[word] = normalized
+        return normalized
 
-    return sentences
+    def __repr__(self):
+        return str(self.__dict__)
 
-def build_graph(token_queue, used_names, emo_vector, depth):
+def build_graph(token_queue, used_names, emo_vector, depth, concurrency=CONCURRENCY, max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, scoring=SCORING, client=None, trace=None):
     """
     Emotional features are extracted using ConceptNet5.
 
@@ -166,16 +272,24 @@ def build_graph(token_queue, used_names, emo_vector, depth):
     # - used_names: a list of names that have been previously looked up
     # - emo_vector: a key-value object with emotions as keys and absolute or percentual metrics as values
     # - depth: an integer representing the graph search's depth
+    # - concurrency: the number of lookups allowed to run at the same time on one level
+    # - max_depth, min_weight and scoring: override the parameters in config.cfg
+    # - client: answers the lookups instead of the shared client, e.g. a SubgraphClient
+    # - trace: the SearchTrace collecting the search's metrics, created on the first level if metrics are enabled
     #
     #
     #
     # Cancellation condition:
     # 
     # if MAX_DEPTH is reached, percentages (calc_percentages) are calculated from the absolute values
-    # returned by calc_nodes_weight.
+    # returned by score_node.
     # Subsequently, the function returns, hence execution is done.
-    if depth >= MAX_DEPTH:
+    if trace is None and depth == 0 and get_metrics().enabled:
+        trace = SearchTrace()
+    if depth >= max_depth:
         emo_vector['emotions'] = calc_percentages(emo_vector['emotions'])
+        if trace is not None:
+            trace.finish(get_metrics())
         return emo_vector
 
     # Graph search part:
@@ -186,41 +300,164 @@ def build_graph(token_queue, used_names, emo_vector, depth):
     # We don't want to lookup the same word twice. Lookups are just too time and CPU consuming.
     token_queue_copy = Set(token_queue)
 
+    # The order in which a level is merged decides which parent a shared child is attributed to.
+    # A Set's order depends on memory addresses, hence we sort by name to get reproducible results.
+    level = sorted(token_queue, key=lambda t: t.name)
+    if trace is not None:
+        trace.add_level(depth, len(level), len([t for t in level if t.name not in EMOTIONS]))
+        started = time.time()
+
+    # Lookups of tokens on the same level do not depend on each other, only the merging
+    # of their edges does. Hence, if allowed, the whole level is fetched upfront and merged
+    # afterwards in exactly the order the serial search uses.
+    if concurrency > 1:
+        lookup_errors = expand_frontier([t for t in level if t.name not in EMOTIONS], used_names, concurrency, client=client)
+    else:
+        lookup_errors = None
+    if trace is not None:
+        trace.lookup_seconds += time.time() - started
+
     # We traverse through every token in the set
     # if the token's name does not resemble to one of the searched-for
     # emotion's name, then we proceed diving further down the graph until MAX_DEPTH is reached.
-    for token in token_queue:
+    for token in level:
         
         # if the token's name resembles 
         if token.name in EMOTIONS:
+            if trace is not None:
+                started = time.time()
             try:
-                emo_vector['emotions'][token.name] = emo_vector['emotions'][token.name] + calc_nodes_weight(token, token.name, [], 0)
-            except:
-                emo_vector['emotions'][token.name] = calc_nodes_weight(token, token.name, [], 0)
+                emo_vector['emotions'][token.name] = emo_vector['emotions'][token.name] + score_node(token, scoring)
+            except KeyError:
+                emo_vector['emotions'][token.name] = score_node(token, scoring)
+            if trace is not None:
+                trace.scoring_seconds += time.time() - started
         else:
             token_queue_copy.remove(token)
+            if trace is not None:
+                started = time.time()
             try:
-                token.edge_lookup(used_names, 'en')
+                if lookup_errors is None:
+                    token.edge_lookup(used_names, 'en', client)
+                elif token in lookup_errors:
+                    raise lookup_errors[token]
             except Exception as e:
-                print e
+                if DEBUG:
+                    print e
                 continue
+            finally:
+                if trace is not None:
+                    trace.lookup_seconds += time.time() - started
             for new_edge in token.edges:
-                if new_edge.name not in used_names and new_edge.weight > MIN_WEIGHT:
+                if new_edge.name not in used_names and new_edge.weight > min_weight:
                     used_names.add(new_edge.name)
                     token_queue_copy.add(new_edge)
-    return build_graph(token_queue_copy, used_names, emo_vector, depth+1)
+            # Nodes carry the state of their paths, so the expanded token does not need to hold on
+            # to its children. Releasing them frees every child that was not queued right away.
+            token.edges = []
+    return build_graph(token_queue_copy, used_names, emo_vector, depth+1, concurrency, max_depth, min_weight, scoring, client, trace)
+
+class SearchTrace(object):
+    """
+    Collects the metrics of a single build_graph search and reports them once it is done:
+        * the number of lookups and the deepest level that had to be expanded;
+        * the size of the frontier on every level; and
+        * the time spent on looking up and parsing edges and on scoring paths.
+    How the lookups' time divides into HTTP requests, decoding and parsing is reported
+    by the client and Node.edge_lookup themselves.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.lookups = 0
+        self.depth = 0
+        self.frontiers = []
+        self.lookup_seconds = 0.0
+        self.scoring_seconds = 0.0
+
+    def add_level(self, depth, size, lookups):
+        self.frontiers.append(size)
+        self.lookups += lookups
+        if lookups:
+            self.depth = depth + 1
+
+    def finish(self, metrics):
+        metrics.increment('graph_searches_total')
+        metrics.observe('graph_search_seconds', time.time() - self.started)
+        metrics.observe('graph_search_lookups', self.lookups)
+        metrics.observe('graph_search_depth', self.depth)
+        metrics.observe('graph_search_lookup_seconds', self.lookup_seconds)
+        metrics.observe('graph_search_scoring_seconds', self.scoring_seconds)
+        for level, size in enumerate(self.frontiers):
+            metrics.observe('graph_search_frontier_size', size, {'level': level})
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def expand_frontier(tokens, used_names, concurrency=CONCURRENCY, lang_code='en', client=None):
+    """
+    Looks up the edges of every token of a graph search level on a bounded pool of workers.
+
+    Returns a dictionary mapping every token whose lookup failed to its exception.
+    """
+    # Every worker filters against the same snapshot of used_names.
+    # Names that get used by another token of this level are filtered out again
+    # when the edges are merged, hence the result is identical to the serial search.
+    snapshot = frozenset(used_names)
+    executor = _frontier_executor(concurrency)
+    futures = dict((executor.submit(t.edge_lookup, snapshot, lang_code, client), t) for t in tokens)
+    lookup_errors = {}
+    for future in as_completed(futures):
+        if future.exception() is not None:
+            lookup_errors[futures[future]] = future.exception()
+    return lookup_errors
+
+def _frontier_executor(concurrency):
+    try:
+        return _frontier_executors[concurrency]
+    except KeyError:
+        return _frontier_executors.setdefault(concurrency, ThreadPoolExecutor(max_workers=concurrency))
 
 def calc_percentages(emotions):
     sum_values = sum(emotions.values())
     return {k: v/sum_values for k, v in emotions.items() if v != 0}
 
+def score_node(node, scoring=SCORING):
+    """
+    Scores the path from the searched token to a node.
+
+    Every node carries the state of its path, hence neither recursion nor walking
+    the node's parents is necessary:
+        * 'exact' scores the path's weights just like calc_nodes_weight; and
+        * 'incremental' uses the node's running path weight, where every edge is worth
+          PATH_DECAY times the following one. This is O(1), but yields slightly different results.
+    """
+    if DEBUG:
+        print node.name + ': %s' % (node.path_weights,)
+    if scoring == 'incremental':
+        if node.depth == 0:
+            return 0
+        return node.path_weight/pow(node.depth, 2)
+    return calc_path_weight(node.path_weights[::-1])
+
 def calc_nodes_weight(node, emotion, weights, weight_num):
-    print node.name + ': %d' % node.weight
+    if DEBUG:
+        print node.name + ': %d' % node.weight
     if node.parent == None:
-        for i, n in enumerate(weights):
-            weight_num = weight_num + n/(i+1 * pow(len(weights), 2))
-        print '###########################'
+        weight_num = calc_path_weight(weights, weight_num)
+        if DEBUG:
+            print '###########################'
         return weight_num
     else:
         weights.append(node.weight)
-        return calc_nodes_weight(node.parent, emotion, weights, weight_num)
\ No newline at end of file
+        return calc_nodes_weight(node.parent, emotion, weights, weight_num)
+
+def calc_path_weight(weights, weight_num=0):
+    """
+    Scores a path by the weights of its edges.
+
+    The weights must be ordered from the emotion back to the token,
+    edges closer to the emotion are weighted more.
+    """
+    for i, n in enumerate(weights):
+        weight_num = weight_num + n/(i+1 * pow(len(weights), 2))
+    return weight_num
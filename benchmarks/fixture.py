@@ -0,0 +1,237 @@
+"""
+Stand-ins for ConceptNet that replay a fixture graph.
+
+A fixture is a JSON file mapping 'lang_code/concept' to the result ConceptNet's web-API
+returned for the concept. It is either recorded from a running ConceptNet:
+
+    python -m emotext.benchmarks.fixture record words.txt fixture.json --depth 2
+
+or generated as a random, but reproducible graph (see synthetic_fixture).
+
+A fixture can be replayed by:
+    * a FixtureClient, which answers lookups in-process; or
+    * a FixtureServer, a local HTTP server that a ConceptNetClient can be pointed to.
+Both wait for a configurable latency on every lookup, to simulate the network.
+A FixtureServer can also answer requests with error codes, to simulate an outage (see fail).
+"""
+import argparse
+import json
+import random
+import time
+import urllib
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Lock
+from threading import Thread
+
+from ..apis.concept_net_client import ConceptNetClient
+from ..apis.edge_cache import strip_lookup_result
+from ..apis.text import EMOTIONS
+from ..utils.utils import extr_from_concept_net_edge
+from ..utils.utils import get_config
+
+REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+
+EMPTY_RESULT = {'numFound': 0, 'edges': []}
+
+class FixtureClient(object):
+    """
+    Answers lookups from a fixture, just like a ConceptNetClient would, and counts them.
+    """
+    def __init__(self, fixture, latency=0.0, req_limit=REQ_LIMIT, remote=True):
+        self.fixture = fixture
+        self.latency = latency
+        self.req_limit = req_limit
+        # remote clients have their results cached by the edge cache
+        self.remote = remote
+        self.lookups = 0
+        self.lock = Lock()
+
+    def lookup(self, type, language, key, timeout=None):
+        with self.lock:
+            self.lookups += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return _limit(self.fixture.get('%s/%s' % (language, key.lower()), EMPTY_RESULT), self.req_limit)
+
+    def lookup_many(self, type, language, keys, timeout=None):
+        for k in keys:
+            yield k, self.lookup(type, language, k, timeout), None
+
+    def reset(self):
+        with self.lock:
+            self.lookups = 0
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class FixtureServer(object):
+    """
+    Serves a fixture over HTTP on localhost, in the form of ConceptNet's web-API.
+    """
+    def __init__(self, fixture, port=0, latency=0.0):
+        self.fixture = fixture
+        self.latency = latency
+        self.lookups = 0
+        # status codes the next requests are answered with instead of the fixture
+        self.errors = []
+        self.lock = Lock()
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self.port = self.httpd.server_address[1]
+        self.thread = Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def fail(self, *statuses):
+        """
+        Answers the next requests with the given status codes (e.g. 503) instead of the fixture.
+        """
+        with self.lock:
+            self.errors.extend(statuses)
+
+    def api_url(self):
+        return 'http://127.0.0.1:%d/data' % self.port
+
+    def client(self, **kwargs):
+        """
+        Returns a ConceptNetClient that is connected to this server.
+        """
+        return ConceptNetClient(api_url=self.api_url(), **kwargs)
+
+    def reset(self):
+        with self.lock:
+            self.lookups = 0
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def _handler(server):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        # keep-alive, just like ConceptNet
+        protocol_version = 'HTTP/1.1'
+        # Responses are written at once. Otherwise, headers and body are sent in separate packets,
+        # which delayed acknowledgements turn into a delay of 40ms per request.
+        wbufsize = -1
+
+        def do_GET(self):
+            with server.lock:
+                server.lookups += 1
+                status = server.errors.pop(0) if server.errors else None
+            url = urlparse.urlparse(self.path)
+            limit = int(urlparse.parse_qs(url.query).get('limit', [REQ_LIMIT])[0])
+            # /data/<version>/c/<lang_code>/<concept>
+            parts = [urllib.unquote(p) for p in url.path.split('/')]
+            key = '/'.join(parts[-2:]).decode('utf8').lower()
+            if server.latency:
+                time.sleep(server.latency)
+            if status is not None:
+                self.send_error(status)
+                return
+            body = json.dumps(_limit(server.fixture.get(key, EMPTY_RESULT), limit))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return FixtureHandler
+
+def _limit(result, limit):
+    if limit is None or len(result['edges']) <= limit:
+        return result
+    return {'numFound': limit, 'edges': result['edges'][:limit]}
+
+def load_fixture(path):
+    with open(path) as f:
+        return json.load(f)
+
+def record_fixture(words, path, depth=2, lang_code='en', client=None):
+    """
+    Looks up the given words and every concept up to depth edges away from them,
+    and saves the results as a fixture. Returns the number of recorded concepts.
+    """
+    client = client or ConceptNetClient()
+    fixture = {}
+    frontier = set(w.lower() for w in words)
+    for level in range(depth + 1):
+        next_frontier = set()
+        for key, result, error in client.lookup_many('c', lang_code, sorted(frontier)):
+            if error is not None:
+                print 'Could not look up %s: %s' % (key, error)
+                continue
+            fixture['%s/%s' % (lang_code, key)] = strip_lookup_result(result)
+            for e in result.get('edges', []):
+                for uri in (e['start'], e['end']):
+                    concept = extr_from_concept_net_edge(uri)
+                    name = '%s/%s' % (concept['lang_code'], concept['name'])
+                    if concept['lang_code'] == lang_code and name not in fixture:
+                        next_frontier.add(concept['name'])
+        frontier = next_frontier
+    with open(path, 'w') as f:
+        json.dump(fixture, f)
+    return len(fixture)
+
+def synthetic_fixture(concepts=2000, edges=12000, seed=1, lang_code='en', emotions=EMOTIONS):
+    """
+    Generates a random graph of concepts named 'w0', 'w1', ... and the emotions.
+    The same arguments always generate the same graph.
+    """
+    rng = random.Random(seed)
+    names = ['w%d' % i for i in range(concepts)] + sorted(emotions)
+    adjacency = dict((n, []) for n in names)
+    for i in range(edges):
+        start, end = rng.choice(names), rng.choice(names)
+        if start == end:
+            continue
+        edge = {
+            'start': '/c/%s/%s' % (lang_code, start),
+            'end': '/c/%s/%s' % (lang_code, end),
+            'rel': '/r/RelatedTo',
+            'weight': round(rng.uniform(-0.5, 3.0), 2)
+        }
+        adjacency[start].append(edge)
+        adjacency[end].append(edge)
+    fixture = {}
+    for name, concept_edges in adjacency.items():
+        # ConceptNet returns the heaviest edges first
+        concept_edges.sort(key=lambda e: -e['weight'])
+        fixture['%s/%s' % (lang_code, name)] = {'numFound': len(concept_edges), 'edges': concept_edges}
+    return fixture
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Records or serves a fixture of ConceptNet.')
+    subparsers = parser.add_subparsers(dest='command')
+    record = subparsers.add_parser('record', help='records a fixture from ConceptNet')
+    record.add_argument('words', help='file with one word per line')
+    record.add_argument('out', help='path of the fixture to write')
+    record.add_argument('--depth', type=int, default=2, help='number of edges to follow from every word')
+    record.add_argument('--language', default='en', help='language code of the words')
+    serve = subparsers.add_parser('serve', help='serves a fixture over HTTP')
+    serve.add_argument('fixture', nargs='?', help='recorded fixture (default: a synthetic graph)')
+    serve.add_argument('--port', type=int, default=8084)
+    serve.add_argument('--latency', type=float, default=0.0, help='seconds every lookup takes')
+    args = parser.parse_args()
+    if args.command == 'record':
+        with open(args.words) as f:
+            words = [l.strip().decode('utf8') for l in f if l.strip()]
+        print 'Recorded %d concepts' % record_fixture(words, args.out, args.depth, args.language)
+    else:
+        server = FixtureServer(load_fixture(args.fixture) if args.fixture else synthetic_fixture(),
+            args.port, args.latency)
+        print 'Serving on %s' % server.api_url()
+        server.httpd.serve_forever()
@@ -0,0 +1,268 @@
+"""
+Benchmarks emotext's search path without depending on a live ConceptNet or the caches on disk.
+
+    python -m emotext.benchmarks.run --latency 0.002 --out results.json
+
+Lookups are answered from a fixture (see fixture), either in-process or, with --http,
+by a local stub server through a ConceptNetClient. Every scenario starts from the state it names:
+the word cache is a temporary SQLite database, the edge cache only lives in memory and
+the emotion index is disabled. The scenarios are:
+
+    * text_processing: processing the texts of all messages;
+    * build_graph_cold: searching every word with an empty edge cache;
+    * build_graph_warm: searching the same words again, with the edge cache filled by the cold run;
+    * to_emotion_vector: converting every message, starting with empty caches; and
+    * conversation_run: running conversations of those messages, starting with empty caches.
+
+For every scenario, the results hold the throughput in operations per second, the p50, p95 and p99
+latency of an operation in milliseconds, the number of lookups per word and the peak memory
+of the process so far in KB. Passing the results of an earlier run as --baseline reports
+scenarios that got slower or look up more concepts, and exits with status 1.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from collections import OrderedDict
+
+from ..apis import concept_net_client
+from ..apis import edge_cache
+from ..apis import emotion_index
+from ..apis.concept_net_client import set_client
+from ..apis.edge_cache import EdgeCache
+from ..apis.edge_cache import set_edge_cache
+from ..apis.text import CONCURRENCY
+from ..apis.text import EMOTIONS
+from ..apis.text import text_processing
+from ..models import models
+from ..models.cache_backends import SQLiteCacheBackend
+from ..models.models import MAX_DEPTH
+from ..models.models import MIN_WEIGHT
+from ..models.models import REQ_LIMIT
+from ..models.models import BreadthFirstSearch
+from ..models.models import CacheController
+from ..models.models import Conversation
+from ..models.models import Message
+from .fixture import FixtureClient
+from .fixture import FixtureServer
+from .fixture import load_fixture
+from .fixture import synthetic_fixture
+
+# maps the name of every scenario to its function, in the order they are run
+SCENARIOS = OrderedDict()
+
+def scenario(name):
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+class Benchmark(object):
+    """
+    The state shared by the scenarios of a run.
+    """
+    def __init__(self, fixture, counter, words, texts, conversation_size, max_depth, min_weight, concurrency, workdir):
+        self.fixture = fixture
+        # the FixtureClient or FixtureServer whose lookups are counted
+        self.counter = counter
+        self.words = words
+        self.texts = texts
+        self.conversation_size = conversation_size
+        self.max_depth = max_depth
+        self.min_weight = min_weight
+        self.concurrency = concurrency
+        self.workdir = workdir
+        self.caches = 0
+
+    def strategy(self):
+        return BreadthFirstSearch(max_depth=self.max_depth, min_weight=self.min_weight, concurrency=self.concurrency)
+
+    def empty_caches(self):
+        """
+        Replaces the edge cache and the word cache by empty ones and returns the word cache.
+        """
+        set_edge_cache(EdgeCache(persistent=False))
+        self.caches += 1
+        strategy = self.strategy()
+        backend = SQLiteCacheBackend(self.max_depth, self.min_weight, REQ_LIMIT, strategy.cache_key(),
+            path=os.path.join(self.workdir, 'word_cache_%d.sqlite' % self.caches))
+        cc = CacheController(self.max_depth, self.min_weight, REQ_LIMIT, strategy=strategy, backend=backend)
+        # Conversation.run always uses the default cache
+        models.DEFAULT_CACHE = cc
+        return cc
+
+    def measure(self, operations, words):
+        """
+        Runs every operation once and summarizes their latencies.
+        words is the number of words the operations process, to relate lookups to.
+        """
+        self.counter.reset()
+        latencies = []
+        started = time.time()
+        for operation in operations:
+            t = time.time()
+            operation()
+            latencies.append(time.time() - t)
+        seconds = time.time() - started
+        latencies.sort()
+        return OrderedDict([
+            ('operations', len(latencies)),
+            ('seconds', seconds),
+            ('throughput', len(latencies) / seconds if seconds else 0),
+            ('p50_ms', _percentile(latencies, 50) * 1000),
+            ('p95_ms', _percentile(latencies, 95) * 1000),
+            ('p99_ms', _percentile(latencies, 99) * 1000),
+            ('lookups', self.counter.lookups),
+            ('lookups_per_word', float(self.counter.lookups) / words if words else 0),
+            # ru_maxrss is the peak of the whole process in KB
+            ('peak_memory_kb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        ])
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+@scenario('text_processing')
+def text_processing_scenario(benchmark):
+    words = sum(len(t.split()) for t in benchmark.texts)
+    return benchmark.measure([lambda t=t: text_processing(t) for t in benchmark.texts], words)
+
+@scenario('build_graph_cold')
+def build_graph_cold(benchmark):
+    benchmark.empty_caches()
+    strategy = benchmark.strategy()
+    return benchmark.measure([lambda w=w: strategy.search(w) for w in benchmark.words], len(benchmark.words))
+
+@scenario('build_graph_warm')
+def build_graph_warm(benchmark):
+    # the edge cache is still filled by build_graph_cold
+    strategy = benchmark.strategy()
+    return benchmark.measure([lambda w=w: strategy.search(w) for w in benchmark.words], len(benchmark.words))
+
+@scenario('to_emotion_vector')
+def to_emotion_vector(benchmark):
+    cc = benchmark.empty_caches()
+    words = sum(len(t.split()) for t in benchmark.texts)
+    return benchmark.measure([lambda t=t: Message('bench', t).to_emotion_vector(cc) for t in benchmark.texts], words)
+
+@scenario('conversation_run')
+def conversation_run(benchmark):
+    benchmark.empty_caches()
+    size = benchmark.conversation_size
+    chunks = [benchmark.texts[i:i + size] for i in range(0, len(benchmark.texts), size)]
+    words = sum(len(t.split()) for t in benchmark.texts)
+    # run is called directly, so that the conversation is timed and not the thread
+    return benchmark.measure([lambda c=c: Conversation([Message('bench', t) for t in c]).run() for c in chunks], words)
+
+def run_benchmarks(fixture, latency=0.0, http=False, words=200, messages=200, conversation_size=10, seed=1,
+        max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, concurrency=CONCURRENCY, scenarios=None):
+    """
+    Runs the given scenarios (default: all of them) against a fixture and returns their results.
+    """
+    rng = random.Random(seed)
+    concepts = sorted(set(k.split('/', 1)[1] for k in fixture) - EMOTIONS)
+    sample = rng.sample(concepts, min(words, len(concepts)))
+    texts = [_text(rng, sample) for i in range(messages)]
+
+    server = None
+    if http:
+        server = FixtureServer(fixture, latency=latency).start()
+        client = server.client()
+        counter = server
+    else:
+        client = counter = FixtureClient(fixture, latency)
+
+    # Everything that is replaced is restored afterwards
+    saved = (concept_net_client._default_client, edge_cache._edge_cache, edge_cache.EDGE_CACHE_ENABLED,
+        emotion_index.EMOTION_INDEX_ENABLED, models.DEFAULT_CACHE)
+    workdir = tempfile.mkdtemp(prefix='emotext_benchmark_')
+    try:
+        set_client(client)
+        emotion_index.EMOTION_INDEX_ENABLED = False
+        benchmark = Benchmark(fixture, counter, sample, texts, conversation_size, max_depth, min_weight, concurrency, workdir)
+        results = OrderedDict()
+        results['parameters'] = OrderedDict([
+            ('concepts', len(fixture)),
+            ('words', len(sample)),
+            ('messages', len(texts)),
+            ('latency', latency),
+            ('http', http),
+            ('max_depth', max_depth),
+            ('min_weight', min_weight),
+            ('concurrency', concurrency),
+            ('req_limit', REQ_LIMIT)
+        ])
+        for name in scenarios or SCENARIOS.keys():
+            results[name] = SCENARIOS[name](benchmark)
+        return results
+    finally:
+        concept_net_client._default_client, edge_cache._edge_cache, edge_cache.EDGE_CACHE_ENABLED, \
+            emotion_index.EMOTION_INDEX_ENABLED, models.DEFAULT_CACHE = saved
+        if server is not None:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Returns a description of every scenario that has a lower throughput or more lookups per word
+    than in the baseline, by more than the given fraction.
+    """
+    regressions = []
+    for name in SCENARIOS:
+        if name not in results or name not in baseline:
+            continue
+        new, old = results[name], baseline[name]
+        if new['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput dropped from %.1f to %.1f operations/sec' % (name, old['throughput'], new['throughput']))
+        if new['lookups_per_word'] > old['lookups_per_word'] * (1 + tolerance):
+            regressions.append('%s: lookups per word rose from %.2f to %.2f' % (name, old['lookups_per_word'], new['lookups_per_word']))
+    return regressions
+
+def _text(rng, words):
+    # Chats repeat few words very often, hence words are drawn from a long-tailed distribution
+    length = rng.randint(3, 15)
+    return ' '.join(words[int(rng.paretovariate(1.0)) % len(words)] for i in range(length)) + '.'
+
+def _percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks emotext's search path against a fixture of ConceptNet.")
+    parser.add_argument('--fixture', help='recorded fixture (default: a synthetic graph)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every lookup takes')
+    parser.add_argument('--http', action='store_true', help='look up concepts from a local stub server over HTTP')
+    parser.add_argument('--words', type=int, default=200, help='number of distinct words')
+    parser.add_argument('--messages', type=int, default=200, help='number of messages')
+    parser.add_argument('--conversation-size', type=int, default=10, help='messages per conversation')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH)
+    parser.add_argument('--min-weight', type=int, default=MIN_WEIGHT)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--scenarios', help='comma-separated scenarios (default: %s)' % ','.join(SCENARIOS))
+    parser.add_argument('--out', help='file the results are written to (default: stdout)')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='fraction a scenario may get worse than the baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks(load_fixture(args.fixture) if args.fixture else synthetic_fixture(), args.latency,
+        args.http, args.words, args.messages, args.conversation_size, args.seed, args.max_depth, args.min_weight,
+        args.concurrency, args.scenarios.split(',') if args.scenarios else None)
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+
+    if args.baseline:
+        regressions = compare(results, load_fixture(args.baseline), args.tolerance)
+        for r in regressions:
+            print >>sys.stderr, 'Regression in ' + r
+        sys.exit(1 if regressions else 0)
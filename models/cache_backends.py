@@ -0,0 +1,235 @@
+"""
+Storages a CacheController can save its words in.
+
+Every backend is bound to one set of parameters (max_depth, min_weight, req_limit and
+the search strategy's cache key), as those alter the results of a word immensely.
+
+    * ShelveCacheBackend saves every parameter set in its own shelve file, just like
+      CacheController always did. It cannot be shared by several processes.
+    * SQLiteCacheBackend saves all parameter sets in one SQLite database, using the
+      parameters as columns. It runs in WAL mode, so several processes can share
+      one warm cache.
+
+Existing shelve caches can be copied to a SQLite database:
+
+    python -m emotext.models.cache_backends word_cache_3_0_20 --to word_cache.sqlite
+"""
+import argparse
+import json
+import os
+import re
+import shelve
+import sqlite3
+
+from threading import Lock
+from threading import local
+
+from ..utils.utils import get_config
+
+# Either 'shelve' or 'sqlite'
+CACHE_BACKEND = get_config('cache', 'BACKEND', 'get', 'shelve')
+CACHE_PATH = get_config('cache', 'PATH', 'get', './word_cache.sqlite')
+# Seconds a process waits for another one to finish writing
+CACHE_TIMEOUT = get_config('cache', 'TIMEOUT', 'getfloat', 30.0)
+
+# SQLite limits the number of variables of a single statement
+SQLITE_BATCH_SIZE = 500
+
+class CacheBackend(object):
+    """
+    Interface of a storage of emotion-vectors by word.
+    """
+    def __init__(self, max_depth, min_weight, req_limit, strategy_key=''):
+        self.max_depth = max_depth
+        self.min_weight = min_weight
+        self.req_limit = req_limit
+        self.strategy_key = strategy_key
+
+    def fetch_words(self, words):
+        """
+        Returns a dictionary of all given words that have been found.
+        """
+        raise NotImplementedError()
+
+    def add_words(self, vectors):
+        """
+        Saves a dictionary of emotion-vectors by word, overwriting existing ones.
+        """
+        raise NotImplementedError()
+
+    def words(self):
+        """
+        Iterates over all (word, emotion-vector) tuples of this parameter set.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class ShelveCacheBackend(CacheBackend):
+    """
+    Saves every parameter set in its own shelve file in the current working directory.
+    """
+    def __init__(self, max_depth, min_weight, req_limit, strategy_key='', path=None):
+        CacheBackend.__init__(self, max_depth, min_weight, req_limit, strategy_key)
+        self.path = path or shelve_path(max_depth, min_weight, req_limit, strategy_key)
+        self.cache = shelve.open(self.path)
+        # shelve does not allow concurrent access
+        self.lock = Lock()
+
+    def fetch_words(self, words):
+        found = {}
+        with self.lock:
+            for word in words:
+                try:
+                    found[word] = self.cache[word.encode('utf8')]
+                except KeyError:
+                    pass
+        return found
+
+    def add_words(self, vectors):
+        with self.lock:
+            for word, vector in vectors.items():
+                self.cache[word.encode('utf8')] = vector
+
+    def words(self):
+        with self.lock:
+            keys = self.cache.keys()
+        for key in keys:
+            yield key.decode('utf8'), self.cache[key]
+
+    def close(self):
+        with self.lock:
+            self.cache.close()
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Saves all parameter sets in one SQLite database.
+    """
+    def __init__(self, max_depth, min_weight, req_limit, strategy_key='', path=CACHE_PATH, timeout=CACHE_TIMEOUT):
+        CacheBackend.__init__(self, max_depth, min_weight, req_limit, strategy_key)
+        self.path = path
+        self.timeout = timeout
+        # sqlite3 connections must not be shared by threads
+        self.local = local()
+        conn = self.connection()
+        # WAL mode lets readers continue while another process writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS word_cache (
+                    word TEXT NOT NULL,
+                    max_depth INTEGER NOT NULL,
+                    min_weight INTEGER NOT NULL,
+                    req_limit INTEGER NOT NULL,
+                    strategy TEXT NOT NULL,
+                    vector TEXT NOT NULL,
+                    PRIMARY KEY (max_depth, min_weight, req_limit, strategy, word)
+                )''')
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def fetch_words(self, words):
+        words = list(words)
+        found = {}
+        conn = self.connection()
+        for i in range(0, len(words), SQLITE_BATCH_SIZE):
+            batch = words[i:i + SQLITE_BATCH_SIZE]
+            rows = conn.execute('SELECT word, vector FROM word_cache WHERE max_depth = ? AND min_weight = ? ' \
+                'AND req_limit = ? AND strategy = ? AND word IN (%s)' % ','.join('?' * len(batch)),
+                self._params() + tuple(batch))
+            for word, vector in rows:
+                found[word] = json.loads(vector)
+        return found
+
+    def add_words(self, vectors):
+        conn = self.connection()
+        # a single transaction for all words
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO word_cache ' \
+                '(max_depth, min_weight, req_limit, strategy, word, vector) VALUES (?, ?, ?, ?, ?, ?)',
+                [self._params() + (word, json.dumps(vector)) for word, vector in vectors.items()])
+
+    def words(self):
+        rows = self.connection().execute('SELECT word, vector FROM word_cache WHERE max_depth = ? ' \
+            'AND min_weight = ? AND req_limit = ? AND strategy = ?', self._params())
+        for word, vector in rows:
+            yield word, json.loads(vector)
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def _params(self):
+        return (self.max_depth, self.min_weight, self.req_limit, self.strategy_key)
+
+BACKENDS = {
+    'shelve': ShelveCacheBackend,
+    'sqlite': SQLiteCacheBackend
+}
+
+def get_backend(max_depth, min_weight, req_limit, strategy_key='', name=CACHE_BACKEND):
+    """
+    Instantiates the backend set by BACKEND in config.cfg for a parameter set.
+    """
+    try:
+        return BACKENDS[name](max_depth, min_weight, req_limit, strategy_key)
+    except KeyError:
+        raise Exception('Unknown cache backend: %s' % name)
+
+def shelve_path(max_depth, min_weight, req_limit, strategy_key=''):
+    # for every form those parameters can take, a new .db file is created on the hard drive.
+    path = './word_cache_%d_%d_%d' % (max_depth, min_weight, req_limit)
+    # the default breadth-first search has no key, so its caches keep their original name
+    if strategy_key:
+        path = path + '_' + strategy_key
+    return path
+
+def migrate_shelve(path, sqlite_path=CACHE_PATH):
+    """
+    Copies a shelve cache into a SQLite database.
+    The parameter set is read from the shelve's file name, e.g. 'word_cache_3_0_20'.
+
+    Returns the number of copied words.
+    """
+    # shelve appends extensions such as .db, .dat or .dir depending on the dbm module
+    name = os.path.basename(path)
+    match = re.match(r'word_cache_(\d+)_(-?\d+)_(\d+)(?:_(.+?))?(?:\.db|\.dat|\.dir|\.bak)?$', name)
+    if match is None:
+        raise Exception('%s is not named like a word cache.' % path)
+    max_depth, min_weight, req_limit, strategy_key = match.groups()
+    source = ShelveCacheBackend(int(max_depth), int(min_weight), int(req_limit), strategy_key or '',
+        path=re.sub(r'(\.db|\.dat|\.dir|\.bak)$', '', path))
+    target = SQLiteCacheBackend(int(max_depth), int(min_weight), int(req_limit), strategy_key or '', path=sqlite_path)
+    batch = {}
+    count = 0
+    for word, vector in source.words():
+        batch[word] = vector
+        if len(batch) >= SQLITE_BATCH_SIZE:
+            target.add_words(batch)
+            count += len(batch)
+            batch = {}
+    target.add_words(batch)
+    count += len(batch)
+    source.close()
+    target.close()
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Copies shelve word caches into a SQLite database.')
+    parser.add_argument('shelves', nargs='+', help='shelve word caches, e.g. word_cache_3_0_20')
+    parser.add_argument('--to', default=CACHE_PATH, help='path of the SQLite database')
+    args = parser.parse_args()
+    for path in args.shelves:
+        print 'Copied %d words from %s' % (migrate_shelve(path, args.to), path)
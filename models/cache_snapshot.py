@@ -0,0 +1,200 @@
+"""
+Read-only snapshots of a word cache.
+
+Every process that opens a CacheController holds its own handle of the cache's backend,
+and a new node starts with an empty cache. A snapshot exports the words of one parameter set
+into an immutable file instead, which is opened using mmap. All processes of a node share
+its pages through the OS' page cache, and the file can be shipped to new nodes as is:
+
+    python -m emotext.models.cache_snapshot word_cache.snapshot
+
+The file holds
+    * the parameter set it was exported for;
+    * a table of emotion names, the columns of the snapshot;
+    * a sorted table of words, which is searched using binary search; and
+    * one row of float32 emotion values per word.
+
+Setting SNAPSHOT in config.cfg layers a snapshot underneath the writable cache of every
+CacheController of the same parameter set (see CacheController.fetch_words).
+"""
+import argparse
+import mmap
+import os
+import struct
+
+from array import array
+from threading import Lock
+
+from ..utils.utils import get_config
+from .emotion_matrix import EMOTION_AXIS
+
+# Path of a snapshot used by every CacheController of its parameter set, empty for none
+CACHE_SNAPSHOT = get_config('cache', 'SNAPSHOT', 'get', '')
+
+MAGIC = 'EMOCACHE'
+FORMAT_VERSION = 1
+
+# magic, version, number of words, number of emotions, max_depth, min_weight, req_limit
+HEADER = struct.Struct('<8sIIIiiI')
+# offsets of the sections: strategy key, emotion offsets, emotions, word offsets, words and values
+SECTIONS = struct.Struct('<6Q')
+
+class CacheSnapshot(object):
+    """
+    Opens a file written by export_snapshot and answers fetches of words from it.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_words, self.n_emotions,
+            self.max_depth, self.min_weight, self.req_limit) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise Exception('%s is not a cache snapshot of version %d.' % (path, FORMAT_VERSION))
+        (strategy_key, self.emotion_offsets, self.emotion_names,
+            self.word_offsets, self.words_blob, self.values) = SECTIONS.unpack_from(self.mm, HEADER.size)
+        self.strategy_key = self.mm[strategy_key:self.emotion_offsets].rstrip('\0').decode('utf8')
+        # the columns are saved in the file, so a snapshot stays readable if EMOTIONS change
+        self.emotions = [self._string(self.emotion_offsets, self.emotion_names, j) for j in xrange(self.n_emotions)]
+        self.row = struct.Struct('<%df' % self.n_emotions)
+
+    def matches(self, max_depth, min_weight, req_limit, strategy_key=''):
+        """
+        Returns whether the snapshot was exported for the given parameter set.
+        """
+        return (self.max_depth, self.min_weight, self.req_limit, self.strategy_key) == \
+            (max_depth, min_weight, req_limit, strategy_key)
+
+    def word_id(self, word):
+        """
+        Returns the row of a word using binary search on the sorted words, or None.
+        """
+        key = word.encode('utf8')
+        lo, hi = 0, self.n_words
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = self._string(self.word_offsets, self.words_blob, mid, decode=False)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def fetch_words(self, words):
+        """
+        Returns a dictionary of all given words that are part of the snapshot.
+        """
+        found = {}
+        for word in words:
+            i = self.word_id(word)
+            if i is None:
+                continue
+            row = self.row.unpack_from(self.mm, self.values + self.row.size * i)
+            # just like calc_percentages, emotions that are 0 are left out
+            found[word] = {
+                'name': word,
+                'emotions': dict((e, v) for e, v in zip(self.emotions, row) if v != 0)
+            }
+        return found
+
+    def __len__(self):
+        return self.n_words
+
+    def close(self):
+        self.mm.close()
+
+    def _string(self, offsets, blob, i, decode=True):
+        start, end = struct.unpack_from('<II', self.mm, offsets + 4 * i)
+        s = self.mm[blob + start:blob + end]
+        return s.decode('utf8') if decode else s
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def export_snapshot(backend, path, axis=EMOTION_AXIS):
+    """
+    Writes all words of a cache backend's parameter set to a snapshot at path.
+    Emotions that are not part of the axis are dropped. Returns the number of words.
+
+    The file is written next to path and renamed afterwards, so processes that still
+    have the previous snapshot opened keep reading it unharmed.
+    """
+    columns = dict((e, j) for j, e in enumerate(axis))
+    rows = {}
+    for word, vector in backend.words():
+        row = [0.0] * len(axis)
+        for emotion, value in vector['emotions'].items():
+            if emotion in columns:
+                row[columns[emotion]] = value
+        rows[word.encode('utf8')] = row
+
+    keys = sorted(rows.keys())
+    values = array('f')
+    for key in keys:
+        values.extend(rows[key])
+    word_offsets, word_blob = _string_table(keys)
+    emotion_offsets, emotion_blob = _string_table([e.encode('utf8') for e in axis])
+    sections = [backend.strategy_key.encode('utf8'), emotion_offsets.tostring(), emotion_blob,
+        word_offsets.tostring(), word_blob, values.tostring()]
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        offset = HEADER.size + SECTIONS.size
+        section_offsets = []
+        for section in sections:
+            section_offsets.append(offset)
+            # sections are aligned to 4 bytes
+            offset += len(section) + _padding(len(section))
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(keys), len(axis),
+            backend.max_depth, backend.min_weight, backend.req_limit))
+        out.write(SECTIONS.pack(*section_offsets))
+        for section in sections:
+            out.write(section)
+            out.write('\0' * _padding(len(section)))
+    os.rename(tmp_path, path)
+    return len(keys)
+
+_snapshots = {}
+_snapshots_lock = Lock()
+
+def get_snapshot(max_depth, min_weight, req_limit, strategy_key='', path=CACHE_SNAPSHOT):
+    """
+    Returns the snapshot set by SNAPSHOT in config.cfg, or None if there is none,
+    it cannot be opened or it was exported for another parameter set.
+    """
+    if not path:
+        return None
+    with _snapshots_lock:
+        if path not in _snapshots:
+            # every process maps the file only once, however many CacheControllers it creates
+            try:
+                _snapshots[path] = CacheSnapshot(path)
+            except Exception as e:
+                # DEFAULT_CACHE is created on import, which must not fail because of a missing snapshot
+                print 'The cache snapshot %s could not be opened, words are only cached by the backend: %s' % (path, e)
+                _snapshots[path] = None
+        snapshot = _snapshots[path]
+    if snapshot is None or not snapshot.matches(max_depth, min_weight, req_limit, strategy_key):
+        return None
+    return snapshot
+
+def _string_table(strings):
+    offsets = array('I', [0])
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    return offsets, ''.join(strings)
+
+def _padding(length):
+    return (4 - length % 4) % 4
+
+if __name__ == '__main__':
+    from .models import DEFAULT_CACHE
+
+    parser = argparse.ArgumentParser(description='Exports the word cache of the parameters in config.cfg to a snapshot.')
+    parser.add_argument('out', help='path of the snapshot to write')
+    args = parser.parse_args()
+    backend = DEFAULT_CACHE.backend
+    print 'Exported %d words of max_depth=%d, min_weight=%d, req_limit=%d to %s' % (export_snapshot(backend, args.out),
+        backend.max_depth, backend.min_weight, backend.req_limit, args.out)
@@ -0,0 +1,224 @@
+"""
+Runs emotext over large dumps of messages.
+
+    python -m emotext.models.corpus messages.jsonl emotions.jsonl --workers 8
+
+Every line of the input is a JSON object with the keys entity_name, text, date and language
+(date and language may be missing). Messages are read one at a time and grouped into
+conversations on the fly. A message continues the current conversation, unless
+    * its language differs from the previous message's;
+    * more than --gap seconds have passed since the previous message; or
+    * the conversation already holds --max-messages messages.
+
+Conversations are handed to process_conversations, so only a bounded number of them
+is held in memory at a time. For every message, a line with the emotions-vectors of
+its words is written to the output.
+
+Every few conversations, a checkpoint is saved next to the output. If the job is started
+again, it continues after the last checkpoint instead of starting over.
+"""
+import argparse
+import json
+import os
+import time
+
+from collections import deque
+from datetime import datetime
+
+from ..utils.utils import get_config
+from .models import Conversation
+from .models import Message
+from .processing import WORKERS
+from .processing import process_conversations
+
+# Seconds between two messages that start a new conversation
+CONVERSATION_GAP = get_config('corpus', 'CONVERSATION_GAP', 'getint', 1800)
+# Conversations are split after this many messages, so their size stays bounded
+MAX_MESSAGES = get_config('corpus', 'MAX_MESSAGES', 'getint', 200)
+# Number of conversations after which a checkpoint is saved
+CHECKPOINT_EVERY = get_config('corpus', 'CHECKPOINT_EVERY', 'getint', 100)
+
+EPOCH = datetime(1970, 1, 1)
+
+def process_corpus(input_path, output_path, workers=WORKERS, checkpoint_path=None, gap=CONVERSATION_GAP,
+        max_messages=MAX_MESSAGES, checkpoint_every=CHECKPOINT_EVERY, cache_path=None, progress_interval=10):
+    """
+    Converts every message of a JSONL file to emotions-vectors and writes them to another JSONL file.
+
+    If a checkpoint of a previous run exists, the input is continued right after it.
+    Returns the number of messages written by this run.
+    """
+    checkpoint_path = checkpoint_path or output_path + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    input_file = open(input_path, 'rb')
+    if checkpoint is not None and os.path.exists(output_path):
+        # Everything written after the checkpoint is dropped, as its conversations are processed again
+        output_file = open(output_path, 'r+b')
+        output_file.truncate(checkpoint['output_offset'])
+        output_file.seek(0, os.SEEK_END)
+        input_file.seek(checkpoint['input_offset'])
+        print 'Resuming after line %d of %s' % (checkpoint['line'], input_path)
+    else:
+        output_file = open(output_path, 'wb')
+        checkpoint = {
+            'line': 0,
+            'input_offset': 0,
+            'output_offset': 0,
+            'conversations': 0,
+            'messages': 0
+        }
+
+    # process_conversations yields the conversations in order, hence the position of the
+    # input each of them ends at can be queued alongside
+    ends = deque()
+    def conversations():
+        records = read_records(input_file, checkpoint['line'], checkpoint['input_offset'])
+        for messages, line, offset in group_messages(records, gap, max_messages):
+            ends.append((line, offset))
+            yield Conversation(messages)
+
+    stats = {}
+    messages = 0
+    started = time.time()
+    last_progress = started
+    try:
+        for conversation in process_conversations(conversations(), workers, cache_path=cache_path, stats=stats):
+            line, offset = ends.popleft()
+            for m in conversation.messages:
+                output_file.write(json.dumps({
+                    'line': m.line,
+                    'conversation': checkpoint['conversations'],
+                    'entity_name': m.entity_name,
+                    'date': m.date,
+                    'language': m.language,
+                    'words': m.text
+                }) + '\n')
+            messages += len(conversation.messages)
+            # A checkpoint only covers conversations that have been written completely
+            checkpoint['output_offset'] = output_file.tell()
+            checkpoint['line'] = line
+            checkpoint['input_offset'] = offset
+            checkpoint['conversations'] += 1
+            checkpoint['messages'] += len(conversation.messages)
+
+            if checkpoint['conversations'] % checkpoint_every == 0:
+                _flush(output_file)
+                save_checkpoint(checkpoint_path, checkpoint)
+
+            if progress_interval and time.time() - last_progress >= progress_interval:
+                last_progress = time.time()
+                print_progress(messages, last_progress - started, stats)
+    finally:
+        # also if the job crashed or was interrupted
+        _flush(output_file)
+        save_checkpoint(checkpoint_path, checkpoint)
+        output_file.close()
+        input_file.close()
+
+    print_progress(messages, time.time() - started, stats)
+    return messages
+
+def read_records(input_file, line=0, offset=0):
+    """
+    Yields (record, line number, offset after the line) tuples of a JSONL file,
+    starting after the given line that ends at offset.
+    Lines that cannot be parsed are skipped.
+    """
+    for raw in input_file:
+        line += 1
+        offset += len(raw)
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            print 'Skipping line %d, it is not valid JSON' % line
+            continue
+        yield record, line, offset
+
+def group_messages(records, gap=CONVERSATION_GAP, max_messages=MAX_MESSAGES):
+    """
+    Groups consecutive records into conversations.
+
+    Yields (messages, line, offset) tuples, where line and offset belong to the
+    last record of the conversation.
+    """
+    messages = []
+    last_date = None
+    end = None
+    for record, line, offset in records:
+        language = record.get('language') or 'english'
+        date = parse_date(record.get('date'))
+        if messages and (language != messages[-1].language or len(messages) >= max_messages \
+                or (date is not None and last_date is not None and date - last_date > gap)):
+            yield (messages,) + end
+            messages = []
+        message = Message(record.get('entity_name'), record.get('text') or '', record.get('date'), language)
+        # the line a message was read from identifies it in the output
+        message.line = line
+        messages.append(message)
+        last_date = date if date is not None else last_date
+        end = (line, offset)
+    if messages:
+        yield (messages,) + end
+
+def parse_date(value):
+    """
+    Converts a date given as a timestamp or in ISO 8601 to seconds since the epoch.
+    Returns None, if the date cannot be read.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    for pattern, length in (('%Y-%m-%d %H:%M:%S', 19), ('%Y-%m-%d %H:%M', 16), ('%Y-%m-%d', 10)):
+        try:
+            return (datetime.strptime(value[:length].replace('T', ' '), pattern) - EPOCH).total_seconds()
+        except ValueError:
+            continue
+    return None
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_checkpoint(path, checkpoint):
+    # Renaming is atomic, so a crash while saving leaves the previous checkpoint intact
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + '.tmp', path)
+
+def print_progress(messages, seconds, stats):
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    print '%d messages, %.1f messages/sec, cache hit rate %.1f%%' % (messages, messages / max(seconds, 1e-6),
+        100.0 * stats.get('hits', 0) / lookups if lookups else 0)
+
+def _flush(output_file):
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a JSONL file of messages to emotions-vectors.')
+    parser.add_argument('input', help='JSONL file with entity_name, text, date and language of one message per line')
+    parser.add_argument('output', help='JSONL file the emotions-vectors of every message are written to')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='number of worker processes')
+    parser.add_argument('--checkpoint', help='path of the checkpoint (default: <output>.checkpoint)')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY,
+        help='number of conversations after which a checkpoint is saved')
+    parser.add_argument('--gap', type=int, default=CONVERSATION_GAP,
+        help='seconds between two messages that start a new conversation')
+    parser.add_argument('--max-messages', type=int, default=MAX_MESSAGES, help='maximum messages per conversation')
+    parser.add_argument('--cache', default=None,
+        help='SQLite word cache shared by the workers (default: the backend set in config.cfg)')
+    parser.add_argument('--progress', type=float, default=10, help='seconds between progress reports')
+    args = parser.parse_args()
+    process_corpus(args.input, args.output, args.workers, args.checkpoint, args.gap, args.max_messages,
+        args.checkpoint_every, args.cache, args.progress)
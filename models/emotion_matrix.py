@@ -0,0 +1,77 @@
+"""
+Emotions-vectors as rows of a NumPy matrix.
+
+An emotions-vector is a dictionary like {'name': 'word', 'emotions': {'joy': 0.5, 'fear': 0.5}}.
+Handling thousands of them in Python loops means allocating thousands of dictionaries.
+Therefore, the words of a conversation are converted to a matrix of shape (words, emotions)
+with one fixed column per emotion in EMOTION_AXIS. Computations (e.g. interpolation, see kernels)
+work on the matrix, dictionaries are only built again where emotext hands its results out.
+"""
+import numpy as np
+
+from ..apis.text import EMOTIONS
+
+# The column of every emotion, ordered by name
+EMOTION_AXIS = tuple(sorted(EMOTIONS))
+
+def to_matrix(vectors, axis=EMOTION_AXIS):
+    """
+    Converts a list of emotions-vectors to a matrix with one row per vector.
+    Emotions that are not part of the axis are ignored, missing ones are 0.
+    """
+    columns = dict((e, j) for j, e in enumerate(axis))
+    rows = []
+    cols = []
+    values = []
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            continue
+        for emotion, value in vector['emotions'].items():
+            j = columns.get(emotion)
+            if j is not None:
+                rows.append(i)
+                cols.append(j)
+                values.append(value)
+    matrix = np.zeros((len(vectors), len(axis)))
+    matrix[rows, cols] = values
+    return matrix
+
+def to_vectors(matrix, names, axis=EMOTION_AXIS):
+    """
+    Converts a matrix back to a list of emotions-vectors named by names.
+    Just like calc_percentages, emotions that are 0 are left out.
+    """
+    return [{
+        'name': name,
+        'emotions': dict((axis[j], value) for j, value in enumerate(row) if value != 0)
+    } for name, row in zip(names, matrix.tolist())]
+
+class MatrixBuffer(object):
+    """
+    A matrix that rows can be appended to.
+    Its capacity is doubled whenever it is full, hence appending a row takes amortized constant time.
+    """
+    def __init__(self, columns, capacity=64):
+        self.data = np.zeros((capacity, columns))
+        self.size = 0
+
+    def append(self, rows):
+        size = self.size + len(rows)
+        if size > len(self.data):
+            data = np.zeros((max(size, 2 * len(self.data)), self.data.shape[1]))
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:size] = rows
+        self.size = size
+
+    def view(self):
+        """
+        Returns the filled rows, without copying them.
+        """
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return str(self.__dict__)
@@ -0,0 +1,236 @@
+"""
+Kernels a Conversation interpolates its words with.
+
+A kernel replaces every word's emotions by a weighted average of the emotions of the
+words around it. Every kernel is a subclass of InterpolationKernel and can be selected
+by its name using KERNEL in config.cfg:
+
+    * box: the unweighted average of WIDTH words (the default of 3 words is emotext's
+      original interpolation), computed using prefix sums;
+    * gaussian: a Gaussian of standard deviation SIGMA words, approximated by repeating
+      the box kernel three times;
+    * exponential: weights decay by DECAY per word, computed recursively in both directions; and
+    * message, sentence: every word gets the average of its message or sentence.
+
+Every kernel takes linear time in the number of words, no matter how wide it is.
+"""
+from math import ceil
+from math import log
+from math import log10
+from math import sqrt
+
+import numpy as np
+
+from ..utils.utils import get_config
+
+KERNEL = get_config('interpolation', 'KERNEL', 'get', 'box')
+# Number of words the box kernel averages
+WIDTH = get_config('interpolation', 'WIDTH', 'getint', 3)
+# Standard deviation of the gaussian kernel in words
+SIGMA = get_config('interpolation', 'SIGMA', 'getfloat', 2.0)
+# Factor by which the weight of a word decays per word of distance in the exponential kernel
+DECAY = get_config('interpolation', 'DECAY', 'getfloat', 0.5)
+
+# The exponential kernel ignores words whose weight would be smaller than this
+EXPONENTIAL_CUTOFF = 1e-9
+
+# decaying_sum divides by at most 10^DECAYING_SUM_EXPONENT
+DECAYING_SUM_EXPONENT = 100
+
+# maps the name of every kernel to its class
+KERNELS = {}
+
+class InterpolationKernel(object):
+    """
+    A way of interpolating the rows of a (words, emotions) matrix.
+
+    Subclasses set name and implement radius and filter. If they average over
+    segments of words instead, they set segments to 'message' or 'sentence'
+    and implement apply.
+    """
+    name = None
+    # the kind of segments apply expects, if any
+    segments = None
+
+    def radius(self):
+        """
+        Returns the number of words on either side that alter a word.
+        """
+        return 0
+
+    def apply(self, matrix, circular=True, segments=None, start=0, stop=None):
+        """
+        Returns the interpolated rows start to stop of a matrix.
+
+        If circular, the words at the end of the matrix are followed by the words at its beginning.
+        Otherwise, the weights of the words that do exist are normalized to 1.
+        """
+        n = len(matrix)
+        stop = n if stop is None else stop
+        if start >= stop:
+            return np.zeros((0, matrix.shape[1]))
+        r = self.radius()
+        rows = np.arange(start - r, stop + r)
+        if circular:
+            rows = rows % n
+            weights = np.ones((len(rows), 1))
+        else:
+            weights = ((rows >= 0) & (rows < n)).astype(float)[:, None]
+            rows = np.clip(rows, 0, n - 1)
+        # Filtering the weights as well normalizes the result, also where words are missing
+        values = self.filter(matrix[rows] * weights)[r:len(rows) - r]
+        return values / self.filter(weights)[r:len(rows) - r]
+
+    def filter(self, matrix):
+        """
+        Returns the weighted sums of every row and its neighbours, rows outside of the matrix count as 0.
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class BoxKernel(InterpolationKernel):
+    """
+    Averages every word with the (width - 1) / 2 words on either side.
+    """
+    name = 'box'
+
+    def __init__(self, width=WIDTH):
+        if width < 1:
+            raise Exception('The width of the box kernel must be at least 1')
+        # the box is centered on a word, hence an even width would average width + 1 words
+        if width % 2 == 0:
+            raise Exception('The width of the box kernel must be odd')
+        self.width = width
+
+    def radius(self):
+        return self.width // 2
+
+    def filter(self, matrix):
+        return moving_sum(matrix, self.radius())
+
+class GaussianKernel(InterpolationKernel):
+    """
+    Approximates a Gaussian by applying a box kernel several times.
+    """
+    name = 'gaussian'
+
+    def __init__(self, sigma=SIGMA, passes=3):
+        self.sigma = sigma
+        self.passes = passes
+        # The variance of a box of width w = 2r + 1 is (w^2 - 1) / 12 and the variances of the passes add up
+        self.box_radius = int(round((sqrt(12.0 * sigma * sigma / passes + 1) - 1) / 2))
+
+    def radius(self):
+        return self.passes * self.box_radius
+
+    def filter(self, matrix):
+        for i in range(self.passes):
+            matrix = moving_sum(matrix, self.box_radius)
+        return matrix
+
+class ExponentialKernel(InterpolationKernel):
+    """
+    Weights a word of distance d by decay^d.
+    """
+    name = 'exponential'
+
+    def __init__(self, decay=DECAY):
+        if not 0 <= decay < 1:
+            raise Exception('The decay of the exponential kernel must be at least 0 and less than 1')
+        self.decay = decay
+
+    def radius(self):
+        if self.decay == 0:
+            return 0
+        return int(ceil(log(EXPONENTIAL_CUTOFF) / log(self.decay)))
+
+    def filter(self, matrix):
+        # Instead of summing up every word's neighbours, the sums are carried from word to word.
+        # The word itself is part of both directions, hence it is subtracted once.
+        if self.decay == 0:
+            return matrix
+        forward = decaying_sum(matrix, self.decay)
+        backward = decaying_sum(matrix[::-1], self.decay)[::-1]
+        return forward + backward - matrix
+
+class SegmentKernel(InterpolationKernel):
+    """
+    Gives every word the average of its segment.
+    Segments are passed as one id per word, words of the same segment must be consecutive.
+    """
+    def apply(self, matrix, circular=True, segments=None, start=0, stop=None):
+        # segments do not extend beyond the boundary, hence it does not matter whether it is circular
+        stop = len(matrix) if stop is None else stop
+        if start >= stop:
+            return np.zeros((0, matrix.shape[1]))
+        if segments is None:
+            raise Exception('The %s kernel requires segments' % self.name)
+        ids = np.asarray(segments[start:stop])
+        # the first row of every segment and the row after its last one
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(ids)]))
+        sums = np.vstack((np.zeros((1, matrix.shape[1])), np.cumsum(matrix[start:stop], axis=0)))
+        means = (sums[ends] - sums[starts]) / (ends - starts)[:, None]
+        return np.repeat(means, ends - starts, axis=0)
+
+class MessageKernel(SegmentKernel):
+    name = 'message'
+    segments = 'message'
+
+class SentenceKernel(SegmentKernel):
+    name = 'sentence'
+    segments = 'sentence'
+
+def moving_sum(matrix, radius):
+    """
+    Sums up every row and the radius rows on either side using prefix sums.
+    """
+    n = len(matrix)
+    sums = np.vstack((np.zeros((1, matrix.shape[1])), np.cumsum(matrix, axis=0)))
+    rows = np.arange(n)
+    return sums[np.minimum(rows + radius + 1, n)] - sums[np.maximum(rows - radius, 0)]
+
+def decaying_sum(matrix, decay):
+    """
+    Returns y with y[i] = matrix[i] + decay * y[i - 1].
+
+    Within a block of rows, y[i] = decay^i * (decay * carry + sum of matrix[j] / decay^j for j <= i),
+    where carry is the last row of the previous block. Hence, every block is computed at once
+    using a cumulative sum. Blocks are kept short enough for decay^-j not to overflow.
+    """
+    n = len(matrix)
+    block = max(1, min(n, int(DECAYING_SUM_EXPONENT / -log10(decay))))
+    powers = (decay ** np.arange(block))[:, None]
+    result = np.empty_like(matrix)
+    carry = np.zeros(matrix.shape[1])
+    for start in range(0, n, block):
+        rows = matrix[start:start + block]
+        p = powers[:len(rows)]
+        result[start:start + len(rows)] = p * (np.cumsum(rows / p, axis=0) + decay * carry)
+        carry = result[start + len(rows) - 1]
+    return result
+
+def register_kernel(kernel_class):
+    """
+    Makes an InterpolationKernel selectable by its name.
+    """
+    KERNELS[kernel_class.name] = kernel_class
+    return kernel_class
+
+def get_kernel(name=KERNEL, **kwargs):
+    """
+    Instantiates a registered InterpolationKernel by its name.
+    """
+    try:
+        return KERNELS[name](**kwargs)
+    except KeyError:
+        raise Exception('Unknown interpolation kernel: %s' % name)
+
+register_kernel(BoxKernel)
+register_kernel(GaussianKernel)
+register_kernel(ExponentialKernel)
+register_kernel(MessageKernel)
+register_kernel(SentenceKernel)
@@ -1,57 +1,223 @@
 import json
-import shelve
+import time
+from ..apis.concept_net_client import get_client
+from ..apis.concept_net_client import lookup_failures
 from ..apis.concept_net_client import lookup
 from ..apis.text import build_graph
 from ..apis.text import lang_name_to_code
 from ..utils.utils import extr_from_concept_net_edge
-from ..apis.text import text_processing
+from ..apis.text import get_text_processor
+from ..apis.text import SCORING
+from ..apis.text import PATH_DECAY
+from ..apis.emotion_index import get_emotion_index
+from ..apis.graph_search import SearchStrategy
+from ..apis.graph_search import get_strategy
+from ..apis.graph_search import register_strategy
+from ..apis.subgraph_cache import get_subgraph_store
+from .cache_backends import get_backend
+from .cache_snapshot import get_snapshot
+from .emotion_matrix import EMOTION_AXIS
+from .emotion_matrix import MatrixBuffer
+from .emotion_matrix import to_matrix
+from .emotion_matrix import to_vectors
+from .kernels import get_kernel
 from datetime import datetime
 from sets import Set
 from threading import Thread
 from ..utils.utils import get_config
+from ..utils.metrics import get_metrics
+from ..utils.single_flight import SingleFlight
 from collections import Counter
 
+import numpy as np
+
 MAX_DEPTH = get_config('graph_search', 'MAX_DEPTH', 'getint')
 MIN_WEIGHT = get_config('graph_search', 'MIN_WEIGHT', 'getint')
 REQ_LIMIT = get_config('conceptnet5_parameters', 'REQ_LIMIT', 'getint')
+# Whether interpolation wraps around from the last word of a conversation to the first one
+BOUNDARY = get_config('interpolation', 'BOUNDARY', 'get', 'circular')
+
+# Concurrent searches of the same word with the same strategy are only run once
+_search_flights = SingleFlight('search')
+
+class BreadthFirstSearch(SearchStrategy):
+    """
+    Emotext's default search strategy, which searches forwards from a word using build_graph.
+    """
+    name = 'bfs'
+
+    def __init__(self, scoring=SCORING, **kwargs):
+        SearchStrategy.__init__(self, **kwargs)
+        self.scoring = scoring
+
+    def params(self):
+        # exactly scored results are comparable to the ones cached before scoring was configurable
+        if self.scoring == 'exact':
+            return {}
+        return {'s': self.scoring}
+
+    def search(self, word, lang_code='en'):
+        # If enabled, the word's recorded subgraph is searched instead of ConceptNet
+        store = get_subgraph_store()
+        if store is not None:
+            return store.search(word, lang_code, self.max_depth, self.min_weight, REQ_LIMIT, self.search_graph, get_client())
+        return self.search_graph(word, lang_code)
+
+    def search_graph(self, word, lang_code='en', client=None, max_depth=None, min_weight=None):
+        """
+        Searches a word using the given client and parameters instead of the strategy's ones.
+        """
+        empty_vector = {
+            'name': word,
+            'emotions': {}
+        }
+        return build_graph(Set([Node(word, lang_code, 'c')]), Set([]), empty_vector, 0, self.concurrency,
+            self.max_depth if max_depth is None else max_depth, self.min_weight if min_weight is None else min_weight,
+            self.scoring, client)
+
+register_strategy(BreadthFirstSearch)
+
+class EmotionIndexSearch(BreadthFirstSearch):
+    """
+    Looks words up in the emotion index (see apis.emotion_index) and only searches the ones
+    it lacks breadth-first. The index approximates build_graph, so its results are cached separately.
+    """
+    name = 'index'
+
+    def search(self, word, lang_code='en'):
+        # the index is scored exactly
+        index = get_emotion_index(lang_code, self.max_depth, self.min_weight, REQ_LIMIT) if self.scoring == 'exact' else None
+        vector = index.fetch_word(word) if index is not None else None
+        if vector is not None:
+            return vector
+        return BreadthFirstSearch.search(self, word, lang_code)
+
+register_strategy(EmotionIndexSearch)
 
 class Conversation(Thread):
     """
     A conversation represents a real-world conversation and is essentially
     a collection of single messages.
+
+    A running conversation (e.g. a live chat) can be updated one message at a time using append.
     """
-    def __init__(self, messages):
+    def __init__(self, messages, boundary=BOUNDARY, kernel=None):
         Thread.__init__(self)
         self.messages = messages        
+        # 'circular' interpolates the first word with the last one, 'open' does not
+        self.boundary = boundary
+        # the InterpolationKernel set by KERNEL in config.cfg per default
+        self.kernel = kernel or get_kernel()
+        # the words of all messages, as a MatrixBuffer, once append has been called
+        self.words = None
 
     def run(self):
         self.emotions = self.conv_to_emotion_vectors()
-        self.emotions = self.word_interpolation(self.emotions[0].text)
+        self.emotions = self.word_interpolation(self.emotions[0].text, self.segment_ids(self.emotions[:1]))
+
+    def append(self, message, cc=None, index=None):
+        """
+        Adds a message to the conversation and updates its emotions.
+
+        In contrast to run, the words of all messages are interpolated as one sequence.
+        Only the new message's tokens are resolved, and only the words whose neighbours have
+        changed are interpolated again. Hence, the cost of an update does not depend on
+        the length of the conversation.
+
+        On the first call, the messages the conversation already holds are resolved as well.
+        """
+        if self.words is None:
+            self._start_stream(cc, index)
+        resolve_messages([message], cc or DEFAULT_CACHE, index)
+        self.messages.append(message)
+        self._extend_stream([message])
+        return self
 
-    def word_interpolation(self, words):
+    def _start_stream(self, cc, index):
+        self.messages = list(self.messages)
+        # messages that have not been converted to emotions-vectors yet still hold their text
+        unresolved = [m for m in self.messages if not isinstance(m.text, list)]
+        if unresolved:
+            resolve_messages(unresolved, cc or DEFAULT_CACHE, index)
+        self.words = MatrixBuffer(len(EMOTION_AXIS))
+        self.interpolated = MatrixBuffer(len(EMOTION_AXIS))
+        self.word_names = []
+        self.segments = []
+        self.emotions = []
+        self.matrix = self.interpolated.view()
+        self._extend_stream(self.messages)
+
+    def _extend_stream(self, messages):
+        words = [w for m in messages for w in m.text]
+        old_size = len(self.words)
+        self.words.append(to_matrix(words))
+        self.interpolated.append(np.zeros((len(words), len(EMOTION_AXIS))))
+        self.word_names.extend(w['name'] for w in words)
+        if self.kernel.segments is not None:
+            # segment ids only have to differ from the ones of the neighbouring segments
+            first = self.segments[-1] + 1 if self.segments else 0
+            self.segments.extend(self.segment_ids(messages, first))
+        self.emotions.extend([None] * len(words))
+        size = len(self.words)
+        if size == old_size:
+            return
+
+        # Besides the new words, the previous words within the kernel's radius have new neighbours.
+        # If the boundary is circular, the first words have new neighbours as well.
+        radius = self.kernel.radius()
+        start = max(old_size - radius, 0)
+        self._update_rows(start, size)
+        if self.boundary == 'circular' and old_size > 0:
+            self._update_rows(0, min(radius, start))
+        self.matrix = self.interpolated.view()
+
+    def _update_rows(self, start, stop):
+        values = self.kernel.apply(self.words.view(), self.boundary == 'circular', self.segments or None, start, stop)
+        self.interpolated.data[start:stop] = values
+        # dictionaries are only built for the words that have changed
+        for row, vector in zip(range(start, stop), to_vectors(values, self.word_names[start:stop])):
+            self.emotions[row] = vector
+
+    def word_interpolation(self, words, segments=None):
         """
         Interpolates a list of words.
         List must be structurally identical to self.emotions.
+
+        Kernels that average messages or sentences need the segment of every word, see segment_ids.
+        The interpolated words are kept as a matrix in self.matrix (see emotion_matrix).
         """
-        # In this word-based interpolation, we simply iterate (enumerate, as we need the index) over our
-        # list and calculate the average of the previous and the next element.
+        # In this word-based interpolation, every word is replaced by a weighted average of the words
+        # around it. Per default, this is the average of the previous word, itself and the next word
+        # (see kernels).
         # 
         # A word is a dictionary with a name and a list of emotions.
+        # Instead of averaging dictionaries word by word, all words are converted to a matrix
+        # with one row per word, which is interpolated at once.
         # 
         # For the sake of simplicity, we interpolate the first element with the last,
-        # and the last with the first.
-        interpolated_words = list()
+        # and the last with the first, unless the boundary is 'open'.
+        self.matrix = self.kernel.apply(to_matrix(words), self.boundary == 'circular', segments)
+        return to_vectors(self.matrix, [w['name'] for w in words])
 
-        for i, w in enumerate(words):
-            prev_w = words[i-1]
-            if i == len(words)-1:
-                next_w = words[0]
+    def segment_ids(self, messages, first=0):
+        """
+        Returns the id of the segment of every word of the given (already resolved) messages,
+        or None if the kernel does not use segments.
+        """
+        if self.kernel.segments is None:
+            return None
+        ids = []
+        segment = first
+        for m in messages:
+            if self.kernel.segments == 'message':
+                lengths = [len(m.text)]
             else:
-                next_w = words[i+1]
-            if prev_w is not None and next_w is not None:
-                interpolated_w = self.interpolate_e_vector(prev_w, w, next_w)
-                interpolated_words.append(interpolated_w)
-        return interpolated_words
+                # messages whose sentences are unknown are treated as a single sentence
+                lengths = getattr(m, 'sentence_lengths', None) or [len(m.text)]
+            for length in lengths:
+                ids.extend([segment] * length)
+                segment += 1
+        return ids
 
     def interpolate_e_vector(self, left, middle, right):
         """
@@ -82,12 +248,12 @@ class Conversation(Thread):
             middle['emotions'][e] = (left_e + middle_e + right_e)/3
         return middle
 
-    def conv_to_emotion_vectors(self):
+    def conv_to_emotion_vectors(self, cc=None, index=None):
         """
         Converts a whole conversation and its messages to emotions.
+        Every distinct token of the conversation is resolved only once.
         """
-        messages = list(self.messages)
-        return [m.to_emotion_vector() for m in messages]
+        return resolve_messages(self.messages, cc or DEFAULT_CACHE, index)
 
     def __repr__(self):
         return str(self.__dict__)
@@ -109,13 +275,26 @@ class CacheController():
     # Also, it is very likely that parameters will increase in later versions, hence naming function parameters
     # might be a good idea for everyone reusing this class.
     
-    def __init__(self, max_depth, min_weight, req_limit):
+    def __init__(self, max_depth, min_weight, req_limit, strategy=None, backend=None, snapshot=None):
         self.max_depth = max_depth
         self.min_weight = min_weight
         self.req_limit = req_limit
-
-        # for every form those parameters can take, a new .db file is created on the hard drive.
-        self.cache = shelve.open('./word_cache_%d_%d_%d' % (self.max_depth, self.min_weight, self.req_limit))
+        # the search strategy used for words that are not cached yet, set by SEARCH_MODE per default
+        self.strategy = strategy or get_strategy(max_depth=max_depth, min_weight=min_weight)
+
+        # The backend (set by BACKEND in config.cfg per default) stores the words of exactly
+        # this set of parameters, including the strategy and its limits.
+        self.backend = backend or get_backend(self.max_depth, self.min_weight, self.req_limit, self.strategy.cache_key())
+        # A read-only snapshot (set by SNAPSHOT in config.cfg per default) is asked for words
+        # the backend does not hold. New words are only ever added to the backend.
+        if snapshot is None:
+            snapshot = get_snapshot(self.max_depth, self.min_weight, self.req_limit, self.strategy.cache_key())
+        elif not snapshot.matches(self.max_depth, self.min_weight, self.req_limit, self.strategy.cache_key()):
+            raise Exception('%s was exported for other parameters.' % snapshot.path)
+        self.snapshot = snapshot
+        self.hits = 0
+        self.snapshot_hits = 0
+        self.misses = 0
 
     def add_word(self, word, emotions):
         """
@@ -123,26 +302,59 @@ class CacheController():
 
         This method will overwrite everything of an already given key.
         """
-        word = word.encode("utf8")
-        self.cache[word] = emotions
+        self.backend.add_words({word: emotions})
+
+    def add_words(self, vectors):
+        """
+        Adds a dictionary of emotion dictionaries by word at once.
+        """
+        self.backend.add_words(vectors)
 
     def fetch_word(self, word):
         """
         Fetches a word and returns None if a KeyValue exception is thrown.
         """
         try:
-            word = word.encode("utf8")
-            return self.cache[word]
+            return self.fetch_words([word]).get(word)
         except:
             # in case a word is not found in the cache
             return None
 
+    def fetch_words(self, words):
+        """
+        Fetches a list of words at once and returns a dictionary of the ones that have been found.
+        """
+        words = list(words)
+        found = self.backend.fetch_words(words)
+        if self.snapshot is not None and len(found) < len(words):
+            # words of the backend are newer than the snapshot's, hence they take precedence
+            from_snapshot = self.snapshot.fetch_words([w for w in words if w not in found])
+            self.snapshot_hits += len(from_snapshot)
+            found.update(from_snapshot)
+        self.hits += len(found)
+        self.misses += len(words) - len(found)
+        metrics = get_metrics()
+        if metrics.enabled:
+            metrics.increment('word_cache_hits_total', len(found))
+            metrics.increment('word_cache_misses_total', len(words) - len(found))
+        return found
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'snapshot_hits': self.snapshot_hits,
+            'misses': self.misses
+        }
+
     def __repr__(self):
         """
         Simply returns a dictionary as representation of the object
         """
         return str(self.__dict__)
 
+# The CacheController that is set default to emotext's config settings
+DEFAULT_CACHE = CacheController(max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, req_limit=REQ_LIMIT)
+
 class Message():
     """
     Represents a message a user of Emotext sends to the cofra framework.
@@ -162,10 +374,20 @@ class Message():
     def __setitem__(self, key, value):
         self[key] = value
 
-    def to_emotion_vector(self, cc=CacheController(max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT, req_limit=REQ_LIMIT)):
+    def tokenize(self):
+        """
+        Processes the message's text into a flat list of tokens.
+        """
+        # Process text via Message object method that uses tokenization, stemming, punctuation removal and so on...
+        return flatten_sentences(get_text_processor(stemming=False).process(self.text))
+
+    def to_emotion_vector(self, cc=DEFAULT_CACHE, index=None):
         """
         Converts a message to an emotions-vector.
         This method can be used in combination with a CacheController, which is set default to emotext's config settings.
+
+        If an EmotionIndex is given, or one has been built for emotext's config settings,
+        tokens are looked up in it first.
         """
 
         # A conversation consists of an arbitrary number of messages, which contain
@@ -173,65 +395,193 @@ class Message():
         # 
         # Due to the fact that processing text to emotions is a tedious process,
         # we implemented a Cache Service to enable faster processing of already seen words
-
-        # Process text via Message object method that uses tokenization, stemming, punctuation removal and so on...
-        tokens = " ".join([" ".join([w for w in s]) \
-            for s in \
-            text_processing(self.text, stemming=False)]) \
-            .split()
-
-        # We have to use enumerate here, as a for each loop's reference
-        # would not work appropriately
-        for i, t in enumerate(tokens):
-            empty_vector = {
-                'name': t,
-                'emotions': {}
-            }
-
-            if cc is not None:
-                # we try to use the cache to find the word's emotions
-                pot_t_vector = cc.fetch_word(t)
-                if pot_t_vector is not None:
-                    tokens[i] = pot_t_vector
-                else:
-                    tokens[i] = build_graph(Set([Node(t, lang_name_to_code(self.language), 'c')]), Set([]), empty_vector, 0)
-                    cc.add_word(tokens[i]['name'], tokens[i])
-            else:
-                tokens[i] = build_graph(Set([Node(t, lang_name_to_code(self.language), 'c')]), Set([]), empty_vector, 0)
-        self.text = tokens
+        resolve_messages([self], cc, index)
         return self
 
-class Node():
-    def __init__(self, name, lang_code='en', type='c', rel=None, weight=0, edges=[], parent=None):
+def flatten_sentences(sentences):
+    """
+    Joins the sentences returned by text_processing into a flat list of tokens.
+    """
+    return " ".join([" ".join([w for w in s]) for s in sentences]).split()
+
+def resolve_messages(messages, cc=DEFAULT_CACHE, index=None):
+    """
+    Converts a list of messages to emotions-vectors at once.
+
+    Chats are very repetitive. Hence, the tokens of all messages are collected first
+    and every distinct token is resolved only once, before the results are handed
+    back to the messages.
+    """
+    messages = list(messages)
+    # the same processor Message.tokenize uses, so its memo is shared by all messages
+    processor = get_text_processor(stemming=False)
+    sentences = list(processor.process_many(m.text for m in messages))
+    tokens = [flatten_sentences(s) for s in sentences]
+
+    words_by_language = {}
+    for m, m_tokens in zip(messages, tokens):
+        words_by_language.setdefault(m.language, set()).update(m_tokens)
+    vectors = {}
+    for language, words in words_by_language.items():
+        for word, vector in resolve_tokens(words, lang_name_to_code(language), cc, index).items():
+            vectors[(language, word)] = vector
+
+    for m, m_tokens, m_sentences in zip(messages, tokens, sentences):
+        # Every occurrence gets its own copy, so altering one of them does not alter the others
+        m.text = [copy_vector(vectors[(m.language, t)]) for t in m_tokens]
+        # kept for interpolating sentence by sentence
+        m.sentence_lengths = [len(flatten_sentences([s])) for s in m_sentences]
+    return messages
+
+def resolve_tokens(words, lang_code='en', cc=DEFAULT_CACHE, index=None):
+    """
+    Resolves a collection of distinct words to their emotions-vectors.
+
+    Words are looked up in the emotion index first, then in the cache (at once),
+    and only the remaining ones are searched - each of them exactly once, even if
+    other threads search the same word at the same time.
+    Returns a dictionary of emotions-vectors by word.
+    """
+    words = sorted(set(words))
+    if index is None:
+        index = emotion_index_for(cc, lang_code)
+
+    vectors = {}
+    # The emotion index only contains concepts that are able to reach an emotion.
+    # For all other tokens, we search the graph as usual.
+    if index is not None:
+        for w in words:
+            vector = index.fetch_word(w)
+            if vector is not None:
+                vectors[w] = vector
+    missing = [w for w in words if w not in vectors]
+
+    if cc is not None and missing:
+        # we try to use the cache to find the words' emotions
+        try:
+            vectors.update(cc.fetch_words(missing))
+        except Exception:
+            pass
+        missing = [w for w in missing if w not in vectors]
+
+    strategy = cc.strategy if cc is not None else get_strategy()
+    failures = lookup_failures()
+    found = dict((w, search_word_once(w, lang_code, strategy)) for w in missing)
+    # If lookups failed meanwhile (maybe those of another thread), the words may lack emotions.
+    # They are not cached, so they are searched again once ConceptNet has recovered.
+    if cc is not None and found and lookup_failures() == failures:
+        cc.add_words(found)
+    vectors.update(found)
+    return vectors
+
+def emotion_index_for(cc=DEFAULT_CACHE, lang_code='en'):
+    """
+    Returns the emotion index built for cc's parameters, or None.
+
+    The index is only used by the exactly scored 'index' strategy, as its results differ
+    from the ones of other strategies, and neither if the strategy's limits differ from cc's.
+    """
+    if cc is None:
+        # without a cache, words are searched using the parameters in config.cfg
+        strategy, max_depth, min_weight, req_limit = get_strategy(), MAX_DEPTH, MIN_WEIGHT, REQ_LIMIT
+    else:
+        strategy, max_depth, min_weight, req_limit = cc.strategy, cc.max_depth, cc.min_weight, cc.req_limit
+    if strategy.name != EmotionIndexSearch.name or strategy.params() or (strategy.max_depth, strategy.min_weight) != (max_depth, min_weight):
+        return None
+    return get_emotion_index(lang_code, max_depth, min_weight, req_limit)
+
+def resolve_conversations(conversations, cc=DEFAULT_CACHE, index=None):
+    """
+    Converts a list of conversations at once, resolving every distinct token of all of them only once.
+    Afterwards, every conversation holds its interpolated emotions, just like after running it.
+    """
+    conversations = list(conversations)
+    resolve_messages([m for c in conversations for m in c.messages], cc, index)
+    for c in conversations:
+        first = list(c.messages)[:1]
+        c.emotions = c.word_interpolation(first[0].text, c.segment_ids(first))
+    return conversations
+
+def copy_vector(vector):
+    return {
+        'name': vector['name'],
+        'emotions': dict(vector['emotions'])
+    }
+
+def search_word_once(word, lang_code='en', strategy=None):
+    """
+    Same as search_word, but threads searching the same word with an equal strategy
+    at the same time wait for the first one's result. Every caller gets its own copy.
+    """
+    strategy = strategy or get_strategy()
+    key = (strategy.cache_key(), strategy.max_depth, strategy.min_weight, lang_code, word)
+    return copy_vector(_search_flights.do(key, strategy.search, word, lang_code))
+
+def search_word(word, lang_code='en', strategy=None):
+    """
+    Searches ConceptNet for the emotions of a single word and returns its emotions-vector.
+
+    If no strategy is given, the one set by SEARCH_MODE in config.cfg is used.
+    """
+    return (strategy or get_strategy()).search(word, lang_code)
+
+class Node(object):
+    # A graph search creates hundreds of thousands of nodes.
+    # Using __slots__, none of them needs its own __dict__.
+    __slots__ = ('name', 'lang_code', 'type', 'edges', 'rel', 'weight', 'parent', 'depth', 'path_weights', 'path_weight')
+
+    def __init__(self, name, lang_code='en', type='c', rel=None, weight=0, edges=None, parent=None):
         self.name = name
         self.lang_code = lang_code
         self.type = type
-        self.edges = edges
+        # a shared default list would be shared by all nodes
+        self.edges = edges if edges is not None else []
         self.rel = rel
         self.weight = weight
         self.parent = parent
 
+        # The state of the path from the searched token to this node is carried forward,
+        # so it can be scored without walking back the parents (see apis.text.score_node)
+        if parent is None:
+            self.depth = 0
+            self.path_weights = ()
+            self.path_weight = 0
+        else:
+            self.depth = parent.depth + 1
+            self.path_weights = parent.path_weights + (weight,)
+            self.path_weight = parent.path_weight * PATH_DECAY + weight
+
     def __repr__(self):
         """
         Simply returns a dictionary as representation of the object
         """
-        return str(self.__dict__)
+        return str(self.to_dict())
 
-    def edge_lookup(self, used_names, lang_code='en'):
+    def to_dict(self):
+        """
+        Nodes have no __dict__, this returns an equivalent one.
+        """
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def edge_lookup(self, used_names, lang_code='en', client=None):
         """
         Uses ConceptNet's lookup function to search for all related
         nodes to this one.
 
         Subsequently parses all of those edges and returns nothing
         when update was successful.
+
+        Optionally, a ConceptNetClient can be passed to do the lookup.
         """
         # node must at least have a name to do a lookup
         # otherwise, an exception is raised
         if self.name == None:
             raise Exception('Cannot do edge_lookup without nodes name.')
         # lookup token via ConceptNet web-API
-        req = lookup(self.type, self.lang_code, self.name)
+        req = lookup(self.type, self.lang_code, self.name, client)
         token_res = req
+        metrics = get_metrics()
+        started = time.time() if metrics.enabled else None
         # used_names is a list of objects, however, in order to perform lookups,
         # we need it to be a list of strings
         # if result has more than 0 edges continue
@@ -254,6 +604,8 @@ class Node():
                         edges.append(Node(basic_start['name'], basic_start['lang_code'], basic_start['type'], e['rel'], e['weight'], [], self))
             # if all edges have been processed, add them to the current object
             self.edges = edges
+            if started is not None:
+                metrics.observe('graph_parse_seconds', time.time() - started)
         else:
             # if no edges found on token, raise exception
             raise Exception('Token has no connecting edges.')
@@ -271,4 +623,4 @@ class NodeEncoder(json.JSONEncoder):
     def default(self, obj):
         if not isinstance(obj, Node):
             return super(NodeEncoder, self).default(obj)
-        return obj.__dict__
+        return obj.to_dict()
@@ -0,0 +1,232 @@
+"""
+Warms up the word cache for a vocabulary.
+
+After a deploy or a change of parameters, the word cache starts cold and every first
+occurrence of a word pays for a whole graph search. Instead, a vocabulary can be resolved
+upfront and written into the cache CacheController uses:
+
+    python -m emotext.models.precompute --words words.txt --workers 8 --rate 50
+    python -m emotext.models.precompute --nltk words
+    python -m emotext.models.precompute --corpus messages.jsonl
+
+The vocabulary is either
+    * a file of one word per line;
+    * one of NLTK's word corpora (e.g. words, which has to be downloaded first); or
+    * the distinct tokens of a JSONL file of messages (see corpus).
+Every entry is processed just like the text of a message, so the cache holds exactly the
+tokens messages are split into.
+
+Words are resolved by a pool of threads, while --rate limits the requests sent to ConceptNet
+per second. Words that are cached already are skipped, hence an interrupted run simply
+continues where it stopped when started again. Words whose lookups failed are not cached
+and are tried again as well. Afterwards, the coverage of the vocabulary and the slowest
+words are reported.
+"""
+import argparse
+import heapq
+import time
+
+from threading import Lock
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from ..apis import concept_net_client
+from ..apis.concept_net_client import get_client
+from ..apis.concept_net_client import lookup_failures
+from ..apis.text import get_text_processor
+from ..apis.text import lang_name_to_code
+from ..utils.utils import get_config
+from .corpus import read_records
+from .models import DEFAULT_CACHE
+from .models import flatten_sentences
+from .models import search_word_once
+
+# Number of words resolved at the same time
+PRECOMPUTE_WORKERS = get_config('precompute', 'WORKERS', 'getint', 4)
+# Requests sent to ConceptNet per second, 0 does not limit them
+PRECOMPUTE_RATE = get_config('precompute', 'RATE', 'getfloat', 0.0)
+
+# Number of words fetched from the cache at once
+CACHE_BATCH_SIZE = 1000
+
+class RateLimiter(object):
+    """
+    Lets at most rate calls of acquire return per second, on average.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = time.time()
+        self.lock = Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class RateLimitedClient(object):
+    """
+    Passes lookups on to another client, once the rate limiter allows them.
+    Lookups answered by the edge cache never reach it, so they are not limited.
+    """
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+        self.remote = client.remote
+        self.req_limit = client.req_limit
+
+    def lookup(self, type, language, key, timeout=None):
+        self.limiter.acquire()
+        return self.client.lookup(type, language, key)
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def word_list_vocabulary(path, language='english'):
+    with open(path) as f:
+        return tokenize((l.decode('utf8') for l in f), language)
+
+def nltk_vocabulary(corpus='words', language='english'):
+    from nltk import corpus as corpora
+    try:
+        return tokenize(getattr(corpora, corpus).words(), language)
+    except LookupError:
+        raise Exception("NLTK's corpus %s is missing, download it using: python -m nltk.downloader %s" % (corpus, corpus))
+
+def corpus_vocabulary(path):
+    """
+    Returns the distinct tokens of every language of a JSONL file of messages.
+    """
+    vocabularies = {}
+    with open(path, 'rb') as f:
+        for record, line, offset in read_records(f):
+            language = record.get('language') or 'english'
+            vocabularies.setdefault(language, set()).update(tokenize([record.get('text') or ''], language))
+    return vocabularies
+
+def tokenize(texts, language='english'):
+    """
+    Returns the distinct tokens of some texts, processed like the texts of messages.
+    """
+    # the processor Message.tokenize uses
+    processor = get_text_processor(stemming=False, language=language)
+    tokens = set()
+    for text in texts:
+        tokens.update(flatten_sentences(processor.process(text)))
+    return tokens
+
+def precompute(words, language='english', cc=DEFAULT_CACHE, workers=PRECOMPUTE_WORKERS, rate=PRECOMPUTE_RATE,
+        slowest=10, progress_interval=10):
+    """
+    Resolves every word that is not cached yet and saves it in cc's cache.
+    Returns a report of the vocabulary's coverage and the slowest words.
+    """
+    lang_code = lang_name_to_code(language)
+    words = sorted(set(words))
+    cached = _cached(words, cc)
+    missing = [w for w in words if w not in cached]
+    print '%d of %d words are cached already, resolving %d' % (len(cached), len(words), len(missing))
+
+    client = get_client()
+    if rate:
+        concept_net_client.set_client(RateLimitedClient(client, RateLimiter(rate)))
+    durations = []
+    durations_lock = Lock()
+    def resolve(word):
+        started = time.time()
+        # Unlike resolve_tokens, the emotion index is bypassed, as the word cache is to be warmed up
+        failures = lookup_failures()
+        vector = search_word_once(word, lang_code, cc.strategy)
+        # just like resolve_tokens, words that may lack emotions due to failed lookups are not saved
+        if lookup_failures() == failures:
+            cc.add_word(word, vector)
+        with durations_lock:
+            heapq.heappush(durations, (time.time() - started, word))
+            if len(durations) > slowest:
+                heapq.heappop(durations)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = set()
+    done = 0
+    started = time.time()
+    last_progress = started
+    try:
+        remaining = iter(missing)
+        while True:
+            # a bounded number of words is queued, so an interrupted run stops soon
+            for word in remaining:
+                pending.add(executor.submit(resolve, word))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            # Without a timeout, Python 2 does not interrupt waiting on Ctrl+C
+            finished, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done += 1
+                if future.exception() is not None:
+                    print 'Could not resolve a word: %s' % future.exception()
+            if progress_interval and time.time() - last_progress >= progress_interval:
+                last_progress = time.time()
+                print '%d of %d words, %.1f words/sec' % (done, len(missing), done / (last_progress - started))
+    finally:
+        executor.shutdown(wait=True)
+        concept_net_client.set_client(client)
+
+    # the cache decides what has been resolved, as words whose lookups failed are not saved
+    vectors = _cached(words, cc)
+    return {
+        'words': len(words),
+        'cached_before': len(cached),
+        'resolved': done,
+        'cached': len(vectors),
+        'with_emotions': len([v for v in vectors.values() if v['emotions']]),
+        'seconds': time.time() - started,
+        'slowest': [(w, s) for s, w in sorted(durations, reverse=True)]
+    }
+
+def print_report(report):
+    words = max(report['words'], 1)
+    print 'Resolved %d words in %.1f seconds' % (report['resolved'], report['seconds'])
+    print 'Cached: %d of %d words (%.1f%%)' % (report['cached'], report['words'], 100.0 * report['cached'] / words)
+    print 'Coverage: %d words reach an emotion (%.1f%%)' % (report['with_emotions'], 100.0 * report['with_emotions'] / words)
+    if report['slowest']:
+        print 'Slowest words:'
+        for word, seconds in report['slowest']:
+            print '    %8.2fs  %s' % (seconds, word)
+
+def _cached(words, cc):
+    cached = {}
+    for i in range(0, len(words), CACHE_BATCH_SIZE):
+        cached.update(cc.fetch_words(words[i:i + CACHE_BATCH_SIZE]))
+    return cached
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resolves a vocabulary and saves it in the word cache.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--words', help='file with one word per line')
+    source.add_argument('--nltk', metavar='CORPUS', help="one of NLTK's word corpora, e.g. words")
+    source.add_argument('--corpus', help='JSONL file of messages, whose tokens are resolved')
+    parser.add_argument('--language', default='english', help='language of --words and --nltk')
+    parser.add_argument('--workers', type=int, default=PRECOMPUTE_WORKERS, help='number of words resolved at the same time')
+    parser.add_argument('--rate', type=float, default=PRECOMPUTE_RATE, help='requests per second, 0 does not limit them')
+    parser.add_argument('--slowest', type=int, default=10, help='number of slowest words reported')
+    parser.add_argument('--progress', type=float, default=10, help='seconds between progress reports')
+    args = parser.parse_args()
+
+    if args.corpus:
+        vocabularies = corpus_vocabulary(args.corpus)
+    elif args.nltk:
+        vocabularies = {args.language: nltk_vocabulary(args.nltk, args.language)}
+    else:
+        vocabularies = {args.language: word_list_vocabulary(args.words, args.language)}
+    for language, words in sorted(vocabularies.items()):
+        print 'Vocabulary of %s' % language
+        print_report(precompute(words, language, DEFAULT_CACHE, args.workers, args.rate, args.slowest, args.progress))
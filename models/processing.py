@@ -0,0 +1,130 @@
+"""
+Processes conversations on a pool of worker processes.
+
+Conversation is a Thread. However, tokenizing, stemming and handling vectors is CPU-bound
+Python code, so threads hardly run in parallel. process_conversations spreads conversations
+across processes instead and hands them back in their original order.
+
+The workers use the word cache backend set by BACKEND in config.cfg, just like DEFAULT_CACHE.
+Since shelve files must not be written by several processes (and the parent process already
+opened it for DEFAULT_CACHE), the workers share the SQLite database at PATH instead of a shelve.
+Edges are only cached in each worker's memory.
+"""
+import signal
+
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+from ..apis import concept_net_client
+from ..apis import text
+from ..apis.edge_cache import EDGE_CACHE_ENABLED
+from ..apis.edge_cache import EdgeCache
+from ..apis.edge_cache import set_edge_cache
+from ..apis.graph_search import get_strategy
+from ..utils.utils import get_config
+from . import models
+from .cache_backends import CACHE_BACKEND
+from .cache_backends import CACHE_PATH
+from .cache_backends import SQLiteCacheBackend
+from .cache_backends import get_backend
+from .models import MAX_DEPTH
+from .models import MIN_WEIGHT
+from .models import REQ_LIMIT
+from .models import CacheController
+from .models import Conversation
+from .models import Message
+from .models import resolve_conversations
+
+WORKERS = get_config('processing', 'WORKERS', 'getint', cpu_count())
+
+# Seconds to wait for a single conversation
+RESULT_TIMEOUT = 60 * 60 * 24
+
+# the CacheController of a worker process, set up by _init_worker
+_worker_cache = None
+
+def process_conversations(conversations, workers=WORKERS, max_pending=None, cache_path=None, stats=None):
+    """
+    Processes conversations on a pool of worker processes.
+
+    This is a generator that yields every conversation, once its messages' texts have been
+    converted to emotions-vectors and its emotions have been interpolated (just like after
+    running it). Conversations are yielded in the order they were passed in.
+
+    conversations may be any iterable. At most max_pending conversations (default: 4 per worker)
+    are processed at a time, so long streams are handled with bounded memory.
+
+    The workers use the configured word cache backend, unless a cache_path is passed,
+    in which case they share the SQLite database at cache_path.
+
+    If a dictionary is passed as stats, the word cache hits and misses of all workers
+    are added up in it.
+    """
+    max_pending = max_pending or workers * 4
+    pool = Pool(workers, _init_worker, (cache_path,))
+    pending = deque()
+    finished = False
+    try:
+        for conversation in conversations:
+            conversation.messages = list(conversation.messages)
+            pending.append((conversation, pool.apply_async(_process, (_to_payload(conversation),))))
+            if len(pending) >= max_pending:
+                yield _finish(*pending.popleft(), stats=stats)
+        while pending:
+            yield _finish(*pending.popleft(), stats=stats)
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            # the consumer stopped early or a worker failed
+            pool.terminate()
+        pool.join()
+
+def _to_payload(conversation):
+    # Conversations are Threads, which cannot be pickled, so only their messages are sent
+    return [(m.entity_name, m.text, m.date, m.language) for m in conversation.messages]
+
+def _finish(conversation, result, stats=None):
+    # Without a timeout, Python 2 does not interrupt waiting on a result on Ctrl+C
+    texts, emotions, matrix, cache_stats = result.get(RESULT_TIMEOUT)
+    if stats is not None:
+        for k, v in cache_stats.items():
+            stats[k] = stats.get(k, 0) + v
+    for m, t in zip(conversation.messages, texts):
+        m.text = t
+    conversation.emotions = emotions
+    conversation.matrix = matrix
+    return conversation
+
+def _init_worker(cache_path):
+    global _worker_cache
+    # Ctrl+C is handled by the parent process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Thread pools and connections of the parent process do not survive forking
+    text._frontier_executors.clear()
+    concept_net_client.set_client(None)
+    concept_net_client._web_client = None
+    # calls the parent's threads were running when forking never finish in the worker
+    concept_net_client._lookup_flights.reset()
+    models._search_flights.reset()
+    if EDGE_CACHE_ENABLED:
+        set_edge_cache(EdgeCache(persistent=False))
+    strategy = get_strategy(max_depth=MAX_DEPTH, min_weight=MIN_WEIGHT)
+    if cache_path is None and CACHE_BACKEND != 'shelve':
+        backend = get_backend(MAX_DEPTH, MIN_WEIGHT, REQ_LIMIT, strategy.cache_key())
+    else:
+        # shelve files cannot be shared by processes
+        backend = SQLiteCacheBackend(MAX_DEPTH, MIN_WEIGHT, REQ_LIMIT, strategy.cache_key(), path=cache_path or CACHE_PATH)
+    _worker_cache = CacheController(MAX_DEPTH, MIN_WEIGHT, REQ_LIMIT, strategy=strategy, backend=backend)
+
+def _process(payload):
+    messages = [Message(*m) for m in payload]
+    conversation = Conversation(messages)
+    before = _worker_cache.stats()
+    resolve_conversations([conversation], _worker_cache)
+    after = _worker_cache.stats()
+    # only the hits and misses of this conversation, the parent process adds them up
+    cache_stats = dict((k, after[k] - before[k]) for k in after)
+    return [m.text for m in messages], conversation.emotions, conversation.matrix, cache_stats
@@ -0,0 +1,100 @@
+"""
+Evaluates a grid of search parameters on recorded subgraphs, without any lookups.
+
+    python -m emotext.models.sweep words.txt --max-depth 1,2,3 --min-weight 0,1,2 --req-limit 10,20
+
+Every word is searched with every combination of the given parameters on its subgraph
+(see apis.subgraph_cache). A word needs a subgraph that covers the most permissive combination,
+words without one are skipped and reported. Passing --record looks them up once and records
+their subgraphs first; this is the only time the network is used.
+
+For every combination and word, a line with its emotions-vector is written to --out.
+Afterwards, a summary of every combination is printed.
+"""
+import argparse
+import json
+import sys
+import time
+
+from collections import OrderedDict
+from itertools import product
+
+from ..apis.concept_net_client import get_client
+from ..apis.subgraph_cache import SUBGRAPH_CACHE_PATH
+from ..apis.subgraph_cache import SubgraphClient
+from ..apis.subgraph_cache import SubgraphStore
+from .models import BreadthFirstSearch
+
+def sweep(words, max_depths, min_weights, req_limits, lang_code='en', store=None, record=False, output=None):
+    """
+    Searches every word with every combination of parameters on its subgraph.
+    Returns a summary of every combination and the list of words that had no subgraph.
+    """
+    store = store or SubgraphStore()
+    combinations = list(product(sorted(max_depths), sorted(min_weights), sorted(req_limits)))
+    # the one subgraph of a word all combinations are replayed on
+    permissive = (max(max_depths), min(min_weights), max(req_limits))
+    summaries = OrderedDict((c, {'words': 0, 'with_emotions': 0, 'seconds': 0.0}) for c in combinations)
+    strategies = dict((c, BreadthFirstSearch(max_depth=c[0], min_weight=c[1])) for c in combinations)
+    missing = []
+    for word in words:
+        subgraph = store.fetch(word, lang_code, *permissive)
+        if subgraph is None and record:
+            subgraph = store.record(word, lang_code, permissive[0], permissive[1], permissive[2],
+                strategies[combinations[0]].search_graph, get_client())
+        if subgraph is None:
+            missing.append(word)
+            continue
+        for c in combinations:
+            started = time.time()
+            vector = strategies[c].search_graph(word, lang_code, SubgraphClient(subgraph, c[2]))
+            summary = summaries[c]
+            summary['seconds'] += time.time() - started
+            summary['words'] += 1
+            if vector['emotions']:
+                summary['with_emotions'] += 1
+            if output is not None:
+                output.write(json.dumps({
+                    'max_depth': c[0],
+                    'min_weight': c[1],
+                    'req_limit': c[2],
+                    'word': word,
+                    'emotions': vector['emotions']
+                }) + '\n')
+    return summaries, missing
+
+def print_summary(summaries, missing):
+    print 'max_depth min_weight req_limit    words  coverage  ms/word'
+    for (max_depth, min_weight, req_limit), s in summaries.items():
+        coverage = 100.0 * s['with_emotions'] / s['words'] if s['words'] else 0
+        ms = 1000 * s['seconds'] / s['words'] if s['words'] else 0
+        print '%9d %10d %9d %8d %8.1f%% %8.2f' % (max_depth, min_weight, req_limit, s['words'], coverage, ms)
+    if missing:
+        print '%d words have no subgraph covering the grid, e.g. %s' % (len(missing), ', '.join(missing[:10]))
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluates a grid of search parameters on recorded subgraphs.')
+    parser.add_argument('words', help='file with one word per line')
+    parser.add_argument('--max-depth', type=_ints, required=True, help='comma-separated values of MAX_DEPTH')
+    parser.add_argument('--min-weight', type=_ints, required=True, help='comma-separated values of MIN_WEIGHT')
+    parser.add_argument('--req-limit', type=_ints, required=True, help='comma-separated values of REQ_LIMIT')
+    parser.add_argument('--language', default='en', help='language code of the words')
+    parser.add_argument('--store', default=SUBGRAPH_CACHE_PATH, help='database of the subgraphs')
+    parser.add_argument('--record', action='store_true', help='record missing subgraphs using the network')
+    parser.add_argument('--out', help='file the emotions-vectors are written to as JSON lines')
+    args = parser.parse_args()
+
+    with open(args.words) as f:
+        words = [l.strip().decode('utf8') for l in f if l.strip()]
+    output = open(args.out, 'w') if args.out else None
+    try:
+        summaries, missing = sweep(words, args.max_depth, args.min_weight, args.req_limit, args.language,
+            SubgraphStore(args.store), args.record, output)
+    finally:
+        if output is not None:
+            output.close()
+    print_summary(summaries, missing)
+    sys.exit(1 if missing else 0)
@@ -0,0 +1,232 @@
+"""
+Emotext's RESTful interface.
+
+    python -m emotext.server
+
+All endpoints accept and return JSON:
+    * POST /message: a single message {"entity_name": ..., "text": ..., "date": ..., "language": ...},
+      answered with the emotions-vectors of its words;
+    * POST /messages: a list of messages, answered with a list of results in the same order; and
+    * POST /conversation: {"messages": [...]}, answered with the results of its messages and
+      the conversation's interpolated emotions.
+
+GET /metrics returns the metrics collected so far in Prometheus' text format,
+if a sink that is able to dump them is configured (see utils.metrics).
+
+Requests that arrive at about the same time are resolved together in micro-batches
+(see MicroBatcher), so tokens they share are only looked up once. The word cache,
+the connections to ConceptNet and the batch workers stay alive for the lifetime
+of the process. Other WSGI servers can serve emotext.server:app.
+"""
+import argparse
+import json
+import time
+
+from Queue import Empty
+from Queue import Queue
+from threading import Lock
+from threading import Semaphore
+from threading import Thread
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+from flask import Flask
+from flask import Response
+from flask import request
+
+from .apis.concept_net_client import get_client
+from .apis.edge_cache import get_edge_cache
+from .apis.text import LANG_TO_CODE
+from .apis.text import get_text_processor
+from .models.models import DEFAULT_CACHE
+from .models.models import Conversation
+from .models.models import Message
+from .models.models import emotion_index_for
+from .models.models import resolve_messages
+from .utils.utils import get_config
+from .utils.metrics import get_metrics
+
+HOST = get_config('server', 'HOST', 'get', '127.0.0.1')
+PORT = get_config('server', 'PORT', 'getint', 5000)
+# Seconds a batch waits for further requests, before it is resolved
+BATCH_WINDOW = get_config('server', 'BATCH_WINDOW', 'getfloat', 0.005)
+# Number of messages after which a batch is resolved right away
+BATCH_SIZE = get_config('server', 'BATCH_SIZE', 'getint', 256)
+# Number of batches resolved at the same time
+BATCH_WORKERS = get_config('server', 'BATCH_WORKERS', 'getint', 4)
+# Seconds after which a request is answered with an error
+REQUEST_TIMEOUT = get_config('server', 'REQUEST_TIMEOUT', 'getfloat', 30.0)
+
+class MicroBatcher(object):
+    """
+    Collects the messages of concurrent requests and resolves them together.
+
+    A batch is resolved once BATCH_WINDOW seconds have passed since its first request,
+    or once it holds BATCH_SIZE messages. While all workers are busy, requests keep
+    being added to the next batch, so batches grow with the load.
+    """
+    def __init__(self, window=BATCH_WINDOW, max_size=BATCH_SIZE, workers=BATCH_WORKERS, cc=DEFAULT_CACHE, index=None):
+        self.window = window
+        self.max_size = max_size
+        self.cc = cc
+        self.index = index
+        self.queue = Queue()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # a batch is only collected once a worker is free to resolve it
+        self.free_workers = Semaphore(workers)
+        self.thread = Thread(target=self._collect)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, messages):
+        """
+        Queues a list of messages. Returns a Future, which results in the messages
+        once their texts have been converted to emotions-vectors.
+        """
+        future = Future()
+        self.queue.put((messages, future))
+        return future
+
+    def _collect(self):
+        while True:
+            batch = [self.queue.get()]
+            self.free_workers.acquire()
+            size = len(batch[0][0])
+            deadline = time.time() + self.window
+            while size < self.max_size:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.time(), 0))
+                except Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self.executor.submit(self._resolve, batch)
+
+    def _resolve(self, batch):
+        try:
+            resolve_messages([m for messages, future in batch for m in messages], self.cc, self.index)
+        except Exception as e:
+            for messages, future in batch:
+                future.set_exception(e)
+        else:
+            for messages, future in batch:
+                future.set_result(messages)
+        finally:
+            self.free_workers.release()
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+app = Flask(__name__)
+
+_batcher = None
+_batcher_lock = Lock()
+
+def get_batcher():
+    """
+    Returns the MicroBatcher shared by all requests.
+    It is created on the first request, so that servers forking workers start its thread in every worker.
+    """
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher()
+    return _batcher
+
+def warm_up():
+    """
+    Opens the caches and the connections to ConceptNet before the first request arrives.
+    """
+    get_client()
+    get_edge_cache()
+    get_text_processor(stemming=False)
+    batcher = get_batcher()
+    for lang_code in LANG_TO_CODE.values():
+        emotion_index_for(batcher.cc, lang_code)
+
+@app.route('/message', methods=['POST'])
+def post_message():
+    return _respond(lambda data: _message_result(_resolve([_to_message(data)])[0]))
+
+@app.route('/messages', methods=['POST'])
+def post_messages():
+    def handle(data):
+        if not isinstance(data, list):
+            raise BadRequest('Expected a list of messages')
+        return [_message_result(m) for m in _resolve([_to_message(d) for d in data])]
+    return _respond(handle)
+
+@app.route('/conversation', methods=['POST'])
+def post_conversation():
+    def handle(data):
+        if not isinstance(data, dict) or not isinstance(data.get('messages'), list):
+            raise BadRequest('Expected an object with a list of messages')
+        messages = _resolve([_to_message(d) for d in data['messages']])
+        conversation = Conversation(messages)
+        # just like resolve_conversations, once the messages have been resolved
+        first = messages[:1]
+        emotions = conversation.word_interpolation(first[0].text, conversation.segment_ids(first)) if first else []
+        return {
+            'messages': [_message_result(m) for m in messages],
+            'emotions': emotions
+        }
+    return _respond(handle)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics_dump():
+    metrics = get_metrics()
+    if not hasattr(metrics, 'dump'):
+        return _json_response({'error': 'The metrics sink %s cannot be dumped' % metrics.name}, 404)
+    return Response(metrics.dump(), mimetype='text/plain; version=0.0.4')
+
+class BadRequest(Exception):
+    pass
+
+def _respond(handle):
+    try:
+        data = request.get_json(force=True, silent=True)
+        if data is None:
+            raise BadRequest('The request body is not valid JSON')
+        return _json_response(handle(data))
+    except BadRequest as e:
+        return _json_response({'error': str(e)}, 400)
+    except TimeoutError:
+        return _json_response({'error': 'The request timed out'}, 503)
+    except Exception as e:
+        return _json_response({'error': str(e)}, 500)
+
+def _json_response(data, status=200):
+    # flask's jsonify does not allow lists as top-level objects
+    return Response(json.dumps(data), status=status, mimetype='application/json')
+
+def _resolve(messages):
+    if not messages:
+        return messages
+    return get_batcher().submit(messages).result(REQUEST_TIMEOUT)
+
+def _to_message(data):
+    if not isinstance(data, dict) or not isinstance(data.get('text'), basestring):
+        raise BadRequest('Every message must be an object with a text')
+    language = data.get('language') or 'english'
+    # a single unknown language would fail the whole batch
+    if language not in LANG_TO_CODE:
+        raise BadRequest('Unknown language: %s' % language)
+    return Message(data.get('entity_name'), data['text'], data.get('date'), language)
+
+def _message_result(message):
+    return {
+        'entity_name': message.entity_name,
+        'date': message.date,
+        'language': message.language,
+        'words': message.text
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs emotext's RESTful interface.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    warm_up()
+    app.run(args.host, args.port, threaded=True)
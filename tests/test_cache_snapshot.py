@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests exporting a word cache to a snapshot and layering it underneath a CacheController's backend.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..models.cache_backends import SQLiteCacheBackend
+from ..models.cache_snapshot import CacheSnapshot
+from ..models.cache_snapshot import export_snapshot
+from ..models.cache_snapshot import get_snapshot
+from ..models.models import BreadthFirstSearch
+from ..models.models import CacheController
+
+VECTORS = {
+    u'joy': {'name': u'joy', 'emotions': {'joy': 0.75, 'fear': 0.25}},
+    u'café': {'name': u'café', 'emotions': {'anger': 1.0}},
+    # words without emotions are cached as well
+    u'table': {'name': u'table', 'emotions': {}}
+}
+
+class CacheSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'word_cache.snapshot')
+        backend = self.backend('exported.sqlite')
+        backend.add_words(VECTORS)
+        self.assertEqual(export_snapshot(backend, self.path), len(VECTORS))
+        self.snapshot = CacheSnapshot(self.path)
+
+    def tearDown(self):
+        self.snapshot.close()
+        shutil.rmtree(self.dir)
+
+    def backend(self, name, max_depth=2, min_weight=1):
+        return SQLiteCacheBackend(max_depth, min_weight, 5, '', path=os.path.join(self.dir, name))
+
+    def test_fetch_words(self):
+        self.assertTrue(self.snapshot.matches(2, 1, 5, ''))
+        self.assertFalse(self.snapshot.matches(3, 1, 5, ''))
+        found = self.snapshot.fetch_words(list(VECTORS) + [u'unknown', u'a', u'zzz'])
+        self.assertEqual(found, VECTORS)
+
+    def test_layered_underneath_the_backend(self):
+        backend = self.backend('writable.sqlite')
+        backend.add_words({u'joy': {'name': u'joy', 'emotions': {'surprise': 1.0}}})
+        cc = CacheController(2, 1, 5, strategy=BreadthFirstSearch(max_depth=2, min_weight=1, scoring='exact'),
+            backend=backend, snapshot=self.snapshot)
+        found = cc.fetch_words([u'joy', u'café', u'unknown'])
+        # the backend's words are newer than the snapshot's
+        self.assertEqual(found[u'joy']['emotions'], {'surprise': 1.0})
+        self.assertEqual(found[u'café'], VECTORS[u'café'])
+        self.assertEqual(cc.stats(), {'hits': 2, 'snapshot_hits': 1, 'misses': 1})
+        # new words never reach the snapshot
+        cc.add_word(u'new', {'name': u'new', 'emotions': {}})
+        self.assertEqual(self.snapshot.fetch_words([u'new']), {})
+
+    def test_other_parameters(self):
+        with self.assertRaises(Exception):
+            CacheController(3, 1, 5, strategy=BreadthFirstSearch(max_depth=3, min_weight=1, scoring='exact'),
+                backend=self.backend('other.sqlite', max_depth=3), snapshot=self.snapshot)
+        self.assertIsNone(get_snapshot(3, 1, 5, '', self.path))
+        self.assertIsNotNone(get_snapshot(2, 1, 5, '', self.path))
+
+    def test_missing_snapshot(self):
+        self.assertIsNone(get_snapshot(2, 1, 5, '', os.path.join(self.dir, 'missing.snapshot')))
+
+if __name__ == '__main__':
+    unittest.main()
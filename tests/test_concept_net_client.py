@@ -0,0 +1,155 @@
+"""
+Tests ConceptNetClient against a local stub of ConceptNet's web-API (see benchmarks.fixture).
+"""
+import time
+import unittest
+
+from requests.exceptions import HTTPError
+from requests.exceptions import Timeout
+
+from ..benchmarks.fixture import FixtureServer
+from ..benchmarks.fixture import synthetic_fixture
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.circuit_breaker import CircuitOpenError
+
+FIXTURE = synthetic_fixture(concepts=20, edges=80)
+WORDS = [u'w%d' % i for i in range(10)]
+
+class ConceptNetClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FixtureServer(FIXTURE).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, **kwargs):
+        # a threshold of 0 never opens the breaker, so it does not interfere with retries
+        kwargs.setdefault('breaker', CircuitBreaker(0, 0))
+        kwargs.setdefault('backoff', 0.001)
+        return self.server.client(req_limit=5, **kwargs)
+
+    def test_lookup(self):
+        res = self.client().lookup('c', 'en', u'W1')
+        self.assertEqual(res['edges'], FIXTURE['en/w1']['edges'][:5])
+
+    def test_retries_transient_errors(self):
+        self.server.fail(503, 429)
+        res = self.client(retries=2).lookup('c', 'en', u'w1')
+        self.assertEqual(res['edges'], FIXTURE['en/w1']['edges'][:5])
+        self.assertEqual(self.server.lookups, 3)
+
+    def test_gives_up_after_retries(self):
+        self.server.fail(503, 503, 503)
+        with self.assertRaises(HTTPError):
+            self.client(retries=2).lookup('c', 'en', u'w1')
+        self.assertEqual(self.server.lookups, 3)
+
+    def test_does_not_retry_other_errors(self):
+        self.server.fail(404)
+        with self.assertRaises(HTTPError):
+            self.client(retries=2).lookup('c', 'en', u'w1')
+        self.assertEqual(self.server.lookups, 1)
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+        with self.assertRaises(Timeout):
+            self.client(retries=0, timeout=0.05).lookup('c', 'en', u'w1')
+
+    def test_lookup_many(self):
+        results = list(self.client().lookup_many('c', 'en', WORDS + [u'unknown']))
+        # results arrive in the order the lookups complete, but each one belongs to its key
+        self.assertEqual(sorted(k for k, res, error in results), sorted(WORDS + [u'unknown']))
+        for key, res, error in results:
+            self.assertIsNone(error)
+            self.assertEqual(res['edges'], FIXTURE.get('en/' + key, {'edges': []})['edges'][:5])
+
+    def test_lookup_many_sends_duplicates_once(self):
+        results = list(self.client().lookup_many('c', 'en', [u'w1', u'w1', u'w2']))
+        self.assertEqual(sorted(k for k, res, error in results), [u'w1', u'w2'])
+        self.assertEqual(self.server.lookups, 2)
+
+    def test_lookup_many_errors(self):
+        self.server.fail(404)
+        results = list(self.client(retries=2).lookup_many('c', 'en', WORDS))
+        self.assertEqual(len(results), len(WORDS))
+        errors = [error for k, res, error in results if error is not None]
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], HTTPError)
+        self.assertEqual(self.server.lookups, len(WORDS))
+
+    def test_lookup_many_retries_transient_errors(self):
+        self.server.fail(503, 503)
+        results = list(self.client(retries=2).lookup_many('c', 'en', WORDS))
+        self.assertTrue(all(error is None for k, res, error in results))
+        self.assertEqual(self.server.lookups, len(WORDS) + 2)
+
+    def test_lookup_many_timeout(self):
+        self.server.latency = 0.5
+        results = list(self.client(retries=0, timeout=0.05).lookup_many('c', 'en', WORDS[:3]))
+        self.assertEqual(len(results), 3)
+        for key, res, error in results:
+            self.assertIsInstance(error, Timeout)
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FixtureServer(FIXTURE).start()
+        self.breaker = CircuitBreaker(2, 0.1)
+        self.client = self.server.client(req_limit=5, retries=0, breaker=self.breaker)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def open_breaker(self):
+        self.server.fail(503, 503)
+        for i in range(2):
+            with self.assertRaises(HTTPError):
+                self.client.lookup('c', 'en', u'w1')
+        self.assertEqual(self.breaker.state(), 'open')
+        with self.assertRaises(CircuitOpenError):
+            self.client.lookup('c', 'en', u'w1')
+        self.assertEqual(self.server.lookups, 2)
+        time.sleep(0.15)
+
+    def test_trial_answered_with_404_closes_the_breaker(self):
+        self.open_breaker()
+        self.server.fail(404)
+        with self.assertRaises(HTTPError):
+            self.client.lookup('c', 'en', u'w1')
+        self.assertEqual(self.breaker.state(), 'closed')
+        self.assertEqual(self.client.lookup('c', 'en', u'w1')['edges'], FIXTURE['en/w1']['edges'][:5])
+
+    def test_failed_trial_opens_the_breaker_again(self):
+        self.open_breaker()
+        self.server.fail(503)
+        with self.assertRaises(HTTPError):
+            self.client.lookup('c', 'en', u'w1')
+        self.assertEqual(self.breaker.state(), 'open')
+        with self.assertRaises(CircuitOpenError):
+            self.client.lookup('c', 'en', u'w1')
+
+    def test_lookup_many_sends_a_single_trial(self):
+        self.open_breaker()
+        self.server.fail(404)
+        results = list(self.client.lookup_many('c', 'en', WORDS))
+        self.assertEqual(self.server.lookups, 3)
+        errors = [error for k, res, error in results]
+        self.assertEqual(len([e for e in errors if isinstance(e, HTTPError)]), 1)
+        self.assertEqual(len([e for e in errors if isinstance(e, CircuitOpenError)]), len(WORDS) - 1)
+        self.assertEqual(self.breaker.state(), 'closed')
+        self.assertTrue(all(error is None for k, res, error in self.client.lookup_many('c', 'en', WORDS)))
+
+    def test_abandoned_trial_is_replaced(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        time.sleep(0.15)
+        self.breaker.check()
+        self.assertEqual(self.breaker.state(), 'half-open')
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+        time.sleep(0.15)
+        self.breaker.check()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+Tests that concept_net_client.lookup only shares cached edges between clients of the same limit.
+"""
+import unittest
+
+from ..apis import edge_cache
+from ..apis.concept_net_client import lookup
+from ..apis.edge_cache import EdgeCache
+from ..apis.edge_cache import set_edge_cache
+from ..benchmarks.fixture import FixtureClient
+from ..benchmarks.fixture import synthetic_fixture
+
+FIXTURE = synthetic_fixture(concepts=20, edges=80)
+
+class EdgeCacheLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = edge_cache._edge_cache, edge_cache.EDGE_CACHE_ENABLED
+        set_edge_cache(EdgeCache(persistent=False, req_limit=5))
+
+    def tearDown(self):
+        edge_cache._edge_cache, edge_cache.EDGE_CACHE_ENABLED = self.saved
+
+    def test_same_limit_is_cached(self):
+        client = FixtureClient(FIXTURE, req_limit=5)
+        first = lookup('c', 'en', u'w1', client)
+        self.assertEqual(lookup('c', 'en', u'w1', client), first)
+        self.assertEqual(client.lookups, 1)
+
+    def test_other_limits_bypass_the_cache(self):
+        lookup('c', 'en', u'w1', FixtureClient(FIXTURE, req_limit=5))
+        for limit in (2, 8):
+            client = FixtureClient(FIXTURE, req_limit=limit)
+            res = lookup('c', 'en', u'w1', client)
+            self.assertEqual(res['edges'], FIXTURE['en/w1']['edges'][:limit])
+            self.assertEqual(client.lookups, 1)
+
+if __name__ == '__main__':
+    unittest.main()
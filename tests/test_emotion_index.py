@@ -0,0 +1,107 @@
+"""
+Tests the emotion index against build_graph on a synthetic fixture, and that resolve_tokens
+only uses an index that matches the cache's strategy and parameters.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..apis import concept_net_client
+from ..apis.emotion_index import EmotionIndex
+from ..apis.emotion_index import build_emotion_index
+from ..apis.graph_search import BeamSearch
+from ..benchmarks.fixture import FixtureClient
+from ..benchmarks.fixture import synthetic_fixture
+from ..models import models
+from ..models.cache_backends import SQLiteCacheBackend
+from ..models.models import BreadthFirstSearch
+from ..models.models import CacheController
+from ..models.models import EmotionIndexSearch
+from ..models.models import emotion_index_for
+from ..models.models import resolve_tokens
+
+FIXTURE = synthetic_fixture(concepts=60, edges=300)
+
+class EmotionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved_client = concept_net_client._default_client
+        # a local client is not cached by the edge cache
+        self.client = FixtureClient(FIXTURE, req_limit=5, remote=False)
+        concept_net_client.set_client(self.client)
+        path = os.path.join(self.dir, 'index')
+        self.assertGreater(build_emotion_index('en', 3, 0, 5, path), 0)
+        self.index = EmotionIndex(path)
+        self.bfs = BreadthFirstSearch(max_depth=3, min_weight=0, scoring='exact', concurrency=1)
+        self.get_emotion_index = models.get_emotion_index
+        models.get_emotion_index = lambda *args: self.index
+
+    def tearDown(self):
+        models.get_emotion_index = self.get_emotion_index
+        self.index.close()
+        concept_net_client.set_client(self.saved_client)
+        shutil.rmtree(self.dir)
+
+    def words(self):
+        return sorted(k.decode('utf8') for k in self.index.index.keys())
+
+    def test_emotions_are_found_by_build_graph(self):
+        # every emotion of the index is reachable by build_graph, though it may score another path
+        for word in self.words():
+            emotions = self.index.fetch_word(word)['emotions']
+            self.assertTrue(set(emotions) <= set(self.bfs.search_graph(word, client=self.client)['emotions']), word)
+
+    def test_bfs_ignores_the_index(self):
+        words = self.words()
+        cc = CacheController(3, 0, 5, strategy=self.bfs, backend=SQLiteCacheBackend(3, 0, 5, '',
+            path=os.path.join(self.dir, 'cache.sqlite')))
+        vectors = resolve_tokens(words, cc=cc)
+        for word in words:
+            self.assertEqual(vectors[word], self.bfs.search_graph(word, client=self.client))
+
+    def test_index_search(self):
+        strategy = EmotionIndexSearch(max_depth=3, min_weight=0, scoring='exact', concurrency=1)
+        for word in self.words():
+            self.assertEqual(strategy.search(word), self.index.fetch_word(word))
+        # words the index lacks are searched breadth-first
+        missing = [w for w in [u'w%d' % i for i in range(60)] if w not in self.index]
+        self.assertTrue(missing)
+        for word in missing:
+            self.assertEqual(strategy.search(word), self.bfs.search_graph(word, client=self.client))
+
+class EmotionIndexForTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.requested = []
+        self.get_emotion_index = models.get_emotion_index
+        models.get_emotion_index = lambda *args: self.requested.append(args) or 'index'
+
+    def tearDown(self):
+        models.get_emotion_index = self.get_emotion_index
+        shutil.rmtree(self.dir)
+
+    def cache(self, strategy, max_depth=2, min_weight=1, req_limit=5):
+        backend = SQLiteCacheBackend(max_depth, min_weight, req_limit, strategy.cache_key(),
+            path=os.path.join(self.dir, 'cache.sqlite'))
+        return CacheController(max_depth, min_weight, req_limit, strategy=strategy, backend=backend)
+
+    def test_parameters_of_the_cache(self):
+        cc = self.cache(EmotionIndexSearch(max_depth=2, min_weight=1, scoring='exact'))
+        self.assertEqual(emotion_index_for(cc, 'de'), 'index')
+        self.assertEqual(self.requested, [('de', 2, 1, 5)])
+
+    def test_other_strategies(self):
+        self.assertIsNone(emotion_index_for(self.cache(BeamSearch(max_depth=2, min_weight=1, beam_width=3))))
+        self.assertIsNone(emotion_index_for(self.cache(BreadthFirstSearch(max_depth=2, min_weight=1, scoring='exact'))))
+        self.assertIsNone(emotion_index_for(self.cache(EmotionIndexSearch(max_depth=2, min_weight=1, scoring='incremental'))))
+        self.assertEqual(self.requested, [])
+
+    def test_strategy_with_other_limits(self):
+        self.assertIsNone(emotion_index_for(self.cache(EmotionIndexSearch(max_depth=3, min_weight=1, scoring='exact'))))
+        self.assertEqual(self.requested, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Tests the search strategies of apis.graph_search against build_graph on a synthetic fixture.
+"""
+import unittest
+
+from ..apis import concept_net_client
+from ..apis import graph_search
+from ..apis.graph_search import bidirectional_search
+from ..benchmarks.fixture import FixtureClient
+from ..benchmarks.fixture import synthetic_fixture
+from ..models.models import BreadthFirstSearch
+
+FIXTURE = synthetic_fixture(concepts=60, edges=300)
+WORDS = [u'w%d' % i for i in range(60)]
+
+class BidirectionalSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_client = concept_net_client._default_client
+        # a local client is not cached by the edge cache
+        self.client = FixtureClient(FIXTURE, req_limit=5, remote=False)
+        concept_net_client.set_client(self.client)
+        graph_search._backward_frontiers.clear()
+
+    def tearDown(self):
+        concept_net_client.set_client(self.saved_client)
+        graph_search._backward_frontiers.clear()
+
+    def assert_found_by_bfs(self, max_depth):
+        bfs = BreadthFirstSearch(max_depth=max_depth, min_weight=0, scoring='exact', concurrency=1)
+        same = 0
+        for word in WORDS:
+            emotions = set(bidirectional_search(word, 'en', max_depth, 0, 1)['emotions'])
+            bfs_emotions = set(bfs.search_graph(word, client=self.client)['emotions'])
+            self.assertTrue(emotions <= bfs_emotions, word)
+            same += emotions == bfs_emotions
+        # only a few words lack emotions
+        self.assertGreater(same, len(WORDS) * 0.9)
+
+    def test_emotions_are_found_by_bfs(self):
+        self.assert_found_by_bfs(3)
+
+    def test_deeper_backward_search(self):
+        # searches two edges backwards
+        self.assert_found_by_bfs(4)
+
+if __name__ == '__main__':
+    unittest.main()
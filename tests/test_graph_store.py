@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Tests importing tiny ConceptNet dumps into a graph store and looking up concepts in it.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..apis.graph_store import GraphStore
+from ..apis.graph_store import import_dump
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# The edges of both dumps, as ConceptNet's web-API would return them by concept.
+# Edges to other languages, loops and lines without a valid weight are left out.
+EXPECTED = {
+    u'dog': [
+        {'start': '/c/en/dog', 'end': '/c/en/animal', 'rel': '/r/IsA', 'weight': 2.0},
+        {'start': '/c/en/dog', 'end': '/c/en/bark', 'rel': '/r/RelatedTo', 'weight': 1.5},
+        {'start': '/c/en/cat', 'end': '/c/en/dog', 'rel': '/r/RelatedTo', 'weight': 0.5}
+    ],
+    u'cat': [
+        {'start': '/c/en/cat', 'end': '/c/en/joy', 'rel': '/r/Desires', 'weight': 1.0},
+        {'start': '/c/en/cat', 'end': '/c/en/dog', 'rel': '/r/RelatedTo', 'weight': 0.5}
+    ],
+    u'coffee': [
+        {'start': u'/c/en/café', 'end': '/c/en/coffee', 'rel': '/r/RelatedTo', 'weight': 1.25}
+    ],
+    u'café': [
+        {'start': u'/c/en/café', 'end': '/c/en/coffee', 'rel': '/r/RelatedTo', 'weight': 1.25}
+    ],
+    u'animal': [{'start': '/c/en/dog', 'end': '/c/en/animal', 'rel': '/r/IsA', 'weight': 2.0}],
+    u'bark': [{'start': '/c/en/dog', 'end': '/c/en/bark', 'rel': '/r/RelatedTo', 'weight': 1.5}],
+    u'joy': [{'start': '/c/en/cat', 'end': '/c/en/joy', 'rel': '/r/Desires', 'weight': 1.0}]
+}
+
+class GraphStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.dir)
+
+    def store(self, dump, req_limit=20):
+        path = os.path.join(self.dir, dump + '.graph')
+        n_concepts, n_edges = import_dump(os.path.join(DATA, dump), path)
+        self.assertEqual((n_concepts, n_edges), (len(EXPECTED), 2 * 5))
+        store = GraphStore(path, req_limit=req_limit)
+        self.stores.append(store)
+        return store
+
+    def assert_lookups(self, store):
+        for concept, edges in EXPECTED.items():
+            self.assertEqual(store.lookup('c', 'en', concept), {'numFound': len(edges), 'edges': edges})
+
+    def test_csv_dump(self):
+        # the CSV holds lines of ConceptNet 5.3 (weight column) and 5.5 (JSON column)
+        self.assert_lookups(self.store('assertions.csv'))
+
+    def test_json_dump(self):
+        self.assert_lookups(self.store('assertions.jsonl'))
+
+    def test_binary_search(self):
+        store = self.store('assertions.csv')
+        # every name is found at its position in the sorted table
+        for i in range(store.n_concepts):
+            lang_code, name = store.concept_name(i).split('/', 1)
+            self.assertEqual(store.concept_id(lang_code, name), i)
+        self.assertIsNone(store.concept_id('en', u'hund'))
+        self.assertIsNone(store.concept_id('de', u'hund'))
+        self.assertIsNone(store.concept_id('en', u'a'))
+        self.assertIsNone(store.concept_id('en', u'zzz'))
+
+    def test_unknown_concept(self):
+        self.assertEqual(self.store('assertions.csv').lookup('c', 'en', u'fox'), {'numFound': 0, 'edges': []})
+
+    def test_req_limit(self):
+        store = self.store('assertions.csv', req_limit=2)
+        self.assertEqual(store.lookup('c', 'en', u'Dog')['edges'], EXPECTED[u'dog'][:2])
+
+if __name__ == '__main__':
+    unittest.main()
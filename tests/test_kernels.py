@@ -0,0 +1,56 @@
+"""
+Tests the interpolation kernels' handling of their parameters.
+"""
+import unittest
+
+import numpy as np
+
+from ..models.kernels import BoxKernel
+from ..models.kernels import GaussianKernel
+
+def variance(kernel):
+    # the variance of the kernel's response to a single word
+    radius = kernel.radius()
+    matrix = np.zeros((2 * radius + 1, 1))
+    matrix[radius] = 1
+    weights = kernel.filter(matrix)[:, 0]
+    weights = weights / weights.sum()
+    offsets = np.arange(-radius, radius + 1)
+    return (weights * offsets * offsets).sum()
+
+def box_variance(radius, passes):
+    # a box of width w has the variance (w^2 - 1) / 12
+    return passes * ((2 * radius + 1) ** 2 - 1) / 12.0
+
+class BoxKernelTest(unittest.TestCase):
+
+    def test_averages_width_words(self):
+        matrix = np.arange(7, dtype=float).reshape(7, 1)
+        # the sums of the 5 rows centered on every row, rows outside of the matrix count as 0
+        self.assertEqual(BoxKernel(5).filter(matrix)[:, 0].tolist(), [3, 6, 10, 15, 20, 18, 15])
+
+    def test_rejects_even_widths(self):
+        for width in (0, 2, 4):
+            with self.assertRaises(Exception):
+                BoxKernel(width)
+
+class GaussianKernelTest(unittest.TestCase):
+
+    def test_variance_of_odd_widths(self):
+        # sigmas whose boxes have an odd width are approximated exactly
+        for width in (3, 5, 7, 9):
+            sigma = np.sqrt(3 * (width * width - 1) / 12.0)
+            kernel = GaussianKernel(sigma, passes=3)
+            self.assertEqual(2 * kernel.box_radius + 1, width)
+            self.assertAlmostEqual(variance(kernel), sigma * sigma)
+
+    def test_variance(self):
+        for sigma in (1.5, 2, 3, 4, 5, 7, 10):
+            kernel = GaussianKernel(sigma, passes=3)
+            self.assertAlmostEqual(variance(kernel), box_variance(kernel.box_radius, 3))
+            # the box is the closest to sigma the width can be rounded to
+            self.assertLessEqual(box_variance(kernel.box_radius - 1, 3), sigma * sigma)
+            self.assertGreaterEqual(box_variance(kernel.box_radius + 1, 3), sigma * sigma)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Tests that a RecordingClient records lookups and counts its failures like any other lookup.
+"""
+import unittest
+
+from requests.exceptions import HTTPError
+
+from ..apis.concept_net_client import lookup_failures
+from ..apis.subgraph_cache import RecordingClient
+from ..benchmarks.fixture import FixtureServer
+from ..benchmarks.fixture import synthetic_fixture
+from ..utils.circuit_breaker import CircuitBreaker
+
+FIXTURE = synthetic_fixture(concepts=20, edges=80)
+
+class RecordingClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FixtureServer(FIXTURE).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def assert_counts_failures(self, req_limit):
+        client = RecordingClient(self.server.client(req_limit=req_limit, retries=0, breaker=CircuitBreaker(0, 0)))
+        self.server.fail(404)
+        failures = lookup_failures()
+        with self.assertRaises(HTTPError):
+            client.lookup('c', 'en', u'w1')
+        self.assertEqual(client.failures, 1)
+        self.assertEqual(lookup_failures(), failures + 1)
+        res = client.lookup('c', 'en', u'W1')
+        self.assertEqual(res['edges'], FIXTURE['en/w1']['edges'][:req_limit])
+        self.assertEqual(client.results[u'w1']['edges'], res['edges'])
+
+    def test_counts_failures(self):
+        self.assert_counts_failures(5)
+
+    def test_counts_failures_of_other_limits(self):
+        # a limit the edge cache does not hold
+        self.assert_counts_failures(3)
+
+if __name__ == '__main__':
+    unittest.main()
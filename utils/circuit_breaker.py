@@ -0,0 +1,72 @@
+"""
+Stops calling a backend that keeps failing.
+
+If ConceptNet is down or overloaded, every lookup of every search waits for its timeout.
+A CircuitBreaker counts consecutive failures instead. Once there are threshold of them,
+it opens and calls fail right away with a CircuitOpenError. After reset_timeout seconds,
+a single trial call is let through: if it succeeds, the breaker closes again, otherwise
+it stays open for another reset_timeout seconds. A trial that never reports back is
+replaced by another one after reset_timeout seconds as well.
+"""
+import time
+
+from threading import Lock
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker(object):
+    """
+    A thread-safe circuit breaker. A threshold of 0 never opens it.
+    """
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        # the time the breaker opened at, None while it is closed
+        self.opened_at = None
+        self.trial = False
+        # the time the trial call was let through at
+        self.trial_at = None
+        self.lock = Lock()
+
+    def check(self):
+        """
+        Raises a CircuitOpenError, unless a call may be made.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.time()
+            if now - (self.trial_at if self.trial else self.opened_at) >= self.reset_timeout:
+                # half-open, only this call is let through until it succeeded or failed
+                self.trial = True
+                self.trial_at = now
+                return
+        raise CircuitOpenError('ConceptNet failed %d times in a row, not retrying for %.0f seconds.' \
+            % (self.failures, self.reset_timeout))
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.opened_at is not None or (self.threshold > 0 and self.failures >= self.threshold):
+                self.opened_at = time.time()
+
+    def state(self):
+        """
+        Returns 'closed', 'open' or 'half-open'.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if self.trial else 'open'
+
+    def __repr__(self):
+        return str(self.__dict__)
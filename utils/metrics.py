@@ -0,0 +1,212 @@
+"""
+Metrics of emotext's hot paths, e.g. the graph search, the caches and text processing.
+
+Instrumented code reports to the shared MetricsSink returned by get_metrics,
+which is selected by its name using SINK in config.cfg:
+
+    * null: ignores everything (the default); and
+    * memory: keeps counters and summaries in memory, which can be dumped in
+      Prometheus' text format (see MemorySink.dump).
+
+Instrumented code checks whether the sink is enabled before taking any measurements,
+so disabled metrics cost little more than an attribute lookup.
+"""
+import time
+
+from threading import Lock
+
+from .utils import get_config
+
+SINK = get_config('metrics', 'SINK', 'get', 'null')
+# Prefix of every metric's name in a dump
+PREFIX = 'emotext_'
+
+# maps the name of every sink to its class
+SINKS = {}
+
+class MetricsSink(object):
+    """
+    Receives metrics. Subclasses set name and implement increment and observe.
+    """
+    name = None
+    # whether instrumented code takes measurements at all
+    enabled = False
+
+    def increment(self, name, value=1, labels=None):
+        """
+        Adds value to a counter.
+        """
+        raise NotImplementedError()
+
+    def observe(self, name, value, labels=None):
+        """
+        Records a single observation, e.g. a duration in seconds or a size.
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+class NullSink(MetricsSink):
+    """
+    Ignores all metrics.
+    """
+    name = 'null'
+
+    def increment(self, name, value=1, labels=None):
+        pass
+
+    def observe(self, name, value, labels=None):
+        pass
+
+class MemorySink(MetricsSink):
+    """
+    Keeps a counter per metric and set of labels, and a summary (count, sum, min and max)
+    of the observations of every other metric.
+    """
+    name = 'memory'
+    enabled = True
+
+    def __init__(self):
+        self.counters = {}
+        self.summaries = {}
+        self.lock = Lock()
+
+    def increment(self, name, value=1, labels=None):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.summaries[key] = [1, value, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = min(summary[2], value)
+                summary[3] = max(summary[3], value)
+
+    def counter(self, name, labels=None):
+        return self.counters.get((name, _label_key(labels)), 0)
+
+    def summary(self, name, labels=None):
+        """
+        Returns a dictionary of the count, sum, min and max of a metric's observations.
+        """
+        count, total, minimum, maximum = self.summaries.get((name, _label_key(labels)), (0, 0, 0, 0))
+        return {
+            'count': count,
+            'sum': total,
+            'min': minimum,
+            'max': maximum
+        }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.summaries.clear()
+
+    def dump(self):
+        """
+        Returns all metrics in Prometheus' text format.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            summaries = sorted((k, list(v)) for k, v in self.summaries.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            _append_sample(lines, typed, name, 'counter', labels, value)
+        # min and max are no part of a Prometheus summary, hence they are gauges of their own
+        for suffix, kind, column in (('', 'summary', None), ('_min', 'gauge', 2), ('_max', 'gauge', 3)):
+            for (name, labels), summary in summaries:
+                if column is None:
+                    _append_sample(lines, typed, name, kind, labels, summary[0], '_count')
+                    _append_sample(lines, typed, name, kind, labels, summary[1], '_sum')
+                else:
+                    _append_sample(lines, typed, name + suffix, kind, labels, summary[column])
+        return '\n'.join(lines) + '\n'
+
+class Stopwatch(object):
+    """
+    Observes the durations of consecutive stages as one metric, labelled by stage.
+    """
+    def __init__(self, sink, name, label='stage'):
+        self.sink = sink
+        self.name = name
+        self.label = label
+        self.last = time.time()
+
+    def lap(self, stage):
+        """
+        Observes the time since the previous lap (or the start) as the duration of a stage.
+        """
+        now = time.time()
+        self.sink.observe(self.name, now - self.last, {self.label: stage})
+        self.last = now
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def _append_sample(lines, typed, name, kind, labels, value, suffix=''):
+    # every family is typed once, right before its first sample
+    if name not in typed:
+        typed.add(name)
+        lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+    lines.append('%s%s%s%s %s' % (PREFIX, name, suffix, _format_labels(labels), _format_value(value)))
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def register_sink(sink_class):
+    """
+    Makes a MetricsSink selectable by its name.
+    """
+    SINKS[sink_class.name] = sink_class
+    return sink_class
+
+def get_sink(name=SINK, **kwargs):
+    """
+    Instantiates a registered MetricsSink by its name.
+    """
+    try:
+        return SINKS[name](**kwargs)
+    except KeyError:
+        raise Exception('Unknown metrics sink: %s' % name)
+
+register_sink(NullSink)
+register_sink(MemorySink)
+
+_sink = None
+_sink_lock = Lock()
+
+def get_metrics():
+    """
+    Returns the sink that all instrumented code reports to.
+    """
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = get_sink()
+    return _sink
+
+def set_metrics(sink):
+    """
+    Replaces the shared sink, e.g. by a MemorySink while benchmarking.
+    """
+    global _sink
+    _sink = sink
@@ -0,0 +1,71 @@
+"""
+Deduplicates concurrent calls that would do the same work.
+
+Threads of several conversations, or batches of concurrent server requests, often
+look up the same concept or search the same uncached word at the same moment.
+A SingleFlight lets the first caller of a key do the work, while every later caller
+of the same key waits for its result (or its exception) instead of repeating it.
+Once the call is done, the key is forgotten, so results are not cached.
+"""
+import sys
+
+from threading import Lock
+
+from concurrent.futures import Future
+
+from .metrics import get_metrics
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time and shares its outcome with everyone waiting for it.
+    """
+    def __init__(self, name):
+        # labels the metrics of this instance
+        self.name = name
+        self.calls = {}
+        self.lock = Lock()
+        self.shared = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Returns function(*args, **kwargs), unless a call of the same key is already running.
+        In that case, its result is returned or its exception is raised.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            metrics = get_metrics()
+            if metrics.enabled:
+                metrics.increment('single_flight_shared_total', labels={'flight': self.name})
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except:
+            # KeyboardInterrupt and the like must not leave waiting callers hanging either
+            future.set_exception(sys.exc_info()[1])
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def reset(self):
+        """
+        Forgets every running call. A forked process must do so, as the threads running
+        the calls of its parent (and maybe holding the lock) do not exist in it.
+        """
+        self.calls = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __repr__(self):
+        return str(self.__dict__)
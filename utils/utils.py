@@ -1,6 +1,9 @@
 import ConfigParser
 import os
 
+# Tells a missing default apart from falsy defaults such as False, 0 or None
+_NO_DEFAULT = object()
+
 def extr_from_concept_net_edge(s):
     """
     ConceptNet returnes on lookup edges that are named in this fashion:
@@ -21,10 +24,13 @@ def extr_from_concept_net_edge(s):
         'name': params_list[3]
     }
 
-def get_config(section, key, method_name='get'):
+def get_config(section, key, method_name='get', default=_NO_DEFAULT):
     """
     Reads the 'config.cfg' file in the root directory and allows
     to select specific values from it that will - if found - be returned.
+
+    Optional settings can pass a default, which is returned silently
+    if the key is missing.
     """
     config_parser = ConfigParser.ConfigParser()
     config_parser.readfp(open(os.path.dirname(os.path.abspath(__file__)) + r'/../config.cfg'))
@@ -36,5 +42,7 @@ def get_config(section, key, method_name='get'):
         else:
             return getattr(config_parser, method_name)(section, key)
     except:
+        if default is not _NO_DEFAULT:
+            return default
         print 'Combination of section and key has not been found in config.cfg file.'
         return None
\ No newline at end of file